@@ -19,6 +19,33 @@ def create_app():
 
     app.mongo = mongo
 
+    # --- ÍNDICES DE LECTURA ---
+    try:
+        from database import asegurar_indices_clasificaciones
+        asegurar_indices_clasificaciones(mongo.db)
+    except Exception as e:
+        print(f"⚠️ No se pudieron crear los índices de clasificaciones: {e}")
+
+    try:
+        from database import asegurar_indices_registro_comida
+        asegurar_indices_registro_comida(mongo.db)
+    except Exception as e:
+        print(f"⚠️ No se pudieron crear los índices de registro_comida: {e}")
+
+    # --- MOTOR DE UMBRALES (evalúa cada lectura de /api/sensores) ---
+    try:
+        from .umbrales import iniciar_motor
+        iniciar_motor(mongo.db)
+    except Exception as e:
+        print(f"⚠️ No se pudo iniciar el motor de umbrales: {e}")
+
+    # --- DETECTOR DE ANOMALÍAS EN STREAMING ---
+    try:
+        from .anomalias import iniciar_detector
+        iniciar_detector(mongo.db)
+    except Exception as e:
+        print(f"⚠️ No se pudo iniciar el detector de anomalías: {e}")
+
     # --- INICIAR SERVICIO DE CLASIFICACIONES ---
     try:
         from . import servicio_clasificaciones
@@ -0,0 +1,235 @@
+import queue
+import threading
+import os
+import requests
+from requests.adapters import HTTPAdapter
+from tenacity import Retrying, retry_if_exception_type, stop_after_attempt, wait_exponential
+
+# Telegram
+BOT_TOKEN = os.environ.get("BOT_TOKEN")
+CHAT_ID = os.environ.get("CHAT_ID")
+
+# Configuración del despachador
+ALERTAS_SINK = os.environ.get("ALERTAS_SINK", "telegram")  # telegram | consola
+ALERTAS_MAX_COLA = int(os.environ.get("ALERTAS_MAX_COLA", "100"))
+ALERTAS_REINTENTOS = int(os.environ.get("ALERTAS_REINTENTOS", "5"))
+ALERTAS_ESPERA_MAX = float(os.environ.get("ALERTAS_ESPERA_MAX", "60"))
+
+# Telegram no acepta mensajes de más de 4096 caracteres
+LARGO_MAX_MENSAJE = 4000
+
+# ====================================================
+# DESTINOS (SINKS) DE ALERTAS
+# ====================================================
+class ErrorTransitorio(Exception):
+    """El destino no puede recibir el mensaje ahora (HTTP 5xx o 429); `espera` son los segundos que pide esperar"""
+
+    def __init__(self, mensaje, espera=None):
+        super().__init__(mensaje)
+        self.espera = espera
+
+# Solo estos errores se reintentan; un 4xx (token o chat inválido, mensaje rechazado) no se arregla reintentando
+ERRORES_REINTENTABLES = (ErrorTransitorio, ConnectionError, requests.ConnectionError, requests.Timeout)
+
+class SinkTelegram:
+    """Envía mensajes al chat de Telegram reutilizando conexiones HTTP"""
+
+    def __init__(self, token, chat_id, timeout=5):
+        self.url = f"https://api.telegram.org/bot{token}/sendMessage"
+        self.chat_id = chat_id
+        self.timeout = timeout
+        self.sesion = requests.Session()
+        self.sesion.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=2))
+
+    def _publicar(self, mensaje, parse_mode=None):
+        datos = {"chat_id": self.chat_id, "text": mensaje}
+        if parse_mode:
+            datos["parse_mode"] = parse_mode
+        respuesta = self.sesion.post(self.url, data=datos, timeout=self.timeout)
+        if respuesta.status_code == 429:
+            # Límite de envíos: Telegram indica cuánto esperar en "retry_after"
+            try:
+                espera = respuesta.json().get("parameters", {}).get("retry_after")
+            except ValueError:
+                espera = None
+            if espera is None and respuesta.headers.get("Retry-After", "").isdigit():
+                espera = int(respuesta.headers["Retry-After"])
+            raise ErrorTransitorio("HTTP 429", espera)
+        if respuesta.status_code >= 500:
+            raise ErrorTransitorio(f"HTTP {respuesta.status_code}")
+        return respuesta
+
+    def enviar(self, mensaje):
+        respuesta = self._publicar(mensaje, "Markdown")
+        if respuesta.status_code == 400:
+            # Markdown inválido (ej. un "_" o "*" sin cerrar al juntar varios mensajes): se envía como texto plano
+            respuesta = self._publicar(mensaje)
+        respuesta.raise_for_status()
+
+class SinkConsola:
+    """Imprime los mensajes en consola (útil en desarrollo o sin credenciales)"""
+
+    def enviar(self, mensaje):
+        print(f"📨 [consola] {mensaje}")
+
+class SinkMemoria:
+    """Guarda los mensajes en una lista, para reemplazar a Telegram en pruebas"""
+
+    def __init__(self, fallar_veces=0):
+        self.mensajes = []
+        self.fallar_veces = fallar_veces
+
+    def enviar(self, mensaje):
+        if self.fallar_veces > 0:
+            self.fallar_veces -= 1
+            raise ConnectionError("Fallo simulado")
+        self.mensajes.append(mensaje)
+
+def crear_sink(tipo=None):
+    """Crea el destino configurado; sin BOT_TOKEN o CHAT_ID se usa la consola"""
+    tipo = tipo or ALERTAS_SINK
+    if tipo == "telegram":
+        if BOT_TOKEN and CHAT_ID:
+            return SinkTelegram(BOT_TOKEN, CHAT_ID)
+        print("⚠️ Faltan BOT_TOKEN o CHAT_ID, las alertas se mostrarán solo en consola")
+        return SinkConsola()
+    if tipo == "consola":
+        return SinkConsola()
+    raise ValueError(f"Destino de alertas desconocido: {tipo}")
+
+# ====================================================
+# DESPACHADOR EN SEGUNDO PLANO
+# ====================================================
+class DespachadorAlertas:
+    """Cola acotada de alertas que un hilo envía al sink con reintentos y backoff.
+
+    `encolar` nunca bloquea: si la cola está llena la alerta se descarta y se cuenta.
+    Los mensajes que se acumulan mientras se reintenta un envío se agrupan en uno solo.
+    Solo se reintentan los errores de red, HTTP 5xx y 429 (respetando la espera que pide el destino).
+    """
+
+    def __init__(self, sink, max_cola=ALERTAS_MAX_COLA, reintentos=ALERTAS_REINTENTOS,
+                 espera_max=ALERTAS_ESPERA_MAX):
+        self.sink = sink
+        self.cola = queue.Queue(maxsize=max_cola)
+        self.reintentos = reintentos
+        self.espera_max = espera_max
+        self.enviadas = 0
+        self.fallidas = 0
+        self.descartadas = 0
+        # Mensaje que no cupo en el último lote; encabeza el siguiente
+        self._sobrante = None
+        self._backoff = wait_exponential(multiplier=1, max=espera_max)
+        self._hilo = None
+        self._detener = threading.Event()
+
+    def iniciar(self):
+        if self._hilo is None or not self._hilo.is_alive():
+            self._detener.clear()
+            self._hilo = threading.Thread(target=self._trabajar, name="despachador_alertas", daemon=True)
+            self._hilo.start()
+        return self
+
+    def detener(self, timeout=None):
+        """Envía lo pendiente y detiene el hilo"""
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout)
+
+    def encolar(self, mensaje):
+        """Agrega una alerta a la cola sin bloquear; devuelve False si se descartó"""
+        try:
+            self.cola.put_nowait(mensaje)
+            return True
+        except queue.Full:
+            self.descartadas += 1
+            print(f"⚠️ Cola de alertas llena, alerta descartada ({self.descartadas} en total)")
+            return False
+
+    def esperar(self):
+        """Bloquea hasta que se procesen todas las alertas encoladas"""
+        self.cola.join()
+
+    def _tomar_lote(self, primero):
+        """Junta el primer mensaje con los pendientes en la cola, sin pasar el largo máximo"""
+        mensajes = [primero]
+        largo = len(primero)
+        while True:
+            try:
+                siguiente = self.cola.get_nowait()
+            except queue.Empty:
+                break
+            if largo + len(siguiente) + 2 > LARGO_MAX_MENSAJE:
+                # No cabe: queda aparte (sin volver a la cola, que puede estar llena) para el siguiente lote
+                self._sobrante = siguiente
+                break
+            mensajes.append(siguiente)
+            largo += len(siguiente) + 2
+        return mensajes
+
+    def _espera(self, estado):
+        # Espera entre reintentos: la que pide el destino, o backoff exponencial
+        espera = getattr(estado.outcome.exception(), "espera", None)
+        return espera if espera is not None else self._backoff(estado)
+
+    def _trabajar(self):
+        while not (self._detener.is_set() and self.cola.empty() and self._sobrante is None):
+            if self._sobrante is not None:
+                primero, self._sobrante = self._sobrante, None
+            else:
+                try:
+                    primero = self.cola.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+
+            mensajes = self._tomar_lote(primero)
+            texto = "\n\n".join(mensajes)
+            try:
+                for intento in Retrying(
+                    stop=stop_after_attempt(self.reintentos),
+                    wait=self._espera,
+                    retry=retry_if_exception_type(ERRORES_REINTENTABLES),
+                    reraise=True
+                ):
+                    with intento:
+                        self.sink.enviar(texto)
+                self.enviadas += len(mensajes)
+                print(f"📨 Alerta enviada ({len(mensajes)} mensaje(s) agrupados)")
+            except Exception as e:
+                self.fallidas += len(mensajes)
+                print(f"❌ Error enviando alerta: {e}")
+            finally:
+                for _ in mensajes:
+                    self.cola.task_done()
+
+    def estado(self):
+        return {
+            "pendientes": self.cola.qsize() + (self._sobrante is not None),
+            "enviadas": self.enviadas,
+            "fallidas": self.fallidas,
+            "descartadas": self.descartadas,
+        }
+
+# Despachador compartido por el proceso (se crea al primer uso)
+_despachador = None
+_lock = threading.Lock()
+
+def obtener_despachador():
+    global _despachador
+    with _lock:
+        if _despachador is None:
+            _despachador = DespachadorAlertas(crear_sink()).iniciar()
+    return _despachador
+
+def configurar_despachador(despachador):
+    """Reemplaza el despachador compartido (por ejemplo, por uno con SinkMemoria en pruebas)"""
+    global _despachador
+    with _lock:
+        if _despachador is not None and _despachador is not despachador:
+            _despachador.detener(timeout=1)
+        _despachador = despachador.iniciar()
+    return _despachador
+
+def enviar_alerta(mensaje):
+    """Encola una alerta para envío en segundo plano (no bloquea)"""
+    return obtener_despachador().encolar(mensaje)
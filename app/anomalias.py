@@ -0,0 +1,322 @@
+"""
+Detección de anomalías en streaming por (dispositivo, variable).
+
+Cada serie ocupa una fila de una tabla de arreglos NumPy (media y varianza EWMA,
+último valor y tiempo, contador de valores repetidos), así que la memoria por
+serie es constante y una lectura se evalúa sin consultar la base de datos. Las
+anomalías se acumulan en memoria y una tarea periódica las escribe en la
+colección `anomalias`.
+
+Se detectan tres tipos:
+- pico: el valor se aleja más de ANOMALIAS_Z desviaciones de la media EWMA
+- cambio_brusco: la variación por minuto supera la máxima de la variable
+- valor_congelado: el sensor repite el mismo valor ANOMALIAS_REPETICIONES veces
+
+Reproducción de historial (desde la raíz del repo):
+    python -m app.anomalias --dominio dominio_terreno --desde 2025-01-01 --hasta 2025-03-31
+"""
+import argparse
+import os
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from pymongo import MongoClient, DESCENDING
+
+from planificador import programar
+
+# Configuración
+ANOMALIAS_ALFA = float(os.environ.get("ANOMALIAS_ALFA", "0.1"))             # Peso de la lectura nueva en la EWMA
+ANOMALIAS_Z = float(os.environ.get("ANOMALIAS_Z", "4"))
+ANOMALIAS_MIN_MUESTRAS = int(os.environ.get("ANOMALIAS_MIN_MUESTRAS", "10"))  # Lecturas antes de evaluar picos
+ANOMALIAS_REPETICIONES = int(os.environ.get("ANOMALIAS_REPETICIONES", "20"))
+ANOMALIAS_FLUSH_S = int(os.environ.get("ANOMALIAS_FLUSH_S", "10"))
+ANOMALIAS_MAX_BUFFER = int(os.environ.get("ANOMALIAS_MAX_BUFFER", "10000"))
+COLECCION_ANOMALIAS = "anomalias"
+
+# Variación máxima esperable por minuto de cada variable
+TASA_MAXIMA = {
+    "temperatura": 2.0,
+    "ph": 0.5,
+    "oxigeno": 3.0,
+    "luz": 2000.0
+}
+VARIABLES = tuple(TASA_MAXIMA)
+
+# Diferencia por debajo de la cual dos lecturas se consideran el mismo valor
+EPSILON_REPETIDO = 1e-9
+
+# Los tiempos de MongoDB son UTC sin zona horaria
+EPOCA = datetime(1970, 1, 1)
+
+def valor_numerico(valor):
+    """Valor de una variable como float, o None si no se evalúa.
+
+    Igual que al leer las lecturas (pd.to_numeric), un texto numérico ("7.1") cuenta como número;
+    los booleanos, los textos no numéricos, NaN e infinito no se evalúan. Lo usan el modo streaming
+    y el de lote, para que ambos vean exactamente los mismos valores.
+    """
+    if valor is None or isinstance(valor, (bool, np.bool_)):
+        return None
+    try:
+        valor = float(valor)
+    except (TypeError, ValueError):
+        return None
+    return valor if np.isfinite(valor) else None
+
+def valores_numericos(serie):
+    """valor_numerico sobre una columna (NaN donde no hay valor); sin recorrerla si ya es numérica"""
+    if pd.api.types.is_bool_dtype(serie):
+        return pd.Series(np.nan, index=serie.index)
+    if pd.api.types.is_numeric_dtype(serie):
+        valores = serie.astype(float)
+    else:
+        valores = serie.map(valor_numerico).astype(float)
+    return valores.where(np.isfinite(valores))
+
+# ====================================================
+# TABLA DE ESTADOS
+# ====================================================
+class DetectorAnomalias:
+    """Estado EWMA por serie en arreglos contiguos, con una fila por (dominio, dispositivo, variable)"""
+
+    def __init__(self, capacidad=1024, alfa=ANOMALIAS_ALFA, umbral_z=ANOMALIAS_Z,
+                 min_muestras=ANOMALIAS_MIN_MUESTRAS, repeticiones=ANOMALIAS_REPETICIONES,
+                 max_buffer=ANOMALIAS_MAX_BUFFER):
+        self.alfa = alfa
+        self.umbral_z = umbral_z
+        self.min_muestras = min_muestras
+        self.repeticiones = repeticiones
+
+        self._filas = {}        # (dominio, dispositivo, variable) -> fila
+        self._claves = []       # fila -> (dominio, dispositivo, variable)
+        self.n = np.zeros(capacidad, dtype=np.int64)
+        self.media = np.zeros(capacidad)
+        self.varianza = np.zeros(capacidad)
+        self.ultimo = np.zeros(capacidad)
+        self.t_ultimo = np.zeros(capacidad)           # Segundos desde la época
+        self.repetidos = np.zeros(capacidad, dtype=np.int64)
+        self.tasa_maxima = np.zeros(capacidad)
+
+        self.pendientes = deque(maxlen=max_buffer)    # Anomalías aún no escritas
+        self.detectadas = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._claves)
+
+    def _crecer(self):
+        for nombre in ("n", "media", "varianza", "ultimo", "t_ultimo", "repetidos", "tasa_maxima"):
+            arreglo = getattr(self, nombre)
+            nuevo = np.zeros(len(arreglo) * 2, dtype=arreglo.dtype)
+            nuevo[:len(arreglo)] = arreglo
+            setattr(self, nombre, nuevo)
+
+    def fila(self, dominio, disp, variable):
+        clave = (dominio, disp, variable)
+        fila = self._filas.get(clave)
+        if fila is None:
+            fila = len(self._claves)
+            if fila == len(self.n):
+                self._crecer()
+            self._filas[clave] = fila
+            self._claves.append(clave)
+            self.tasa_maxima[fila] = TASA_MAXIMA.get(variable, np.inf)
+        return fila
+
+    # --- ACTUALIZACIÓN VECTORIZADA ---
+    def _actualizar(self, filas, valores, tiempos):
+        """Evalúa y actualiza varias series a la vez (cada fila aparece una sola vez).
+
+        Devuelve un arreglo con el tipo de anomalía por lectura ("" si no hay) y la media,
+        desviación, z y tasa por minuto calculadas antes de incorporar la lectura.
+        """
+        n = self.n[filas]
+        media = self.media[filas]
+        desviacion = np.sqrt(self.varianza[filas])
+        previas = n > 0
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            z = np.where(desviacion > 0, np.abs(valores - media) / desviacion, 0.0)
+            minutos = (tiempos - self.t_ultimo[filas]) / 60
+            delta = np.abs(valores - self.ultimo[filas])
+            tasa = np.where(previas & (minutos > 0), delta / minutos, 0.0)
+
+        repetidos = np.where(previas & (delta <= EPSILON_REPETIDO), self.repetidos[filas] + 1, 0)
+
+        tipos = np.full(len(filas), "", dtype=object)
+        tipos[repetidos == self.repeticiones] = "valor_congelado"
+        tipos[tasa > self.tasa_maxima[filas]] = "cambio_brusco"
+        tipos[(n >= self.min_muestras) & (z > self.umbral_z)] = "pico"
+
+        # EWMA de media y varianza (la primera lectura inicializa la media)
+        diferencia = valores - media
+        incremento = self.alfa * diferencia
+        self.media[filas] = np.where(previas, media + incremento, valores)
+        self.varianza[filas] = np.where(previas, (1 - self.alfa) * (self.varianza[filas] + diferencia * incremento), 0.0)
+        self.n[filas] = n + 1
+        self.ultimo[filas] = valores
+        self.t_ultimo[filas] = tiempos
+        self.repetidos[filas] = repetidos
+
+        return tipos, media, desviacion, z, tasa
+
+    def _registrar(self, filas, valores, tiempos, resultado, origen):
+        tipos, media, desviacion, z, tasa = resultado
+        anomalias = []
+        for i in np.flatnonzero(tipos != ""):
+            dominio, disp, variable = self._claves[filas[i]]
+            anomalias.append({
+                "dominio": dominio,
+                "id_dispositivo": disp,
+                "variable": variable,
+                "tipo": tipos[i],
+                "valor": float(valores[i]),
+                "media": float(media[i]),
+                "desviacion": float(desviacion[i]),
+                "z": float(z[i]),
+                "tasa_por_min": float(tasa[i]),
+                "tiempo": datetime.utcfromtimestamp(tiempos[i]),
+                "origen": origen,
+            })
+        self.detectadas += len(anomalias)
+        return anomalias
+
+    # --- MODO STREAMING ---
+    def procesar(self, dominio, lectura):
+        """Evalúa una lectura de /api/sensores; las anomalías quedan pendientes de escritura"""
+        disp = lectura.get("id_dispositivo")
+        tiempo = lectura.get("tiempo")
+        tiempo = ((tiempo if isinstance(tiempo, datetime) else datetime.utcnow()) - EPOCA).total_seconds()
+        numeros = {v: valor_numerico(lectura.get(v)) for v in VARIABLES}
+        variables = [v for v in VARIABLES if numeros[v] is not None]
+        if not variables:
+            return []
+
+        with self._lock:
+            filas = np.array([self.fila(dominio, disp, v) for v in variables])
+            valores = np.array([numeros[v] for v in variables])
+            tiempos = np.full(len(filas), tiempo)
+            anomalias = self._registrar(filas, valores, tiempos, self._actualizar(filas, valores, tiempos), "tiempo_real")
+            self.pendientes.extend(anomalias)
+        return anomalias
+
+    def vaciar(self, col_anomalias):
+        """Escribe las anomalías pendientes con un insert_many no ordenado"""
+        with self._lock:
+            lote = list(self.pendientes)
+            self.pendientes.clear()
+        if lote:
+            try:
+                col_anomalias.insert_many(lote, ordered=False)
+            except Exception:
+                with self._lock:
+                    self.pendientes.extendleft(reversed(lote))
+                raise
+        return len(lote)
+
+    # --- MODO LOTE (REPRODUCCIÓN DE HISTORIAL) ---
+    def procesar_lote(self, dominio, df, origen="reproduccion"):
+        """Reproduce un historial (id_dispositivo, tiempo, variables...) y devuelve sus anomalías.
+
+        Las lecturas se ordenan por tiempo dentro de cada serie; en el paso k se procesa la
+        k-ésima lectura de todas las series a la vez, con las mismas reglas que en streaming.
+        """
+        variables = [v for v in VARIABLES if v in df.columns]
+        largo = df.melt(id_vars=["id_dispositivo", "tiempo"], value_vars=variables,
+                        var_name="variable", value_name="valor")
+        largo["valor"] = valores_numericos(largo["valor"])
+        largo = largo[largo["valor"].notna()]
+        if largo.empty:
+            return []
+
+        largo = largo.sort_values("tiempo", kind="stable")
+        with self._lock:
+            claves = list(zip(largo["id_dispositivo"], largo["variable"]))
+            filas = np.array([self.fila(dominio, disp, v) for disp, v in claves])
+            valores = largo["valor"].to_numpy(dtype=float)
+            tiempos = pd.to_datetime(largo["tiempo"]).astype("int64").to_numpy() / 1e9
+            paso = largo.groupby(filas).cumcount().to_numpy()
+
+            orden = np.argsort(paso, kind="stable")
+            limites = np.flatnonzero(np.diff(paso[orden])) + 1
+            anomalias = []
+            for indices in np.split(orden, limites):
+                f, x, t = filas[indices], valores[indices], tiempos[indices]
+                anomalias.extend(self._registrar(f, x, t, self._actualizar(f, x, t), origen))
+        return anomalias
+
+    def estado(self):
+        return {
+            "series": len(self),
+            "pendientes": len(self.pendientes),
+            "detectadas": self.detectadas,
+        }
+
+# Detector compartido por el proceso de la API
+_detector = None
+
+def obtener_detector():
+    global _detector
+    if _detector is None:
+        _detector = DetectorAnomalias()
+    return _detector
+
+def asegurar_indices(db):
+    db[COLECCION_ANOMALIAS].create_index([("id_dispositivo", 1), ("tiempo", DESCENDING)])
+
+def iniciar_detector(db):
+    """Crea el detector y programa la escritura periódica de anomalías en MongoDB"""
+    detector = obtener_detector()
+    asegurar_indices(db)
+    programar("vaciar_anomalias", lambda: detector.vaciar(db[COLECCION_ANOMALIAS]), intervalo_s=ANOMALIAS_FLUSH_S)
+    return detector
+
+# ====================================================
+# REPRODUCCIÓN DESDE MONGODB
+# ====================================================
+def reproducir(db, dominio, desde=None, hasta=None):
+    """Recalcula las anomalías de un dominio y reemplaza las reproducidas antes en ese rango"""
+    filtro = {}
+    if desde or hasta:
+        filtro["tiempo"] = {}
+        if desde:
+            filtro["tiempo"]["$gte"] = desde
+        if hasta:
+            filtro["tiempo"]["$lt"] = hasta
+
+    proyeccion = {"_id": 0, "id_dispositivo": 1, "tiempo": 1, **{v: 1 for v in VARIABLES}}
+    df = pd.DataFrame(list(db[dominio].find(filtro, proyeccion)))
+    if df.empty:
+        print(f"⚠️ Sin datos en {dominio} para el rango indicado.")
+        return 0
+    df = df[df["tiempo"].notna()]
+
+    anomalias = DetectorAnomalias().procesar_lote(dominio, df)
+
+    col = db[COLECCION_ANOMALIAS]
+    col.delete_many({"dominio": dominio, "origen": "reproduccion", **filtro})
+    if anomalias:
+        col.insert_many(anomalias, ordered=False)
+    print(f"✔️ {len(anomalias)} anomalías en {len(df)} lecturas de {dominio}")
+    return len(anomalias)
+
+def _fecha(valor):
+    return datetime.strptime(valor, "%Y-%m-%d")
+
+def main():
+    parser = argparse.ArgumentParser(description="Reproduce el historial de un dominio y guarda sus anomalías")
+    parser.add_argument("--dominio", default="dominio_terreno", help="Colección de datos del dominio")
+    parser.add_argument("--desde", type=_fecha, help="Fecha inicial (YYYY-MM-DD, UTC)")
+    parser.add_argument("--hasta", type=lambda v: _fecha(v) + timedelta(days=1), help="Fecha final inclusiva (YYYY-MM-DD, UTC)")
+    args = parser.parse_args()
+
+    mongo_uri = os.environ.get("MONGO_URI")
+    if not mongo_uri:
+        raise RuntimeError("❌ No se encontró la variable de entorno MONGO_URI")
+    reproducir(MongoClient(mongo_uri)["biorreactor_app"], args.dominio, args.desde, args.hasta)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+Reconstrucción histórica de clasificaciones de fase (backfill).
+
+Desliza la ventana de 48 pasos sobre todo el historial de cada dispositivo,
+clasifica todas las ventanas en lotes grandes con el modelo ONNX y guarda los
+resultados en `clasificaciones` con escrituras `bulk_write` no ordenadas.
+Cada resultado se identifica por (dominio, id_dispositivo, fin_ventana), por lo que
+volver a ejecutar el backfill (por ejemplo tras actualizar el modelo)
+reemplaza las clasificaciones anteriores en lugar de duplicarlas, y dos dominios
+con un mismo id de dispositivo no se pisan.
+Los resultados llevan origen="backfill": las consultas de clasificaciones de la API
+y del dashboard muestran por defecto solo las del servicio (ver database.filtro_origen).
+
+Uso (desde la raíz del repo):
+    python -m app.backfill_clasificaciones
+    python -m app.backfill_clasificaciones --desde 2025-01-01 --hasta 2025-03-31 --procesos 4
+    python -m app.backfill_clasificaciones --dispositivos reactor_1 reactor_2
+"""
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from pymongo import ASCENDING, MongoClient, UpdateOne
+
+from . import servicio_clasificaciones as svc
+
+TAMANO_LOTE_ONNX = 4096
+TAMANO_LOTE_ESCRITURA = 1000
+
+# Cliente de MongoDB por proceso (se crea en el inicializador de cada worker)
+_client = None
+
+def _iniciar_worker(mongo_uri):
+    global _client
+    _client = MongoClient(mongo_uri)
+
+# ====================================================
+# CLASIFICACIÓN DE TODAS LAS VENTANAS
+# ====================================================
+def clasificar_ventanas(df, modelo, tam_lote=TAMANO_LOTE_ONNX):
+    """Clasifica todas las ventanas deslizantes de 48 filas; devuelve (fin_ventana, clases, probas, calidad)"""
+    if len(df) < svc.SEQ_LEN:
+        return [], np.empty(0, dtype=int), np.empty((0, 0), dtype=np.float32), []
+
+    # Las ventanas se arman como vista (sin copiar); cada lote se copia, se limpia y se escala
+    features = svc.matriz_features(df)
+    ventanas = sliding_window_view(features, svc.SEQ_LEN, axis=0).transpose(0, 2, 1)
+
+    indices, probas, calidad = [], [], []
+    for inicio in range(0, len(ventanas), tam_lote):
+        # Mismo criterio que el servicio: se descartan las ventanas con huecos demasiado largos
+        limpias, validas, calidad_lote = svc.limpiar_secuencias(ventanas[inicio:inicio + tam_lote])
+        if not validas.any():
+            continue
+        indices.append(inicio + np.flatnonzero(validas))
+        probas.append(svc.inferir(modelo.sesion, svc.escalar_lote(limpias[validas], modelo.scaler)))
+        calidad.extend(svc.calidad_a_dict(c) for c in calidad_lote[validas])
+
+    if not probas:
+        return [], np.empty(0, dtype=int), np.empty((0, 0), dtype=np.float32), []
+    indices = np.concatenate(indices)
+    probas = np.concatenate(probas)
+
+    tiempos_fin = df["tiempo"].to_numpy()[indices + svc.SEQ_LEN - 1]
+    return tiempos_fin, probas.argmax(axis=1), probas, calidad
+
+def nombres_fases(clases, encoder):
+    """Traduce los índices de clase a nombres de fase con el label encoder"""
+    if len(clases) == 0:
+        return []
+    try:
+        return encoder.inverse_transform(clases).tolist()
+    except Exception:
+        return [str(c) for c in clases]
+
+# ====================================================
+# TRABAJO POR DISPOSITIVO (se ejecuta en un proceso del pool)
+# ====================================================
+def backfill_dispositivo(disp, coleccion, desde=None, hasta=None, tam_lote=TAMANO_LOTE_ONNX):
+    """Lee el historial de un dispositivo, clasifica todas sus ventanas y escribe los resultados"""
+    t0 = time.perf_counter()
+    db = _client[svc.DB_NAME]
+
+    filtro = {"id_dispositivo": disp}
+    if desde or hasta:
+        filtro["tiempo"] = {}
+        if desde:
+            filtro["tiempo"]["$gte"] = desde
+        if hasta:
+            filtro["tiempo"]["$lt"] = hasta
+
+    cursor = db[coleccion].find(
+        filtro, {"_id": 0, "tiempo": 1, "ph": 1, "oxigeno": 1}
+    ).sort("tiempo", 1)
+    df = pd.DataFrame(list(cursor), columns=["tiempo", "ph", "oxigeno"])
+    df = df[df["tiempo"].notna()]
+    df["tiempo"] = pd.to_datetime(df["tiempo"])
+
+    modelo = svc.CATALOGO.modelo(coleccion)
+    tiempos_fin, clases, probas, calidad = clasificar_ventanas(df, modelo, tam_lote)
+    fases = nombres_fases(clases, modelo.encoder)
+
+    ahora = datetime.utcnow()
+    operaciones = []
+    escritos = 0
+    for fin, fase, proba, calidad_ventana in zip(tiempos_fin, fases, probas, calidad):
+        fin = pd.Timestamp(fin).to_pydatetime()
+        operaciones.append(UpdateOne(
+            {"dominio": coleccion, "id_dispositivo": disp, "fin_ventana": fin},
+            {"$set": {
+                "fase": fase,
+                "proba": proba.tolist(),
+                "timestamp": fin,
+                "origen": "backfill",
+                "version_modelo": modelo.version,
+                "calidad": calidad_ventana,
+                "fecha_backfill": ahora,
+            }},
+            upsert=True
+        ))
+        if len(operaciones) >= TAMANO_LOTE_ESCRITURA:
+            escritos += _escribir(db, operaciones)
+            operaciones = []
+    if operaciones:
+        escritos += _escribir(db, operaciones)
+
+    return {
+        "id_dispositivo": disp,
+        "filas": len(df),
+        "ventanas": len(fases),
+        "escritos": escritos,
+        "segundos": time.perf_counter() - t0,
+    }
+
+def _escribir(db, operaciones):
+    resultado = db[svc.COLECCION_CLASIFICACIONES].bulk_write(operaciones, ordered=False)
+    return resultado.upserted_count + resultado.modified_count
+
+def asegurar_indice(db):
+    """Índice único parcial que hace idempotente el backfill por (dominio, dispositivo, fin de ventana)"""
+    coleccion = db[svc.COLECCION_CLASIFICACIONES]
+    # El índice anterior no incluía el dominio y rechazaría el mismo dispositivo en otro dominio
+    if "id_dispositivo_fin_ventana" in coleccion.index_information():
+        coleccion.drop_index("id_dispositivo_fin_ventana")
+    coleccion.create_index(
+        [("dominio", ASCENDING), ("id_dispositivo", ASCENDING), ("fin_ventana", ASCENDING)],
+        unique=True,
+        partialFilterExpression={"fin_ventana": {"$exists": True}},
+        name="dominio_id_dispositivo_fin_ventana"
+    )
+
+# ====================================================
+# EJECUCIÓN
+# ====================================================
+def ejecutar_backfill(dispositivos=None, coleccion=svc.COLECCION_DATOS, desde=None, hasta=None,
+                      procesos=None, tam_lote=TAMANO_LOTE_ONNX):
+    """Reparte los dispositivos en un pool de procesos y devuelve el resumen por dispositivo"""
+    if not svc.MONGO_URI:
+        raise RuntimeError("❌ No se encontró la variable de entorno MONGO_URI")
+
+    client = MongoClient(svc.MONGO_URI)
+    db = client[svc.DB_NAME]
+    asegurar_indice(db)
+    if not dispositivos:
+        dispositivos = sorted(d for d in db[coleccion].distinct("id_dispositivo") if d)
+    client.close()
+
+    if not dispositivos:
+        print("⚠️ No hay dispositivos para reconstruir.")
+        return []
+
+    procesos = procesos or os.cpu_count() or 1
+    print(f"🔁 Backfill de {len(dispositivos)} dispositivos con {procesos} procesos...")
+
+    # "spawn" para que cada proceso cree su propia sesión ONNX y su propio cliente de MongoDB
+    contexto = multiprocessing.get_context("spawn")
+    resumen = []
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=procesos, mp_context=contexto,
+                             initializer=_iniciar_worker, initargs=(svc.MONGO_URI,)) as pool:
+        futuros = {
+            pool.submit(backfill_dispositivo, disp, coleccion, desde, hasta, tam_lote): disp
+            for disp in dispositivos
+        }
+        for futuro in as_completed(futuros):
+            disp = futuros[futuro]
+            try:
+                r = futuro.result()
+                resumen.append(r)
+                print(f"🧪 {disp}: {r['ventanas']} ventanas, {r['escritos']} escritas ({r['segundos']:.1f} s)")
+            except Exception as e:
+                print(f"❌ Error en backfill de {disp}: {e}")
+
+    total = sum(r["ventanas"] for r in resumen)
+    print(f"✔️ Backfill finalizado: {total} ventanas en {time.perf_counter() - t0:.1f} s")
+    return resumen
+
+def _fecha(valor):
+    return datetime.strptime(valor, "%Y-%m-%d")
+
+def _fecha_fin(valor):
+    # La fecha final es inclusiva: se toma hasta el inicio del día siguiente
+    return _fecha(valor) + timedelta(days=1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconstruye el historial de fases de los dispositivos")
+    parser.add_argument("--dispositivos", nargs="+", help="Dispositivos a procesar (por defecto todos)")
+    parser.add_argument("--coleccion", default=svc.COLECCION_DATOS, help="Colección de datos del dominio")
+    parser.add_argument("--desde", type=_fecha, help="Fecha inicial (YYYY-MM-DD, UTC)")
+    parser.add_argument("--hasta", type=_fecha_fin, help="Fecha final inclusiva (YYYY-MM-DD, UTC)")
+    parser.add_argument("--procesos", type=int, help="Procesos en paralelo (por defecto CPUs disponibles)")
+    parser.add_argument("--lote", type=int, default=TAMANO_LOTE_ONNX, help="Ventanas por llamada a ONNX")
+    args = parser.parse_args()
+
+    ejecutar_backfill(args.dispositivos, args.coleccion, args.desde, args.hasta, args.procesos, args.lote)
+
+if __name__ == "__main__":
+    main()
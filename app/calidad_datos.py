@@ -0,0 +1,122 @@
+import os
+import warnings
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Límites físicos de cada variable: fuera de ellos la lectura es un error del sensor y se recorta
+LIMITES_FISICOS = {
+    "ph": (0.0, 14.0),
+    "oxigeno": (0.0, 50.0),
+    "temperatura": (-10.0, 60.0),
+    "luz": (0.0, 200000.0)
+}
+
+# Filtro de Hampel: mediana móvil de 2*MEDIA_VENTANA+1 lecturas, atípico si se aleja más de N_SIGMAS
+HAMPEL_MEDIA_VENTANA = int(os.environ.get("HAMPEL_MEDIA_VENTANA", "5"))
+HAMPEL_N_SIGMAS = float(os.environ.get("HAMPEL_N_SIGMAS", "5"))
+# Huecos de hasta esta cantidad de lecturas se interpolan; uno más largo invalida la ventana
+MAX_HUECO = int(os.environ.get("MAX_HUECO", "3"))
+
+# Factor que convierte la MAD en desviación estándar para datos normales
+K_MAD = 1.4826
+
+# ====================================================
+# ETAPAS (TODAS SOBRE MATRICES SERIES × LECTURAS)
+# ====================================================
+def recortar_limites(x, minimo, maximo):
+    """Recorta al rango físico; devuelve la matriz recortada y la máscara de valores modificados"""
+    recortado = np.clip(x, minimo, maximo)
+    return recortado, ~np.isnan(x) & (recortado != x)
+
+def filtro_hampel(x, media_ventana=HAMPEL_MEDIA_VENTANA, n_sigmas=HAMPEL_N_SIGMAS):
+    """Reemplaza los atípicos por la mediana móvil; devuelve la matriz filtrada y la máscara de atípicos"""
+    relleno = np.pad(x, ((0, 0), (media_ventana, media_ventana)), constant_values=np.nan)
+    ventanas = sliding_window_view(relleno, 2 * media_ventana + 1, axis=1)
+    with warnings.catch_warnings():
+        # Ventanas formadas solo por NaN: su mediana queda en NaN y no marcan atípicos
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        mediana = np.nanmedian(ventanas, axis=2)
+        mad = np.nanmedian(np.abs(ventanas - mediana[..., np.newaxis]), axis=2)
+    atipicos = np.abs(x - mediana) > n_sigmas * K_MAD * mad
+    atipicos &= mad > 0
+    return np.where(atipicos, mediana, x), atipicos
+
+def imputar_huecos(x, max_hueco=MAX_HUECO):
+    """Interpola linealmente los huecos cortos (en los bordes se repite el valor más cercano)"""
+    largo = x.shape[1]
+    indices = np.arange(largo)
+    faltantes = np.isnan(x)
+
+    # Índice de la lectura válida anterior y siguiente de cada posición
+    anterior = np.maximum.accumulate(np.where(faltantes, -1, indices), axis=1)
+    siguiente = np.minimum.accumulate(np.where(faltantes, largo, indices)[:, ::-1], axis=1)[:, ::-1]
+
+    filas = np.arange(x.shape[0])[:, np.newaxis]
+    valor_anterior = x[filas, np.clip(anterior, 0, largo - 1)]
+    valor_siguiente = x[filas, np.clip(siguiente, 0, largo - 1)]
+
+    hay_anterior = anterior >= 0
+    hay_siguiente = siguiente < largo
+    with np.errstate(divide="ignore", invalid="ignore"):
+        peso = (indices - anterior) / (siguiente - anterior)
+    interior = faltantes & hay_anterior & hay_siguiente & (siguiente - anterior - 1 <= max_hueco)
+    inicio = faltantes & ~hay_anterior & hay_siguiente & (siguiente <= max_hueco)
+    final = faltantes & hay_anterior & ~hay_siguiente & (largo - 1 - anterior <= max_hueco)
+
+    imputado = x.copy()
+    imputado[interior] = (valor_anterior + peso * (valor_siguiente - valor_anterior))[interior]
+    imputado[inicio] = valor_siguiente[inicio]
+    imputado[final] = valor_anterior[final]
+    return imputado, interior | inicio | final
+
+# ====================================================
+# LIMPIEZA DE VENTANAS
+# ====================================================
+def limpiar_ventanas(ventanas, variables):
+    """Limpia a la vez todas las ventanas (N × lecturas × features).
+
+    Las primeras columnas corresponden a `variables` (en ese orden) y son las que se limpian;
+    el resto (ej. la hora codificada) se deja igual. Devuelve las ventanas limpias, la máscara
+    de ventanas válidas (sin huecos largos) y un arreglo estructurado con la calidad de cada una.
+    """
+    ventanas = np.array(ventanas, dtype=float)
+    n, largo, _ = ventanas.shape
+    n_vars = len(variables)
+
+    # (N, lecturas, variables) → (N * variables, lecturas): cada fila es una serie
+    series = ventanas[:, :, :n_vars].transpose(0, 2, 1).reshape(n * n_vars, largo)
+    faltantes = np.isnan(series)
+
+    minimos = np.tile([LIMITES_FISICOS[v][0] for v in variables], n)[:, np.newaxis]
+    maximos = np.tile([LIMITES_FISICOS[v][1] for v in variables], n)[:, np.newaxis]
+    series, recortados = recortar_limites(series, minimos, maximos)
+    series, atipicos = filtro_hampel(series)
+    series, imputados = imputar_huecos(series)
+
+    ventanas[:, :, :n_vars] = series.reshape(n, n_vars, largo).transpose(0, 2, 1)
+    validas = ~np.isnan(ventanas).any(axis=(1, 2))
+
+    def por_ventana(mascara):
+        return mascara.reshape(n, n_vars * largo).sum(axis=1)
+
+    calidad = np.zeros(n, dtype=[("calidad", float), ("faltantes", int), ("imputados", int),
+                                 ("recortados", int), ("atipicos", int)])
+    calidad["faltantes"] = por_ventana(faltantes)
+    calidad["imputados"] = por_ventana(imputados)
+    calidad["recortados"] = por_ventana(recortados)
+    calidad["atipicos"] = por_ventana(atipicos)
+    # Fracción de lecturas que llegaron bien y no hubo que tocar
+    modificadas = por_ventana(faltantes | recortados | atipicos)
+    calidad["calidad"] = 1 - modificadas / (n_vars * largo)
+    return ventanas, validas, calidad
+
+def calidad_a_dict(fila):
+    """Convierte una fila de calidad en un documento para MongoDB"""
+    return {
+        "calidad": round(float(fila["calidad"]), 4),
+        "faltantes": int(fila["faltantes"]),
+        "imputados": int(fila["imputados"]),
+        "recortados": int(fila["recortados"]),
+        "atipicos": int(fila["atipicos"]),
+    }
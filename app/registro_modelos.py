@@ -0,0 +1,238 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+from pathlib import Path
+
+import joblib
+import numpy as np
+
+from .sesion_onnx import crear_sesion, resolver_modelo, inferir
+
+# Archivos que componen una versión del modelo
+ARCHIVO_MODELO = "gru_48.onnx"
+ARCHIVO_SCALER = "robust_scaler.pkl"
+ARCHIVO_ENCODER = "label_encoder.pkl"
+ARCHIVOS = (ARCHIVO_MODELO, ARCHIVO_SCALER, ARCHIVO_ENCODER)
+
+# Si existe este subdirectorio, cada versión vive en su propia carpeta (ej. modelos/versiones/2025-06-01)
+# y se usa la de nombre mayor; si no, se usan los archivos directamente en el directorio de modelos
+SUBDIR_VERSIONES = "versiones"
+
+ModeloCargado = namedtuple("ModeloCargado", ["version", "sesion", "scaler", "encoder", "ruta", "cargado"])
+
+# ====================================================
+# CARGA Y VALIDACIÓN DE UNA VERSIÓN
+# ====================================================
+def cargar_modelo(directorio, version, seq_len, archivos=ARCHIVOS, usar_cache=None):
+    """Carga sesión ONNX, scaler y encoder de un directorio y los valida con una inferencia de prueba"""
+    directorio = Path(directorio)
+    archivo_modelo, archivo_scaler, archivo_encoder = archivos
+    ruta_modelo = resolver_modelo(directorio / archivo_modelo)
+    sesion = crear_sesion(ruta_modelo, usar_cache=usar_cache)
+    scaler = joblib.load(directorio / archivo_scaler)
+    encoder = joblib.load(directorio / archivo_encoder)
+
+    # Inferencia de prueba: una ventana en cero y otra aleatoria (fija), ya escaladas,
+    # deben producir una probabilidad finita por clase
+    n_features = getattr(scaler, "n_features_in_", sesion.get_inputs()[0].shape[-1])
+    ventanas = np.stack([
+        scaler.transform(np.zeros((seq_len, n_features))),
+        np.random.default_rng(0).standard_normal((seq_len, n_features)),
+    ]).astype(np.float32)
+    salida = inferir(sesion, ventanas)
+    n_clases = len(encoder.classes_)
+    if salida.shape != (2, n_clases):
+        raise ValueError(f"Salida de forma {salida.shape}, se esperaba (2, {n_clases})")
+    if not np.isfinite(salida).all():
+        raise ValueError("La inferencia de prueba produjo valores no finitos")
+
+    # La sesión (que puede venir del grafo optimizado en caché) debe responder igual que el archivo recién leído
+    referencia = inferir(crear_sesion(ruta_modelo, nivel="ninguno", usar_cache=False), ventanas)
+    if not np.allclose(salida, referencia, rtol=1e-4, atol=1e-5):
+        raise ValueError(f"La sesión no coincide con {ruta_modelo.name} (diferencia máxima {np.abs(salida - referencia).max():.2e})")
+
+    return ModeloCargado(version, sesion, scaler, encoder, str(directorio), datetime.utcnow())
+
+def _firma_archivos(directorio, archivos=ARCHIVOS):
+    """Firma barata (tamaño y fecha de modificación) para detectar cambios sin leer los archivos"""
+    firma = []
+    for nombre in archivos:
+        estado = (Path(directorio) / nombre).stat()
+        firma.append((nombre, estado.st_size, estado.st_mtime_ns))
+    return tuple(firma)
+
+def _hash_archivos(directorio, archivos=ARCHIVOS):
+    h = hashlib.sha256()
+    for nombre in archivos:
+        h.update((Path(directorio) / nombre).read_bytes())
+    return h.hexdigest()[:10]
+
+# ====================================================
+# REGISTRO CON RECARGA EN CALIENTE
+# ====================================================
+class RegistroModelos:
+    """Mantiene la versión activa del modelo y la reemplaza cuando cambia en disco.
+
+    `actual()` devuelve una referencia inmutable: quien la tomó al comienzo de una
+    clasificación termina con esa versión aunque entre tanto se active otra.
+    """
+
+    def __init__(self, directorio, seq_len, archivos=ARCHIVOS):
+        self.directorio = Path(directorio)
+        self.seq_len = seq_len
+        self.archivos = tuple(archivos)
+        self._actual = None
+        self._firma_actual = None
+        self._firma_fallida = None
+        self._lock = threading.Lock()
+
+    def candidato(self):
+        """Devuelve (directorio, firma) de la versión que debería estar activa"""
+        versiones = self.directorio / SUBDIR_VERSIONES
+        if versiones.is_dir():
+            carpetas = sorted(p for p in versiones.iterdir() if p.is_dir() and not p.name.startswith("."))
+            if carpetas:
+                ultima = carpetas[-1]
+                return ultima, (ultima.name, _firma_archivos(ultima, self.archivos))
+        return self.directorio, (None, _firma_archivos(self.directorio, self.archivos))
+
+    def actual(self):
+        if self._actual is None:
+            self.revisar()
+            if self._actual is None:
+                raise RuntimeError("❌ No hay un modelo válido cargado")
+        return self._actual
+
+    def revisar(self):
+        """Carga y activa una nueva versión si cambió en disco; devuelve True si hubo cambio"""
+        with self._lock:
+            try:
+                directorio, firma = self.candidato()
+            except OSError as e:
+                print(f"⚠️ No se pudo revisar el directorio de modelos: {e}")
+                return False
+            if firma == self._firma_actual or firma == self._firma_fallida:
+                return False
+
+            nombre_version = firma[0] or _hash_archivos(directorio, self.archivos)
+            try:
+                # En una recarga en caliente no se usa el grafo optimizado en caché: se lee el archivo nuevo
+                recarga = self._actual is not None
+                nuevo = cargar_modelo(directorio, nombre_version, self.seq_len, self.archivos,
+                                      usar_cache=False if recarga else None)
+            except Exception as e:
+                # Se recuerda la firma fallida para no reintentar hasta que los archivos cambien otra vez
+                self._firma_fallida = firma
+                print(f"❌ Versión de modelo {nombre_version} rechazada: {e}")
+                return False
+
+            anterior = self._actual.version if self._actual else None
+            self._actual = nuevo  # Reemplazo atómico de la referencia
+            self._firma_actual = firma
+            self._firma_fallida = None
+            print(f"🔁 Modelo activo: {nuevo.version} (antes: {anterior})")
+            return True
+
+    def memoria_estimada(self):
+        """Estimación en bytes de la memoria del modelo activo (archivos en disco × factor de carga)"""
+        if self._actual is None:
+            return 0
+        ruta = Path(self._actual.ruta)
+        return FACTOR_MEMORIA * sum((ruta / nombre).stat().st_size for nombre in self.archivos if (ruta / nombre).exists())
+
+# ====================================================
+# CATÁLOGO DE MODELOS POR DOMINIO (LRU CON PRESUPUESTO DE MEMORIA)
+# ====================================================
+# La sesión ONNX ocupa en memoria más que el archivo (grafo optimizado, buffers): se estima el doble
+FACTOR_MEMORIA = 2
+
+def cargar_configuracion_dominios(ruta, dominio_por_defecto):
+    """Lee el JSON dominio → {directorio, modelo, scaler, encoder}; sin archivo se usa solo el dominio por defecto"""
+    ruta = Path(ruta)
+    if not ruta.exists():
+        return {dominio_por_defecto: {}}
+    with open(ruta, encoding="utf-8") as f:
+        return json.load(f)
+
+class CatalogoModelos:
+    """Asocia cada dominio a su modelo y mantiene cargados los usados recientemente.
+
+    Los modelos se cargan la primera vez que se piden y se guardan en un LRU; si la memoria
+    estimada supera el presupuesto se descarta el menos usado (se recargará cuando se vuelva
+    a pedir). Dominios configurados con los mismos archivos comparten la misma entrada.
+    """
+
+    def __init__(self, directorio_base, configuracion, seq_len, presupuesto_mb):
+        self.directorio_base = Path(directorio_base)
+        self.configuracion = configuracion
+        self.seq_len = seq_len
+        self.presupuesto = presupuesto_mb * 1024 * 1024
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def dominios(self):
+        return list(self.configuracion)
+
+    def _clave(self, dominio):
+        if dominio not in self.configuracion:
+            raise KeyError(f"Dominio sin modelo configurado: {dominio}")
+        cfg = self.configuracion[dominio]
+        directorio = (self.directorio_base / cfg.get("directorio", ".")).resolve()
+        archivos = (
+            cfg.get("modelo", ARCHIVO_MODELO),
+            cfg.get("scaler", ARCHIVO_SCALER),
+            cfg.get("encoder", ARCHIVO_ENCODER),
+        )
+        return directorio, archivos
+
+    def modelo(self, dominio):
+        """Versión activa del modelo del dominio, cargándolo si no está en la caché"""
+        clave = self._clave(dominio)
+        with self._lock:
+            registro = self._cache.get(clave)
+            if registro is not None:
+                self._cache.move_to_end(clave)
+                return registro.actual()
+
+        # La carga se hace fuera del lock para no bloquear a los demás dominios
+        registro = RegistroModelos(clave[0], self.seq_len, clave[1])
+        modelo = registro.actual()
+
+        with self._lock:
+            existente = self._cache.get(clave)
+            if existente is not None:
+                # Otro hilo lo cargó mientras tanto: se usa ese
+                self._cache.move_to_end(clave)
+                return existente.actual()
+            self._cache[clave] = registro
+            self._liberar()
+        print(f"📦 Modelo de {dominio} cargado ({modelo.version})")
+        return modelo
+
+    def memoria_estimada(self):
+        return sum(r.memoria_estimada() for r in self._cache.values())
+
+    def _liberar(self):
+        # Descarta los menos usados mientras se supere el presupuesto (siempre queda al menos uno)
+        while len(self._cache) > 1 and self.memoria_estimada() > self.presupuesto:
+            (directorio, _), _ = self._cache.popitem(last=False)
+            print(f"🗑️ Modelo descargado por presupuesto de memoria: {directorio}")
+
+    def revisar(self):
+        """Recarga en caliente los modelos cargados que hayan cambiado en disco"""
+        with self._lock:
+            registros = list(self._cache.values())
+        return any([r.revisar() for r in registros])
+
+    def estado(self):
+        with self._lock:
+            return {
+                "memoria_estimada_mb": round(self.memoria_estimada() / 1024 / 1024, 2),
+                "presupuesto_mb": round(self.presupuesto / 1024 / 1024, 2),
+                "cargados": [
+                    {"directorio": str(d), "archivos": list(a), "version": r.actual().version}
+                    for (d, a), r in self._cache.items()
+                ],
+            }
@@ -1,8 +1,49 @@
 from flask import Blueprint, request, jsonify, current_app
-from datetime import datetime
+from datetime import datetime, date, timedelta
+from pymongo.errors import DuplicateKeyError
+from database import (
+    obtener_dispositivos_clasificados,
+    obtener_clasificaciones as obtener_clasificaciones_dispositivo,
+    obtener_timeline_fases,
+    ORIGENES_CLASIFICACION,
+    obtener_comparacion_manual,
+    obtener_estado_alimentacion,
+    inicio_dia_utc
+)
+from planificador import estado_tareas
+from .umbrales import obtener_motor as obtener_motor_umbrales
+from .anomalias import obtener_detector as obtener_detector_anomalias
 
 main = Blueprint('main', __name__)
 
+def tiempo_iso(tiempo):
+    # Convertir un datetime UTC a texto ISO (compatible con JSON)
+    if isinstance(tiempo, datetime):
+        return tiempo.isoformat() + "Z"
+    return str(tiempo)
+
+def tiempo_registro():
+    # Hora del registro: la original si el cliente la reenvía desde su spool (cabecera X-Tiempo-Original), o la actual
+    original = request.headers.get("X-Tiempo-Original")
+    if original:
+        try:
+            return datetime.fromisoformat(original.rstrip("Z"))
+        except ValueError:
+            pass
+    return datetime.utcnow()
+
+def insertar_idempotente(collection, doc):
+    # Con cabecera Idempotency-Key el documento usa esa clave como _id: un reenvío repetido no duplica.
+    # Devuelve False si el registro ya existía
+    clave = request.headers.get("Idempotency-Key")
+    if clave:
+        doc["_id"] = clave
+    try:
+        collection.insert_one(doc)
+    except DuplicateKeyError:
+        return False
+    return True
+
 @main.route('/')
 def index():
     return jsonify({"message": "API del biorreactor funcionando"})
@@ -26,6 +67,18 @@ def recibir_datos():
     # Inserta el documento completo, sin el campo "dominio" que se usó como nombre de la colección
     collection.insert_one(data)
 
+    # Evaluar umbrales en memoria; un error aquí no debe impedir guardar la lectura
+    try:
+        obtener_motor_umbrales().evaluar(dominio, data)
+    except Exception as e:
+        print(f"⚠️ Error evaluando umbrales: {e}")
+
+    # Detección de anomalías en memoria (se escriben en lote en segundo plano)
+    try:
+        obtener_detector_anomalias().procesar(dominio, data)
+    except Exception as e:
+        print(f"⚠️ Error detectando anomalías: {e}")
+
     return jsonify({'message': f'Datos guardados en dominio {dominio}'}), 201
 
 @main.route('/api/datos', methods=['GET'])
@@ -90,12 +143,13 @@ def registrar_comida():
         return jsonify({'error': 'JSON inválido o evento incorrecto'}), 400
 
     # Agregar automáticamente la hora en que se registró el evento (UTC), y asegurar que haya un "id_dispositivo", si no se pone "Desconocido"
-    data['tiempo'] = datetime.utcnow()
+    data['tiempo'] = tiempo_registro()
     data['id_dispositivo'] = data.get("id_dispositivo", "desconocido")
 
-    # Conectar a la colección "registro_comida" y se guarda el documento
+    # Conectar a la colección "registro_comida" y se guarda el documento (un reenvío repetido responde 200)
     collection = current_app.mongo.db.registro_comida
-    collection.insert_one(data)
+    if not insertar_idempotente(collection, data):
+        return jsonify({'message': 'Registro de comida ya existía'}), 200
 
     # Devolver un mensaje de éxito (201 Created) 
     return jsonify({'message': 'Registro de comida guardado correctamente'}), 201
@@ -128,6 +182,18 @@ def obtener_registros_comida():
     # Invertir la lista para que los datos se entreguen del más antiguo al más reciente y se devuelven en formato JSON
     return jsonify(list(reversed(registros)))
 
+@main.route('/api/registro_comida/estado', methods=['GET'])
+def estado_alimentacion():
+    # Última alimentación y cantidad de eventos por dispositivo, agrupados en MongoDB.
+    # Parámetro opcional: id_dispositivo (se puede repetir, o separar por comas) para limitar los dispositivos
+    dispositivos = [d for valor in request.args.getlist('id_dispositivo') for d in valor.split(',') if d]
+    estado = obtener_estado_alimentacion(dispositivos or None, db=current_app.mongo.db)
+    return jsonify([{
+        'id_dispositivo': dispositivo,
+        'ultima': tiempo_iso(e['ultima']),
+        'n': e['n']
+    } for dispositivo, e in sorted(estado.items())])
+
 @main.route('/api/registro_manual', methods=['POST'])
 def registrar_manual():
     # Recibir los datos JSON
@@ -153,13 +219,92 @@ def registrar_manual():
 
     # Agregar el tiempo con fecha y hora del registro, en UTC, y campo adicional "manual" que marca ese dato como manual,
     # para diferenciarlo de los datos automáticos de sensores
-    doc["tiempo"] = datetime.utcnow()
+    doc["tiempo"] = tiempo_registro()
     doc["manual"] = True  # Campo adicional al final
 
-    # Guardar el documento en la colección correspondiente al dominio indicado
+    # Guardar el documento en la colección correspondiente al dominio indicado (un reenvío repetido responde 200)
     collection = current_app.mongo.db[dominio]
-    collection.insert_one(doc)
+    if not insertar_idempotente(collection, doc):
+        return jsonify({'message': f'Registro manual ya existía en dominio {dominio}'}), 200
 
     # Devolver mensaje indicando que el registro fue guardado correctamente, junto al código HTTP (201 Created)
     return jsonify({'message': f'Registro manual guardado en dominio {dominio}'}), 201
 
+
+@main.route('/api/clasificaciones', methods=['GET'])
+def obtener_clasificaciones():
+    # Sin "id_dispositivo" se devuelve la lista de dispositivos con clasificaciones
+    id_dispositivo = request.args.get('id_dispositivo')
+    # "dominio" (opcional) limita la consulta a un dominio: el mismo id de dispositivo puede estar en varios
+    dominio = request.args.get('dominio') or None
+    db = current_app.mongo.db
+    if not id_dispositivo:
+        return jsonify({'dispositivos': obtener_dispositivos_clasificados(db=db, dominio=dominio)})
+
+    # Leer y validar "limit" (por defecto las últimas 50 clasificaciones)
+    limit = request.args.get('limit', default=50, type=int)
+    if limit <= 0:
+        return jsonify({'error': 'El parámetro limit debe ser mayor que 0'}), 400
+
+    # Origen: "servicio" (por defecto, clasificaciones en vivo), "backfill" (reconstruidas) o "todos"
+    origen = request.args.get('origen', 'servicio')
+    if origen not in ORIGENES_CLASIFICACION:
+        return jsonify({'error': 'El parámetro origen debe ser "servicio", "backfill" o "todos"'}), 400
+
+    # Modo "timeline": historial de fases comprimido en tramos consecutivos de la misma fase
+    modo = request.args.get('modo', 'ultimas')
+    if modo == 'timeline':
+        tramos = obtener_timeline_fases(id_dispositivo, limit=limit, db=db, origen=origen, dominio=dominio)
+        return jsonify([{
+            'fase': t['fase'],
+            'inicio': tiempo_iso(t['inicio']),
+            'fin': tiempo_iso(t['fin']),
+            'n': t['n']
+        } for t in tramos])
+    if modo != 'ultimas':
+        return jsonify({'error': 'El parámetro modo debe ser "ultimas" o "timeline"'}), 400
+
+    # Modo por defecto: últimas clasificaciones en orden cronológico ascendente
+    registros = obtener_clasificaciones_dispositivo(id_dispositivo, limit=limit, db=db, origen=origen,
+                                                     dominio=dominio)
+    return jsonify([{
+        'timestamp': tiempo_iso(doc.get('timestamp')),
+        'fase': doc.get('fase'),
+        'proba': doc.get('proba'),
+        'version_modelo': doc.get('version_modelo'),
+        'dominio': doc.get('dominio'),
+        'calidad': doc.get('calidad')
+    } for doc in registros])
+
+@main.route('/api/tareas', methods=['GET'])
+def obtener_tareas():
+    # Estado de las tareas periódicas del proceso: duración y resultado de las últimas ejecuciones,
+    # ticks saltados por solapamiento y próximo tick programado
+    return jsonify(estado_tareas())
+
+@main.route('/api/umbrales', methods=['GET'])
+def obtener_umbrales():
+    # Variables actualmente en alarma o pendientes según el motor de umbrales del proceso
+    return jsonify([{
+        **e,
+        'desde': tiempo_iso(e['desde'])
+    } for e in obtener_motor_umbrales().estado()])
+
+@main.route('/api/comparacion_manual', methods=['GET'])
+def comparacion_manual():
+    # Comparación diaria registro manual vs sensor de un dispositivo, agregada en MongoDB.
+    # Parámetros: dominio, id_dispositivo y opcionalmente desde/hasta (fechas AAAA-MM-DD en hora de Chile, ambas incluidas)
+    dominio = request.args.get('dominio')
+    id_dispositivo = request.args.get('id_dispositivo')
+    if not dominio or not id_dispositivo:
+        return jsonify({'error': 'Faltan parámetros dominio o id_dispositivo'}), 400
+
+    try:
+        desde = request.args.get('desde')
+        hasta = request.args.get('hasta')
+        desde = inicio_dia_utc(date.fromisoformat(desde)) if desde else None
+        hasta = inicio_dia_utc(date.fromisoformat(hasta) + timedelta(days=1)) if hasta else None
+    except ValueError:
+        return jsonify({'error': 'Las fechas deben tener formato AAAA-MM-DD'}), 400
+
+    return jsonify(obtener_comparacion_manual(id_dispositivo, dominio, desde, hasta, db=current_app.mongo.db))
@@ -1,181 +1,323 @@
 import numpy as np
 import pandas as pd
-import onnxruntime as ort
 from datetime import datetime, timedelta
 from pathlib import Path
-import joblib
-from pymongo import MongoClient
-import time
-import threading
+from pymongo import MongoClient, InsertOne, UpdateOne
 import os
-import requests
+from .sesion_onnx import inferir
+from .registro_modelos import CatalogoModelos, cargar_configuracion_dominios
+from .calidad_datos import limpiar_ventanas, calidad_a_dict
+from .alertas import enviar_alerta
+from planificador import programar
 
 # Configuración
 SEQ_LEN = 48
+VARIABLES_MODELO = ("ph", "oxigeno")  # Primeras columnas de matriz_features, las que se limpian
 BASE_DIR = Path(__file__).parent
 MODELS_DIR = BASE_DIR / "modelos"
 
 # MongoDB
 MONGO_URI = os.environ.get("MONGO_URI")
 DB_NAME = "biorreactor_app"
-COLECCION_DATOS = "dominio_terreno"
+COLECCION_DATOS = "dominio_terreno"  # Dominio por defecto si no hay configuración de dominios
 COLECCION_CLASIFICACIONES = "clasificaciones"
 COLECCION_ESTADO = "estado_clasificacion"  # Guarda última fase
 
-# Telegram
-BOT_TOKEN = os.environ.get("BOT_TOKEN")
-CHAT_ID = os.environ.get("CHAT_ID")
-
-# Modelo GRU
-GRU_MODEL_PATH = MODELS_DIR / "gru_48.onnx"
-SESSION_GRU = ort.InferenceSession(str(GRU_MODEL_PATH))
-
-# Escalador y label encoder
-SCALER = joblib.load(MODELS_DIR / "robust_scaler.pkl")
-LABEL_ENCODER = joblib.load(MODELS_DIR / "label_encoder.pkl")
+# Modelo GRU, escalador y label encoder por dominio. La configuración es un JSON como
+#   {"dominio_terreno": {}, "dominio_laboratorio": {"directorio": "laboratorio"}}
+# donde "directorio" es relativo a MODELS_DIR y "modelo"/"scaler"/"encoder" permiten cambiar los nombres
+# de archivo. Los modelos se cargan al primer uso, se recargan en caliente y se descartan los menos
+# usados si la memoria estimada supera MODELOS_MEMORIA_MB.
+MODELOS_DOMINIOS = os.environ.get("MODELOS_DOMINIOS", str(MODELS_DIR / "dominios.json"))
+MODELOS_MEMORIA_MB = float(os.environ.get("MODELOS_MEMORIA_MB", "256"))
+CATALOGO = CatalogoModelos(
+    MODELS_DIR,
+    cargar_configuracion_dominios(MODELOS_DOMINIOS, COLECCION_DATOS),
+    SEQ_LEN,
+    MODELOS_MEMORIA_MB
+)
+RECARGA_MODELOS_SEGUNDOS = int(os.environ.get("RECARGA_MODELOS_SEGUNDOS", "60"))
 
 # ====================================================
-# ALERTAS TELEGRAM
+# ALERTAS
 # ====================================================
-def enviar_alerta(mensaje):
-    if not BOT_TOKEN or not CHAT_ID:
-        print("⚠️ No se enviaron alertas (faltan BOT_TOKEN o CHAT_ID)")
-        return
-    try:
-        requests.post(
-            f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage",
-            data={"chat_id": CHAT_ID, "text": mensaje, "parse_mode": "Markdown"},
-            timeout=5
+def mensaje_cambios_fase(cambios, ahora):
+    """Resume en un solo mensaje todos los cambios de fase de una ejecución"""
+    if len(cambios) == 1:
+        dominio, disp, fase_anterior, fase = cambios[0]
+        return (
+            f"🔔 *Cambio de fase detectado*\n"
+            f"Dispositivo: `{disp}` ({dominio})\n"
+            f"Antes: `{fase_anterior}`\n"
+            f"Ahora: *{fase}*\n"
+            f"🕒 {ahora.strftime('%Y-%m-%d %H:%M')}"
         )
-        print(f"📨 Alerta enviada: {mensaje}")
-    except Exception as e:
-        print(f"❌ Error enviando alerta Telegram: {e}")
+    lineas = [f"🔔 *{len(cambios)} cambios de fase detectados*"]
+    for dominio, disp, fase_anterior, fase in cambios:
+        lineas.append(f"• `{disp}` ({dominio}): `{fase_anterior}` → *{fase}*")
+    lineas.append(f"🕒 {ahora.strftime('%Y-%m-%d %H:%M')}")
+    return "\n".join(lineas)
 
 # ====================================================
 # FUNCIONES AUXILIARES
 # ====================================================
-def preparar_secuencia(df):
-    """Prepara la secuencia para GRU (48 filas × features)"""
+def cargar_datos_dispositivo(col_datos, disp, desde):
+    """Lee los datos de un dispositivo desde la fecha indicada, ordenados por tiempo"""
+    cursor = col_datos.find(
+        {"id_dispositivo": disp, "tiempo": {"$gte": desde}}
+    ).sort("tiempo", 1)
+    df = pd.DataFrame(list(cursor))
+    if not df.empty:
+        df["tiempo"] = pd.to_datetime(df["tiempo"])
+    return df
+
+def matriz_features(df):
+    """Calcula las features del modelo para todas las filas de un DataFrame ordenado por tiempo"""
+    hora = df["tiempo"].dt.hour + df["tiempo"].dt.minute / 60
+    return np.column_stack([
+        df["ph"].to_numpy(dtype=float),
+        df["oxigeno"].to_numpy(dtype=float),
+        np.sin(2 * np.pi * hora.to_numpy() / 24),
+        np.cos(2 * np.pi * hora.to_numpy() / 24),
+    ])
+
+def extraer_features(df):
+    """Construye la matriz de features sin escalar (48 filas × features), que puede traer nulos"""
     if len(df) < SEQ_LEN:
         return None, f"No hay suficientes datos (se necesitan {SEQ_LEN})"
 
-    df = df.sort_values("tiempo")
-    df["hora"] = df["tiempo"].dt.hour + df["tiempo"].dt.minute / 60
-    df["hora_sin"] = np.sin(2 * np.pi * df["hora"] / 24)
-    df["hora_cos"] = np.cos(2 * np.pi * df["hora"] / 24)
+    df = df.sort_values("tiempo").tail(SEQ_LEN)
+    return matriz_features(df), None
 
-    features = ["ph", "oxigeno", "hora_sin", "hora_cos"]
-    seq = df.tail(SEQ_LEN)[features]
+def limpiar_secuencias(secuencias):
+    """Recorta, filtra atípicos e imputa huecos cortos de todas las secuencias a la vez"""
+    return limpiar_ventanas(np.stack(secuencias), VARIABLES_MODELO)
 
-    if seq.isna().any().any():
-        return None, "Secuencia con valores nulos"
+def escalar_secuencia(seq, scaler):
+    """Aplica el RobustScaler y agrega la dimensión de lote (1 × 48 × features)"""
+    return scaler.transform(seq)[np.newaxis, :, :].astype(np.float32)
+
+def preparar_secuencia(df, scaler):
+    """Prepara la secuencia para GRU (48 filas × features)"""
+    seq, error = extraer_features(df)
+    if error:
+        return None, error
 
-    return SCALER.transform(seq.to_numpy())[np.newaxis, :, :].astype(np.float32), None
+    limpias, validas, _ = limpiar_secuencias([seq])
+    if not validas[0]:
+        return None, "Secuencia con huecos demasiado largos"
+    return escalar_secuencia(limpias[0], scaler), None
 
-def clasificar_fase(df):
+def clasificar_fase(df, modelo):
     """Ejecuta modelo GRU y devuelve fase y probabilidades"""
-    input_seq, error = preparar_secuencia(df)
+    input_seq, error = preparar_secuencia(df, modelo.scaler)
     if error:
         return None, None, error
 
-    input_name = SESSION_GRU.get_inputs()[0].name
-    output = SESSION_GRU.run(None, {input_name: input_seq})[0].flatten()
+    return interpretar_salida(inferir(modelo.sesion, input_seq).flatten(), modelo.encoder)
+
+def escalar_lote(secuencias, scaler):
+    """Escala varias secuencias con una sola llamada al scaler (N × 48 × features)"""
+    lote = np.stack(secuencias)
+    n, pasos, n_features = lote.shape
+    return scaler.transform(lote.reshape(-1, n_features)).reshape(n, pasos, n_features).astype(np.float32)
+
+def interpretar_lote(salida, encoder):
+    """Convierte la salida del modelo para un lote en [(fase, probabilidades)]"""
+    clases = salida.argmax(axis=1)
+    try:
+        fases = encoder.inverse_transform(clases).tolist()
+    except:
+        fases = [str(c) for c in clases]
+    return list(zip(fases, salida.tolist()))
+
+def clasificar_lote(secuencias, modelo):
+    """Clasifica varias secuencias con una sola inferencia; devuelve [(fase, probabilidades)]"""
+    if len(secuencias) == 0:
+        return []
+    return interpretar_lote(inferir(modelo.sesion, escalar_lote(secuencias, modelo.scaler)), modelo.encoder)
+
+def interpretar_salida(output, encoder):
+    """Convierte la salida del modelo en (fase, probabilidades, error)"""
     clase = int(np.argmax(output))
 
     try:
-        fase = LABEL_ENCODER.inverse_transform([clase])[0]
+        fase = encoder.inverse_transform([clase])[0]
     except:
         fase = str(clase)
 
     return fase, output.tolist(), None
 
+def leer_fases_anteriores(col_estado, dispositivos, dominio=COLECCION_DATOS):
+    """Lee en una sola consulta la última fase guardada de cada dispositivo del dominio"""
+    # Los estados guardados antes de existir varios dominios no tienen "dominio": son del dominio por defecto
+    filtro_dominio = {"$in": [dominio, None]} if dominio == COLECCION_DATOS else dominio
+    cursor = col_estado.find(
+        {"id_dispositivo": {"$in": list(dispositivos)}, "dominio": filtro_dominio},
+        {"_id": 0, "id_dispositivo": 1, "fase_actual": 1, "dominio": 1}
+    )
+    fases = {}
+    for doc in cursor:
+        # Si hay estado con y sin dominio, gana el que tiene dominio (el más nuevo)
+        if doc.get("dominio") or doc["id_dispositivo"] not in fases:
+            fases[doc["id_dispositivo"]] = doc.get("fase_actual")
+    return fases
+
+def operaciones_clasificacion(disp, fase, proba, ahora, version_modelo=None, dominio=COLECCION_DATOS,
+                              calidad=None):
+    """Arma la inserción histórica y el upsert de estado de una clasificación"""
+    historico = InsertOne({
+        "id_dispositivo": disp,
+        "dominio": dominio,
+        "fase": fase,
+        "proba": proba,
+        "timestamp": ahora,
+        "version_modelo": version_modelo,
+        "calidad": calidad
+    })
+    estado = UpdateOne(
+        {"id_dispositivo": disp, "dominio": dominio},
+        {"$set": {"fase_actual": fase, "fecha": ahora}},
+        upsert=True
+    )
+    return historico, estado
+
+def guardar_resultados(col_clasificacion, col_estado, historicos, estados):
+    """Confirma las clasificaciones y estados acumulados con dos bulk_write no ordenados"""
+    if historicos:
+        col_clasificacion.bulk_write(historicos, ordered=False)
+    if estados:
+        col_estado.bulk_write(estados, ordered=False)
+
 # ====================================================
 # SERVICIO PRINCIPAL
 # ====================================================
+def clasificar_dominio(db, dominio, modelo, desde):
+    """Clasifica todos los dispositivos de un dominio con una sola inferencia por lotes"""
+    col_datos = db[dominio]
+    secuencias, dispositivos = [], []
+    for disp in col_datos.distinct("id_dispositivo"):
+        # Un dispositivo con datos inesperados (ej. sin "oxigeno") se omite sin afectar a los demás
+        try:
+            df = cargar_datos_dispositivo(col_datos, disp, desde)
+            if df.empty:
+                print(f"⚠️ Sin datos recientes para {disp} ({dominio})")
+                continue
+            seq, error = extraer_features(df)
+        except Exception as e:
+            seq, error = None, f"{type(e).__name__}: {e}"
+        if error:
+            print(f"❌ Error clasificación GRU ({disp}): {error}")
+            continue
+        secuencias.append(seq)
+        dispositivos.append(disp)
+
+    if not secuencias:
+        return {}
+
+    # Limpieza de todas las ventanas del dominio en una sola pasada vectorizada
+    limpias, validas, calidad = limpiar_secuencias(secuencias)
+    for disp in np.array(dispositivos, dtype=object)[~validas]:
+        print(f"❌ Error clasificación GRU ({disp}): Secuencia con huecos demasiado largos")
+
+    indices = np.flatnonzero(validas)
+    resultados = clasificar_lote(limpias[indices], modelo)
+    return {
+        dispositivos[i]: (fase, proba, calidad_a_dict(calidad[i]))
+        for i, (fase, proba) in zip(indices, resultados)
+    }
+
+def operaciones_dominio(db, col_estado, dominio, desde):
+    """Clasifica un dominio y devuelve sus escrituras (históricos, estados) y cambios de fase"""
+    historicos, estados, cambios = [], [], []
+    # Todo el dominio usa la versión de modelo activa al comenzar, aunque se recargue otra entre tanto
+    try:
+        modelo = CATALOGO.modelo(dominio)
+    except Exception as e:
+        print(f"❌ Sin modelo para {dominio}: {e}")
+        return historicos, estados, cambios
+
+    resultados = clasificar_dominio(db, dominio, modelo, desde)
+    if not resultados:
+        print(f"⚠️ No hay dispositivos para clasificar en {dominio}.")
+        return historicos, estados, cambios
+
+    # Leer todas las fases anteriores del dominio de una vez
+    fases_anteriores = leer_fases_anteriores(col_estado, resultados, dominio)
+
+    ahora = datetime.utcnow()
+    for disp, (fase, proba, calidad) in resultados.items():
+        fase_anterior = fases_anteriores.get(disp)
+        historico, estado = operaciones_clasificacion(disp, fase, proba, ahora, modelo.version, dominio, calidad)
+        historicos.append(historico)
+        estados.append(estado)
+
+        if fase_anterior and fase_anterior != fase:
+            cambios.append((dominio, disp, fase_anterior, fase))
+
+        print(f"🧪 {disp} ({dominio}) → Fase: {fase} (antes: {fase_anterior}, calidad: {calidad['calidad']:.2f})")
+    return historicos, estados, cambios
+
 def servicio_clasificaciones():
-    """Ejecuta clasificaciones GRU por dispositivo y actualiza MongoDB"""
+    """Ejecuta clasificaciones GRU de todos los dominios configurados y actualiza MongoDB"""
     try:
         print(f"\n[{datetime.utcnow()}] 🔄 Ejecutando clasificaciones...")
 
         client = MongoClient(MONGO_URI)
         db = client[DB_NAME]
-        col_datos = db[COLECCION_DATOS]
         col_clasificacion = db[COLECCION_CLASIFICACIONES]
         col_estado = db[COLECCION_ESTADO]
 
-        dispositivos = col_datos.distinct("id_dispositivo")
-        if not dispositivos:
-            print("⚠️ No hay dispositivos en la base de datos.")
-            return
+        # Las escrituras y alertas de todos los dominios se acumulan y se confirman al final
+        historicos, estados, cambios = [], [], []
 
-        for disp in dispositivos:
-            cursor = col_datos.find(
-                {"id_dispositivo": disp, "tiempo": {"$gte": datetime.utcnow() - timedelta(hours=48)}}
-            ).sort("tiempo", 1)
-            df = pd.DataFrame(list(cursor))
-            if df.empty:
-                print(f"⚠️ Sin datos recientes para {disp}")
+        desde = datetime.utcnow() - timedelta(hours=48)
+        fallidos = []
+        for dominio in CATALOGO.dominios():
+            # Un error en un dominio se registra y no descarta las clasificaciones de los demás
+            try:
+                historicos_dominio, estados_dominio, cambios_dominio = operaciones_dominio(db, col_estado, dominio, desde)
+            except Exception as e:
+                fallidos.append(dominio)
+                print(f"❌ Error clasificando {dominio}: {type(e).__name__}: {e}")
                 continue
+            historicos.extend(historicos_dominio)
+            estados.extend(estados_dominio)
+            cambios.extend(cambios_dominio)
 
-            df["tiempo"] = pd.to_datetime(df["tiempo"])
-            fase, proba, error = clasificar_fase(df)
-            if error:
-                print(f"❌ Error clasificación GRU ({disp}): {error}")
-                continue
+        guardar_resultados(col_clasificacion, col_estado, historicos, estados)
+
+        # Encolar un único resumen de cambios de fase (el envío ocurre en segundo plano)
+        if cambios:
+            enviar_alerta(mensaje_cambios_fase(cambios, datetime.utcnow()))
 
-            # Leer fase anterior
-            doc_estado = col_estado.find_one({"id_dispositivo": disp})
-            fase_anterior = doc_estado["fase_actual"] if doc_estado else None
-
-            # Guardar clasificación histórica
-            col_clasificacion.insert_one({
-                "id_dispositivo": disp,
-                "fase": fase,
-                "proba": proba,
-                "timestamp": datetime.utcnow()
-            })
-
-            # Enviar alerta si hay cambio de fase
-            if fase_anterior and fase_anterior != fase:
-                mensaje = (
-                    f"🔔 *Cambio de fase detectado*\n"
-                    f"Dispositivo: `{disp}`\n"
-                    f"Antes: `{fase_anterior}`\n"
-                    f"Ahora: *{fase}*\n"
-                    f"🕒 {datetime.utcnow().strftime('%Y-%m-%d %H:%M')}"
-                )
-                enviar_alerta(mensaje)
-
-            # Actualizar estado
-            col_estado.update_one(
-                {"id_dispositivo": disp},
-                {"$set": {"fase_actual": fase, "fecha": datetime.utcnow()}},
-                upsert=True
-            )
-
-            print(f"🧪 {disp} → Fase: {fase} (antes: {fase_anterior})")
-
-        print(f"[{datetime.utcnow()}] ✔️ Clasificaciones finalizadas.")
+        print(f"[{datetime.utcnow()}] ✔️ Clasificaciones finalizadas ({len(historicos)} guardadas).")
+        if fallidos:
+            # Lo de los demás dominios ya quedó guardado; la ejecución se informa como fallida al planificador
+            raise RuntimeError(f"Fallaron los dominios: {', '.join(fallidos)}")
 
     except Exception as e:
         print(f"❌ Error en servicio_clasificaciones: {e}")
+        raise  # El planificador registra la ejecución como fallida
 
 # ====================================================
 # EJECUCIÓN AUTOMÁTICA CADA HORA
 # ====================================================
-def iniciar_hilo(interval_minutes=60):
-    def tarea():
-        print(f"🧵 Hilo iniciado, clasificaciones cada {interval_minutes} min...")
-        time.sleep(2)
-        while True:
-            servicio_clasificaciones()
-            time.sleep(interval_minutes * 60)
-
-    hilo = threading.Thread(target=tarea, daemon=True)
-    hilo.start()
+def iniciar_hilo(interval_minutes=60, jitter_segundos=30):
+    # Ticks alineados al reloj (ej. cada hora en punto) con un pequeño jitter; una ejecución
+    # que aún no termina hace que se salte el tick siguiente en vez de acumularse
+    tarea = programar(
+        "clasificaciones",
+        servicio_clasificaciones,
+        intervalo_s=interval_minutes * 60,
+        jitter_s=jitter_segundos,
+        ejecutar_al_iniciar=True
+    )
+    # Revisión periódica de los modelos cargados para activar nuevas versiones sin reiniciar
+    programar("recarga_modelos", CATALOGO.revisar, intervalo_s=RECARGA_MODELOS_SEGUNDOS)
     print("✔️ Hilo de clasificaciones ejecutándose en segundo plano.")
-    return hilo
+    return tarea
 
 # Para arrancar el hilo automáticamente
 if __name__ == "__main__":
-    iniciar_hilo(interval_minutes=60)
+    iniciar_hilo(interval_minutes=60).esperar()
@@ -0,0 +1,143 @@
+import onnxruntime as ort
+import numpy as np
+from pathlib import Path
+import hashlib
+import os
+
+# ====================================================
+# CONFIGURACIÓN DE ONNX RUNTIME (variables de entorno)
+# ====================================================
+# Por defecto se usa 1 hilo para no competir por CPU con los workers de Gunicorn
+ORT_INTRA_OP_THREADS = int(os.environ.get("ORT_INTRA_OP_THREADS", "1"))
+ORT_INTER_OP_THREADS = int(os.environ.get("ORT_INTER_OP_THREADS", "1"))
+ORT_NIVEL_OPTIMIZACION = os.environ.get("ORT_NIVEL_OPTIMIZACION", "todo")
+ORT_MODO_EJECUCION = os.environ.get("ORT_MODO_EJECUCION", "secuencial")
+
+# Guardar en disco el grafo optimizado para reutilizarlo en los siguientes arranques
+ORT_CACHE_OPTIMIZADO = os.environ.get("ORT_CACHE_OPTIMIZADO", "1") == "1"
+
+# Usar la variante cuantizada int8 del modelo (si existe el archivo)
+MODELO_INT8 = os.environ.get("MODELO_INT8", "0") == "1"
+
+NIVELES_OPTIMIZACION = {
+    "ninguno": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basico": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extendido": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "todo": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+MODOS_EJECUCION = {
+    "secuencial": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "paralelo": ort.ExecutionMode.ORT_PARALLEL,
+}
+
+PROVEEDORES = ["CPUExecutionProvider"]
+
+# ====================================================
+# OPCIONES DE SESIÓN
+# ====================================================
+def crear_opciones(intra_op=None, inter_op=None, nivel=None, modo=None):
+    """Construye las SessionOptions a partir de los parámetros o de la configuración global"""
+    nivel = nivel or ORT_NIVEL_OPTIMIZACION
+    modo = modo or ORT_MODO_EJECUCION
+    if nivel not in NIVELES_OPTIMIZACION:
+        raise ValueError(f"Nivel de optimización desconocido: {nivel}")
+    if modo not in MODOS_EJECUCION:
+        raise ValueError(f"Modo de ejecución desconocido: {modo}")
+
+    opciones = ort.SessionOptions()
+    opciones.intra_op_num_threads = ORT_INTRA_OP_THREADS if intra_op is None else intra_op
+    opciones.inter_op_num_threads = ORT_INTER_OP_THREADS if inter_op is None else inter_op
+    opciones.graph_optimization_level = NIVELES_OPTIMIZACION[nivel]
+    opciones.execution_mode = MODOS_EJECUCION[modo]
+    return opciones
+
+def ruta_variante_int8(ruta_modelo):
+    """Ruta de la variante cuantizada: gru_48.onnx → gru_48.int8.onnx"""
+    ruta_modelo = Path(ruta_modelo)
+    return ruta_modelo.with_name(f"{ruta_modelo.stem}.int8.onnx")
+
+def huella_modelo(ruta_modelo):
+    """Hash del contenido del modelo: identifica la fuente aunque se reemplace conservando la fecha (cp -p, rsync -a)"""
+    h = hashlib.sha256()
+    with open(ruta_modelo, "rb") as f:
+        for bloque in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(bloque)
+    return h.hexdigest()[:16]
+
+def nivel_guardado(nivel):
+    """Nivel con que se guarda el grafo: ORT advierte que lo optimizado con "todo" depende del hardware,
+    así que se guarda como mucho con "extendido" y el resto se aplica al cargarlo"""
+    return "extendido" if nivel == "todo" else nivel
+
+def ruta_cache_optimizado(ruta_modelo, nivel=None, huella=None):
+    """Ruta del grafo optimizado en caché, una por modelo (según su contenido) y nivel de optimización"""
+    ruta_modelo = Path(ruta_modelo)
+    nivel = nivel_guardado(nivel or ORT_NIVEL_OPTIMIZACION)
+    huella = huella or huella_modelo(ruta_modelo)
+    return ruta_modelo.parent / ".cache" / f"{ruta_modelo.stem}.{nivel}.{huella}.onnx"
+
+def limpiar_cache_optimizado(ruta_cache):
+    """Borra los grafos guardados de otras versiones del mismo modelo y nivel"""
+    prefijo = ruta_cache.name.rsplit(".", 2)[0]
+    for ruta in ruta_cache.parent.glob(f"{prefijo}.*.onnx"):
+        if ruta != ruta_cache:
+            ruta.unlink(missing_ok=True)
+
+def resolver_modelo(ruta_modelo, int8=None):
+    """Devuelve la variante int8 si está habilitada y existe, si no el modelo float"""
+    int8 = MODELO_INT8 if int8 is None else int8
+    if int8:
+        ruta_int8 = ruta_variante_int8(ruta_modelo)
+        if ruta_int8.exists():
+            return ruta_int8
+        print(f"⚠️ No existe {ruta_int8.name}, se usa el modelo float")
+    return Path(ruta_modelo)
+
+# ====================================================
+# CREACIÓN DE SESIONES
+# ====================================================
+def crear_sesion(ruta_modelo, intra_op=None, inter_op=None, nivel=None, modo=None, usar_cache=None):
+    """Crea una InferenceSession reutilizando el grafo optimizado guardado en disco si está vigente"""
+    ruta_modelo = Path(ruta_modelo)
+    nivel = nivel or ORT_NIVEL_OPTIMIZACION
+    usar_cache = ORT_CACHE_OPTIMIZADO if usar_cache is None else usar_cache
+
+    if not usar_cache or nivel == "ninguno":
+        opciones = crear_opciones(intra_op, inter_op, nivel, modo)
+        return ort.InferenceSession(str(ruta_modelo), sess_options=opciones, providers=PROVEEDORES)
+
+    # El nombre del archivo lleva el hash del modelo: si el modelo cambia, la caché anterior no se usa
+    ruta_cache = ruta_cache_optimizado(ruta_modelo, nivel)
+    # Al cargar la caché solo falta aplicar las optimizaciones propias del hardware (nivel "todo")
+    nivel_carga = "todo" if nivel == "todo" else "ninguno"
+    if ruta_cache.exists():
+        try:
+            opciones = crear_opciones(intra_op, inter_op, nivel_carga, modo)
+            return ort.InferenceSession(str(ruta_cache), sess_options=opciones, providers=PROVEEDORES)
+        except Exception as e:
+            print(f"⚠️ Caché de modelo optimizado inválida ({ruta_cache.name}): {e}")
+
+    # Optimizar y guardar el grafo en un archivo temporal por proceso, luego se reemplaza de forma atómica
+    # para que varios workers arrancando a la vez no lean un archivo a medio escribir
+    ruta_tmp = ruta_cache.with_name(f"{ruta_cache.name}.{os.getpid()}.tmp")
+    try:
+        ruta_cache.parent.mkdir(parents=True, exist_ok=True)
+        opciones = crear_opciones(intra_op, inter_op, nivel_guardado(nivel), modo)
+        opciones.optimized_model_filepath = str(ruta_tmp)
+        ort.InferenceSession(str(ruta_modelo), sess_options=opciones, providers=PROVEEDORES)
+        os.replace(ruta_tmp, ruta_cache)
+        limpiar_cache_optimizado(ruta_cache)
+        print(f"💾 Modelo optimizado guardado en caché: {ruta_cache.name}")
+        opciones = crear_opciones(intra_op, inter_op, nivel_carga, modo)
+        return ort.InferenceSession(str(ruta_cache), sess_options=opciones, providers=PROVEEDORES)
+    except OSError as e:
+        print(f"⚠️ No se pudo guardar el modelo optimizado en caché: {e}")
+        ruta_tmp.unlink(missing_ok=True)
+        opciones = crear_opciones(intra_op, inter_op, nivel, modo)
+        return ort.InferenceSession(str(ruta_modelo), sess_options=opciones, providers=PROVEEDORES)
+
+def inferir(sesion, entrada):
+    """Ejecuta la sesión sobre un lote (N × pasos × features) y devuelve las salidas (N × clases)"""
+    input_name = sesion.get_inputs()[0].name
+    return sesion.run(None, {input_name: np.ascontiguousarray(entrada, dtype=np.float32)})[0]
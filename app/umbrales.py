@@ -0,0 +1,213 @@
+import json
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from pymongo import UpdateOne
+
+from .alertas import enviar_alerta
+from planificador import programar
+
+# Configuración
+UMBRALES_CONFIG = os.environ.get("UMBRALES_CONFIG", str(Path(__file__).parent / "umbrales.json"))
+UMBRALES_HISTERESIS = float(os.environ.get("UMBRALES_HISTERESIS", "0.05"))     # Fracción del rango
+UMBRALES_DURACION_MIN_S = float(os.environ.get("UMBRALES_DURACION_MIN_S", "60"))
+UMBRALES_PERSISTIR_S = int(os.environ.get("UMBRALES_PERSISTIR_S", "60"))
+COLECCION_ESTADO_UMBRALES = "estado_umbrales"
+
+# Rangos por defecto (los mismos que usa el dashboard)
+UMBRAL_POR_DEFECTO = {
+    "temperatura": (18, 27),
+    "ph": (6.0, 9.5),
+    "oxigeno": (3, 25),
+    "luz": (0, 5000)
+}
+
+# Estados de cada (dominio, dispositivo, variable)
+NORMAL = "normal"
+PENDIENTE = "pendiente"  # Fuera de rango, pero aún no cumple la duración mínima
+ALARMA = "alarma"
+
+def cargar_configuracion(ruta=UMBRALES_CONFIG):
+    """Lee el JSON {"por_defecto": {...}, "dominios": {...}, "dispositivos": {...}} de rangos [min, max]"""
+    ruta = Path(ruta)
+    if not ruta.exists():
+        return {"por_defecto": UMBRAL_POR_DEFECTO}
+    with open(ruta, encoding="utf-8") as f:
+        return json.load(f)
+
+# ====================================================
+# MOTOR DE UMBRALES
+# ====================================================
+class MotorUmbrales:
+    """Evalúa cada lectura recibida contra los rangos de su dominio y dispositivo.
+
+    Una variable pasa a alarma solo si sigue fuera de rango durante `duracion_min_s`, y
+    vuelve a normal solo cuando entra al rango reducido por la histéresis, para que un
+    valor que oscila en el borde no genere una alerta por lectura. Los rangos se resuelven
+    una vez por (dominio, dispositivo) y quedan en un diccionario, así cada lectura cuesta
+    una búsqueda por variable. El estado vive en memoria y se guarda periódicamente.
+    """
+
+    def __init__(self, configuracion, histeresis=UMBRALES_HISTERESIS,
+                 duracion_min_s=UMBRALES_DURACION_MIN_S, notificar=enviar_alerta):
+        self.por_defecto = configuracion.get("por_defecto", UMBRAL_POR_DEFECTO)
+        self.dominios = configuracion.get("dominios", {})
+        self.dispositivos = configuracion.get("dispositivos", {})
+        self.histeresis = histeresis
+        self.duracion_min_s = duracion_min_s
+        self.notificar = notificar
+
+        self._rangos = {}       # (dominio, dispositivo) -> {variable: (min, max, min_salida, max_salida)}
+        self._estados = {}      # (dominio, dispositivo, variable) -> {"estado", "desde", "valor"}
+        self._modificados = set()
+        self._lock = threading.Lock()
+
+    def rangos(self, dominio, disp):
+        """Rangos efectivos del dispositivo: los del dispositivo pisan a los del dominio y estos a los por defecto"""
+        clave = (dominio, disp)
+        rangos = self._rangos.get(clave)
+        if rangos is None:
+            combinados = {**self.por_defecto, **self.dominios.get(dominio, {}), **self.dispositivos.get(disp, {})}
+            rangos = {}
+            for variable, (minimo, maximo) in combinados.items():
+                margen = (maximo - minimo) * self.histeresis
+                rangos[variable] = (minimo, maximo, minimo + margen, maximo - margen)
+            self._rangos[clave] = rangos
+        return rangos
+
+    def evaluar(self, dominio, lectura):
+        """Actualiza el estado con una lectura y devuelve los eventos (alarma o recuperación) generados"""
+        disp = lectura.get("id_dispositivo")
+        tiempo = lectura.get("tiempo") or datetime.utcnow()
+        eventos = []
+        with self._lock:
+            for variable, (minimo, maximo, min_salida, max_salida) in self.rangos(dominio, disp).items():
+                valor = lectura.get(variable)
+                if not isinstance(valor, (int, float)) or isinstance(valor, bool):
+                    continue
+                evento = self._transicion((dominio, disp, variable), valor, tiempo,
+                                          minimo, maximo, min_salida, max_salida)
+                if evento:
+                    eventos.append(evento)
+
+        for evento in eventos:
+            self.notificar(mensaje_evento(evento))
+        return eventos
+
+    def _transicion(self, clave, valor, tiempo, minimo, maximo, min_salida, max_salida):
+        estado = self._estados.get(clave)
+        fuera = valor < minimo or valor > maximo
+
+        if estado is None or estado["estado"] == NORMAL:
+            if not fuera:
+                return None
+            estado = {"estado": PENDIENTE, "desde": tiempo, "valor": valor}
+            self._guardar(clave, estado)
+            # Con duración mínima 0 la alarma es inmediata
+            if self.duracion_min_s > 0:
+                return None
+
+        if estado["estado"] == PENDIENTE:
+            if not fuera:
+                self._guardar(clave, {"estado": NORMAL, "desde": tiempo, "valor": valor})
+                return None
+            estado["valor"] = valor
+            if (tiempo - estado["desde"]).total_seconds() < self.duracion_min_s:
+                return None
+            self._guardar(clave, {"estado": ALARMA, "desde": estado["desde"], "valor": valor})
+            return self._evento(clave, ALARMA, valor, estado["desde"], tiempo, minimo, maximo)
+
+        # En alarma: solo se recupera dentro del rango reducido por la histéresis
+        estado["valor"] = valor
+        if min_salida <= valor <= max_salida:
+            inicio = estado["desde"]
+            self._guardar(clave, {"estado": NORMAL, "desde": tiempo, "valor": valor})
+            return self._evento(clave, "recuperado", valor, inicio, tiempo, minimo, maximo)
+        return None
+
+    def _guardar(self, clave, estado):
+        self._estados[clave] = estado
+        self._modificados.add(clave)
+
+    def _evento(self, clave, tipo, valor, inicio, tiempo, minimo, maximo):
+        dominio, disp, variable = clave
+        return {
+            "tipo": tipo, "dominio": dominio, "id_dispositivo": disp, "variable": variable,
+            "valor": valor, "minimo": minimo, "maximo": maximo, "inicio": inicio, "tiempo": tiempo,
+        }
+
+    # --- PERSISTENCIA ---
+    def cargar_estado(self, col_estado):
+        """Recupera el estado guardado (por ejemplo tras un reinicio de la API)"""
+        with self._lock:
+            for doc in col_estado.find({}, {"_id": 0}):
+                clave = (doc["dominio"], doc["id_dispositivo"], doc["variable"])
+                self._estados[clave] = {"estado": doc["estado"], "desde": doc["desde"], "valor": doc.get("valor")}
+        print(f"📥 Estado de umbrales recuperado ({len(self._estados)} variables)")
+
+    def persistir(self, col_estado):
+        """Guarda con un bulk_write solo los estados que cambiaron desde la última vez"""
+        with self._lock:
+            modificados, self._modificados = self._modificados, set()
+            operaciones = [
+                UpdateOne(
+                    {"dominio": dominio, "id_dispositivo": disp, "variable": variable},
+                    {"$set": dict(self._estados[(dominio, disp, variable)])},
+                    upsert=True
+                )
+                for dominio, disp, variable in modificados
+            ]
+        if operaciones:
+            try:
+                col_estado.bulk_write(operaciones, ordered=False)
+            except Exception:
+                # Se vuelven a marcar para el próximo intento
+                with self._lock:
+                    self._modificados |= modificados
+                raise
+        return len(operaciones)
+
+    def estado(self):
+        """Variables actualmente en alarma o pendientes"""
+        with self._lock:
+            return [
+                {"dominio": d, "id_dispositivo": disp, "variable": v, **e}
+                for (d, disp, v), e in self._estados.items() if e["estado"] != NORMAL
+            ]
+
+def mensaje_evento(evento):
+    """Texto de la alerta de un evento del motor de umbrales"""
+    variable = evento["variable"].upper()
+    if evento["tipo"] == ALARMA:
+        return (
+            f"🚨 *{variable} fuera de rango*\n"
+            f"Dispositivo: `{evento['id_dispositivo']}` ({evento['dominio']})\n"
+            f"Valor: *{evento['valor']:.2f}* (rango [{evento['minimo']} – {evento['maximo']}])\n"
+            f"🕒 Desde {evento['inicio'].strftime('%Y-%m-%d %H:%M')}"
+        )
+    return (
+        f"✅ *{variable} normalizado*\n"
+        f"Dispositivo: `{evento['id_dispositivo']}` ({evento['dominio']})\n"
+        f"Valor: *{evento['valor']:.2f}*\n"
+        f"🕒 {evento['tiempo'].strftime('%Y-%m-%d %H:%M')}"
+    )
+
+# Motor compartido por el proceso de la API
+_motor = None
+
+def obtener_motor():
+    global _motor
+    if _motor is None:
+        _motor = MotorUmbrales(cargar_configuracion())
+    return _motor
+
+def iniciar_motor(db):
+    """Crea el motor, recupera su estado y programa el guardado periódico en MongoDB"""
+    motor = obtener_motor()
+    col_estado = db[COLECCION_ESTADO_UMBRALES]
+    col_estado.create_index([("dominio", 1), ("id_dispositivo", 1), ("variable", 1)], unique=True)
+    motor.cargar_estado(col_estado)
+    programar("persistir_umbrales", lambda: motor.persistir(col_estado), intervalo_s=UMBRALES_PERSISTIR_S)
+    return motor
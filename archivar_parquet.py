@@ -0,0 +1,183 @@
+"""
+Archiva en Parquet las lecturas antiguas de las colecciones "dominio_*".
+
+Las lecturas con más de N días se escriben en archivos Parquet comprimidos,
+particionados por dominio y mes (UTC):
+    ARCHIVO_PARQUET_DIR/dominio=<dominio>/mes=<AAAA-MM>/parte-<desde>-<hasta>.parquet
+Con --borrar, cada lote se elimina de MongoDB (por _id) solo después de escribir
+su archivo. database.leer_lecturas junta lo archivado con lo que sigue en MongoDB
+y descarta los duplicados por _id, así que interrumpir o repetir el proceso no
+pierde ni duplica lecturas.
+Sin --borrar se recuerda hasta dónde se archivó cada dominio (estado.json) para
+no volver a escribir lo mismo en la próxima ejecución.
+
+Uso (desde la raíz del repo):
+    python archivar_parquet.py --dias 90 --simular
+    python archivar_parquet.py --dias 90 --borrar
+    python archivar_parquet.py --dominio dominio_terreno --dias 30
+
+Igual que con las imágenes, MongoDB no devuelve el espacio liberado hasta
+ejecutar `compact` sobre la colección.
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from database import obtener_db, asegurar_indices_dominio, directorio_particion, ARCHIVO_PARQUET_DIR, CAMPOS_SENSORES
+
+ARCHIVO_ESTADO = "estado.json"
+# Filas por grupo dentro de cada archivo: el lector salta los grupos fuera del rango con sus estadísticas
+FILAS_POR_GRUPO = 50000
+
+def leer_estado(directorio):
+    ruta = Path(directorio) / ARCHIVO_ESTADO
+    if not ruta.exists():
+        return {}
+    with open(ruta, encoding="utf-8") as f:
+        return json.load(f)
+
+def guardar_estado(directorio, estado):
+    ruta = Path(directorio) / ARCHIVO_ESTADO
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    temporal = ruta.with_suffix(".tmp")
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(estado, f, indent=2)
+    temporal.replace(ruta)
+
+def a_numero(valor):
+    """Valor de sensor como float, o None si no es numérico (igual que obtener_datos_df)"""
+    if valor is None:
+        return None
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return None
+
+def documentos_a_tabla(documentos):
+    """Tabla Arrow con _id (texto), tiempo, id_dispositivo y las variables escalares de los documentos.
+
+    Las variables de sensores (CAMPOS_SENSORES) son siempre float64, con los valores no numéricos
+    como nulos, para que todos los meses tengan el mismo esquema. En las demás, los números se
+    guardan como float64, los booleanos (ej. "manual") como bool y los textos como string; los
+    campos anidados no se archivan.
+    """
+    tipos = {campo: pa.float64() for campo in CAMPOS_SENSORES if any(campo in doc for doc in documentos)}
+    for doc in documentos:
+        for campo, valor in doc.items():
+            if campo in ("_id", "tiempo", "id_dispositivo") or campo in CAMPOS_SENSORES or valor is None:
+                continue
+            if isinstance(valor, bool):
+                tipo = pa.bool_()
+            elif isinstance(valor, (int, float)):
+                tipo = pa.float64()
+            elif isinstance(valor, str):
+                tipo = pa.string()
+            else:
+                continue
+            # Un campo con tipos mezclados queda como texto
+            if tipos.setdefault(campo, tipo) != tipo:
+                tipos[campo] = pa.string()
+
+    columnas = {
+        "_id": pa.array([str(doc["_id"]) for doc in documentos], pa.string()),
+        "tiempo": pa.array([doc.get("tiempo") for doc in documentos], pa.timestamp("ms")),
+        "id_dispositivo": pa.array([doc.get("id_dispositivo") for doc in documentos], pa.string()),
+    }
+    for campo, tipo in sorted(tipos.items()):
+        valores = [doc.get(campo) for doc in documentos]
+        if campo in CAMPOS_SENSORES:
+            valores = [a_numero(v) for v in valores]
+        elif tipo == pa.string():
+            valores = [None if v is None else str(v) for v in valores]
+        elif tipo == pa.float64():
+            valores = [float(v) if isinstance(v, (int, float)) and not isinstance(v, bool) else None for v in valores]
+        else:
+            valores = [v if isinstance(v, bool) else None for v in valores]
+        columnas[campo] = pa.array(valores, tipo)
+    return pa.table(columnas)
+
+def escribir_lote(dominio, documentos, directorio):
+    """Escribe un lote (ordenado por tiempo, todo del mismo mes) y devuelve la ruta del archivo"""
+    tabla = documentos_a_tabla(documentos)
+    primero, ultimo = documentos[0]["tiempo"], documentos[-1]["tiempo"]
+    carpeta = directorio_particion(dominio, primero.strftime("%Y-%m"), directorio)
+    carpeta.mkdir(parents=True, exist_ok=True)
+    ruta = carpeta / f"parte-{primero:%Y%m%dT%H%M%S}-{ultimo:%Y%m%dT%H%M%S}-{int(time.time() * 1000)}.parquet"
+    # Se escribe con otro nombre y se renombra: un archivo a medias nunca queda visible para el lector
+    temporal = ruta.with_suffix(".tmp")
+    pq.write_table(tabla, temporal, compression="zstd", row_group_size=FILAS_POR_GRUPO)
+    temporal.replace(ruta)
+    return ruta
+
+def archivar_dominio(db, dominio, corte, directorio=ARCHIVO_PARQUET_DIR, borrar=False, lote=50000, simular=False):
+    collection = db[dominio]
+    estado = leer_estado(directorio)
+    filtro = {"tiempo": {"$lt": corte}}
+    # Sin borrar, lo anterior a la marca ya está archivado; borrando, lo que queda en MongoDB es lo pendiente
+    marca = estado.get(dominio)
+    if marca and not borrar:
+        filtro["tiempo"]["$gte"] = datetime.fromisoformat(marca)
+
+    total = collection.count_documents(filtro)
+    print(f"🗄️ {dominio}: {total} lecturas anteriores a {corte:%Y-%m-%d} por archivar")
+    if simular or total == 0:
+        return 0
+
+    archivadas, archivos = 0, 0
+    t0 = time.perf_counter()
+    pendientes = []
+
+    def cerrar_lote():
+        nonlocal archivadas, archivos
+        ruta = escribir_lote(dominio, pendientes, directorio)
+        if borrar:
+            collection.delete_many({"_id": {"$in": [doc["_id"] for doc in pendientes]}})
+        archivadas += len(pendientes)
+        archivos += 1
+        print(f"  {archivadas}/{total} archivadas → {ruta.name} ({time.perf_counter() - t0:.1f} s)")
+        # La marca avanza con cada archivo: si el proceso se corta, la próxima ejecución sigue desde aquí.
+        # Se usa el tiempo del último documento (con $gte), así que en el peor caso se repiten las lecturas
+        # de ese instante, que el lector descarta por _id
+        estado[dominio] = pendientes[-1]["tiempo"].isoformat()
+        guardar_estado(directorio, estado)
+        pendientes.clear()
+
+    for doc in collection.find(filtro, batch_size=5000).sort("tiempo", 1):
+        if doc.get("tiempo") is None:
+            continue
+        # Cada archivo pertenece a un solo mes
+        if pendientes and (len(pendientes) >= lote or doc["tiempo"].strftime("%Y-%m") != pendientes[0]["tiempo"].strftime("%Y-%m")):
+            cerrar_lote()
+        pendientes.append(doc)
+    if pendientes:
+        cerrar_lote()
+
+    estado[dominio] = corte.isoformat()
+    guardar_estado(directorio, estado)
+    print(f"✔️ {dominio}: {archivadas} lecturas en {archivos} archivos{' (borradas de MongoDB)' if borrar else ''}")
+    return archivadas
+
+def main():
+    parser = argparse.ArgumentParser(description="Archiva en Parquet las lecturas antiguas de los dominios")
+    parser.add_argument("--dias", type=int, default=90, help="Se archivan las lecturas con más de estos días")
+    parser.add_argument("--dominio", action="append", help="Dominio a archivar (se puede repetir; por defecto todos)")
+    parser.add_argument("--directorio", default=ARCHIVO_PARQUET_DIR, help="Carpeta del archivo Parquet")
+    parser.add_argument("--lote", type=int, default=50000, help="Lecturas máximas por archivo")
+    parser.add_argument("--borrar", action="store_true", help="Eliminar de MongoDB lo archivado")
+    parser.add_argument("--simular", action="store_true", help="Solo contar las lecturas por archivar")
+    args = parser.parse_args()
+
+    db = obtener_db()
+    dominios = args.dominio or sorted(c for c in db.list_collection_names() if c.startswith("dominio_"))
+    corte = datetime.utcnow() - timedelta(days=args.dias)
+    for dominio in dominios:
+        asegurar_indices_dominio(dominio, db)
+        archivar_dominio(db, dominio, corte, args.directorio, args.borrar, args.lote, args.simular)
+
+if __name__ == "__main__":
+    main()
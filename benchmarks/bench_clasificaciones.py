@@ -0,0 +1,312 @@
+"""
+Benchmark por etapas del servicio de clasificaciones.
+
+Genera historiales sintéticos de sensores (48 h por dispositivo) en una base
+Mongo local y mide por separado cada etapa de `servicio_clasificaciones`:
+carga de datos, `preparar_secuencia` (features), limpieza, escalado e
+inferencia ONNX por lote y escritura de resultados. Reporta tiempo, throughput y memoria
+por etapa en JSON, para comparar entre commits. La memoria se mide de dos formas:
+  - rss_pico_kb: crecimiento del RSS del proceso durante la etapa (muestreado cada 1 ms),
+    que incluye las arenas de ONNX Runtime y los buffers nativos de NumPy. Se mide en una
+    pasada previa con todos los dispositivos; memoria que el proceso ya había reservado
+    (ej. en un tamaño anterior) no vuelve a aparecer como crecimiento.
+  - pico_heap_python_kb: pico del heap de Python (tracemalloc) sobre una muestra; no ve la
+    memoria nativa, sirve para detectar copias innecesarias en el código Python.
+Además se informa rss_max_proceso_kb, el máximo RSS del proceso hasta ese tamaño.
+
+Uso (desde la raíz del repo):
+    python -m benchmarks.bench_clasificaciones --salida bench.json
+    python -m benchmarks.bench_clasificaciones --comparar bench_base.json
+    python -m benchmarks.bench_clasificaciones --mongo-uri mongodb://localhost:27017
+
+Sin --mongo-uri se usa `mongomock` (pip install mongomock) como base en memoria.
+Los tiempos de carga/escritura con mongomock no representan la red de Atlas,
+pero sí sirven para detectar regresiones del código del servicio. mongomock no
+usa índices (cada consulta recorre la colección), por lo que con 1000
+dispositivos conviene apuntar a un mongod local con --mongo-uri.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+from app import servicio_clasificaciones as svc
+
+TAMANOS_POR_DEFECTO = [10, 100, 1000]
+ETAPAS = ["carga_datos", "preparar_secuencia", "limpieza", "scaler_transform", "onnx_run", "escritura"]
+
+# ====================================================
+# BASE DE DATOS LOCAL Y DATOS SINTÉTICOS
+# ====================================================
+def abrir_db(mongo_uri=None):
+    """Devuelve una base de datos vacía para el benchmark (mongod local o mongomock)"""
+    if mongo_uri:
+        from pymongo import MongoClient
+        client = MongoClient(mongo_uri)
+    else:
+        import mongomock
+        client = mongomock.MongoClient()
+    nombre = "bench_biorreactor"
+    client.drop_database(nombre)
+    return client[nombre]
+
+def generar_historial(col_datos, n_dispositivos, ahora, intervalo_min, semilla):
+    """Inserta 48 h de lecturas por dispositivo con tendencias y ruido realistas"""
+    rng = np.random.default_rng(semilla)
+    pasos = int(48 * 60 / intervalo_min)
+    docs = []
+    for i in range(n_dispositivos):
+        ph = rng.uniform(6.5, 9.0) + np.cumsum(rng.normal(0, 0.02, pasos))
+        oxigeno = rng.uniform(4, 20) + np.cumsum(rng.normal(0, 0.1, pasos))
+        temperatura = rng.uniform(18, 27) + rng.normal(0, 0.2, pasos)
+        luz = rng.uniform(0, 3000, pasos)
+        for k in range(pasos):
+            docs.append({
+                "id_dispositivo": f"bench_{i:04d}",
+                "tiempo": ahora - timedelta(minutes=intervalo_min * (pasos - k)),
+                "temperatura": float(temperatura[k]),
+                "ph": float(ph[k]),
+                "oxigeno": float(oxigeno[k]),
+                "luz": float(luz[k]),
+            })
+    col_datos.insert_many(docs)
+    col_datos.create_index([("id_dispositivo", 1), ("tiempo", 1)])
+    return len(docs)
+
+# ====================================================
+# MEMORIA DEL PROCESO (RSS)
+# ====================================================
+def rss_actual():
+    """RSS actual del proceso en bytes (psutil si está instalado, si no /proc en Linux)"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return None
+
+def rss_maximo_proceso():
+    """Máximo RSS del proceso desde que arrancó, en bytes (ru_maxrss viene en KB en Linux y en bytes en macOS)"""
+    maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maximo if sys.platform == "darwin" else maximo * 1024
+
+class MuestreadorRSS:
+    """Muestrea el RSS en un hilo mientras dura el bloque; `crecimiento` es el pico menos el RSS inicial"""
+
+    def __init__(self, intervalo_s=0.001):
+        self.intervalo_s = intervalo_s
+        self.crecimiento = 0
+        self._detener = threading.Event()
+
+    def _muestrear(self):
+        while not self._detener.wait(self.intervalo_s):
+            self._pico = max(self._pico, rss_actual())
+
+    def __enter__(self):
+        self._base = self._pico = rss_actual()
+        self._hilo = threading.Thread(target=self._muestrear, daemon=True)
+        self._hilo.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._detener.set()
+        self._hilo.join()
+        self._pico = max(self._pico, rss_actual())
+        self.crecimiento = self._pico - self._base
+        return False
+
+# ====================================================
+# EJECUCIÓN POR ETAPAS
+# ====================================================
+def ejecutar_etapas(db, desde, medir_memoria=False, max_dispositivos=None, medir_rss=False):
+    """Recorre los dispositivos como el servicio, acumulando tiempo y memoria por etapa"""
+    col_datos = db["datos"]
+    col_clasificacion = db["clasificaciones"]
+    col_estado = db["estado_clasificacion"]
+
+    tiempos = dict.fromkeys(ETAPAS, 0.0)
+    picos = dict.fromkeys(ETAPAS, 0)
+    picos_rss = dict.fromkeys(ETAPAS, 0)
+    conteos = dict.fromkeys(ETAPAS, 0)
+
+    def medir(etapa, funcion, *args):
+        if medir_memoria:
+            tracemalloc.reset_peak()
+            base, _ = tracemalloc.get_traced_memory()
+        muestreador = MuestreadorRSS() if medir_rss else None
+        t0 = time.perf_counter()
+        if muestreador:
+            with muestreador:
+                resultado = funcion(*args)
+            picos_rss[etapa] = max(picos_rss[etapa], muestreador.crecimiento)
+        else:
+            resultado = funcion(*args)
+        tiempos[etapa] += time.perf_counter() - t0
+        conteos[etapa] += 1
+        if medir_memoria:
+            _, pico = tracemalloc.get_traced_memory()
+            picos[etapa] = max(picos[etapa], pico - base)
+        return resultado
+
+    dispositivos = col_datos.distinct("id_dispositivo")[:max_dispositivos]
+    modelo = svc.CATALOGO.modelo(svc.COLECCION_DATOS)
+
+    # Como en el servicio: carga y features por dispositivo; limpieza, escalado e inferencia en un solo lote
+    secuencias, validos = [], []
+    for disp in dispositivos:
+        df = medir("carga_datos", svc.cargar_datos_dispositivo, col_datos, disp, desde)
+        seq, error = medir("preparar_secuencia", svc.extraer_features, df)
+        if error:
+            continue
+        secuencias.append(seq)
+        validos.append(disp)
+    resultados = []
+    if secuencias:
+        limpias, validas, _ = medir("limpieza", svc.limpiar_secuencias, secuencias)
+        validos = [disp for disp, ok in zip(validos, validas) if ok]
+        entrada = medir("scaler_transform", svc.escalar_lote, limpias[validas], modelo.scaler)
+        salida = medir("onnx_run", svc.inferir, modelo.sesion, entrada)
+        resultados = svc.interpretar_lote(salida, modelo.encoder)
+
+    # La escritura incluye la lectura previa de fases y los bulk_write del final, como en el servicio
+    medir("escritura", svc.leer_fases_anteriores, col_estado, validos)
+    historicos, estados = [], []
+    ahora = datetime.utcnow()
+    for disp, (fase, proba) in zip(validos, resultados):
+        historico, estado = svc.operaciones_clasificacion(disp, fase, proba, ahora, modelo.version)
+        historicos.append(historico)
+        estados.append(estado)
+    medir("escritura", svc.guardar_resultados, col_clasificacion, col_estado, historicos, estados)
+
+    return tiempos, picos, picos_rss, conteos
+
+def benchmark_tamano(n_dispositivos, args):
+    db = abrir_db(args.mongo_uri)
+    ahora = datetime.utcnow()
+    n_docs = generar_historial(db["datos"], n_dispositivos, ahora, args.intervalo_min, args.semilla)
+    desde = ahora - timedelta(hours=48)
+
+    # Pasada de RSS con todos los dispositivos (el lote de ONNX y sus arenas crecen con la cantidad);
+    # va primero para que el crecimiento de memoria nativa de este tamaño quede en sus etapas
+    picos_rss = {}
+    if not args.sin_memoria and rss_actual() is not None:
+        _, _, picos_rss, _ = ejecutar_etapas(db, desde, medir_rss=True)
+        db["clasificaciones"].drop()
+        db["estado_clasificacion"].drop()
+
+    # Pasada de tiempo sin muestreo ni tracemalloc (su overhead distorsiona los tiempos)
+    tiempos, _, _, conteos = ejecutar_etapas(db, desde)
+
+    # Pasada de heap de Python sobre una muestra: el pico por llamada no depende de la cantidad de dispositivos
+    picos = {}
+    if not args.sin_memoria:
+        db["clasificaciones"].drop()
+        db["estado_clasificacion"].drop()
+        tracemalloc.start()
+        _, picos, _, _ = ejecutar_etapas(db, desde, medir_memoria=True, max_dispositivos=args.muestra_memoria)
+        tracemalloc.stop()
+
+    etapas = {}
+    for etapa in ETAPAS:
+        segundos = tiempos[etapa]
+        etapas[etapa] = {
+            "segundos": segundos,
+            "llamadas": conteos[etapa],
+            "throughput_por_s": n_dispositivos / segundos if segundos > 0 else None,
+            "rss_pico_kb": picos_rss[etapa] / 1024 if etapa in picos_rss else None,
+            "pico_heap_python_kb": picos[etapa] / 1024 if etapa in picos else None,
+        }
+
+    total = sum(tiempos.values())
+    return {
+        "dispositivos": n_dispositivos,
+        "documentos": n_docs,
+        "total_segundos": total,
+        "dispositivos_por_s": n_dispositivos / total if total > 0 else None,
+        "rss_max_proceso_kb": rss_maximo_proceso() / 1024,
+        "etapas": etapas,
+    }
+
+# ====================================================
+# REPORTE Y COMPARACIÓN
+# ====================================================
+def commit_actual():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+def comparar_reportes(base, actual, umbral_pct):
+    """Imprime el delta de tiempo por etapa y devuelve True si alguna supera el umbral"""
+    regresion = False
+    base_por_tamano = {r["dispositivos"]: r for r in base["resultados"]}
+    print(f"\n📊 Comparación contra {base.get('commit')} (umbral {umbral_pct:.0f}%)")
+    for r in actual["resultados"]:
+        anterior = base_por_tamano.get(r["dispositivos"])
+        if not anterior:
+            continue
+        for etapa in ETAPAS:
+            if etapa not in anterior["etapas"]:
+                continue  # Etapa agregada después del reporte de referencia
+            t_base = anterior["etapas"][etapa]["segundos"]
+            t_act = r["etapas"][etapa]["segundos"]
+            if t_base <= 0:
+                continue
+            delta = 100 * (t_act / t_base - 1)
+            marca = "❌" if delta > umbral_pct else "✔️"
+            regresion |= delta > umbral_pct
+            print(f"{marca} {r['dispositivos']:>5} disp. {etapa:<20} {t_base:8.3f}s → {t_act:8.3f}s ({delta:+.1f}%)")
+    return regresion
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark por etapas del servicio de clasificaciones")
+    parser.add_argument("--tamanos", type=int, nargs="+", default=TAMANOS_POR_DEFECTO, help="Cantidades de dispositivos")
+    parser.add_argument("--intervalo-min", type=int, default=30, help="Minutos entre lecturas sintéticas")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--mongo-uri", help="Mongo local para el benchmark (por defecto mongomock)")
+    parser.add_argument("--sin-memoria", action="store_true", help="Omitir las pasadas de medición de memoria")
+    parser.add_argument("--muestra-memoria", type=int, default=50, help="Dispositivos usados en la pasada de heap de Python")
+    parser.add_argument("--salida", help="Archivo JSON donde guardar el reporte")
+    parser.add_argument("--comparar", help="Reporte JSON de referencia para calcular deltas")
+    parser.add_argument("--umbral", type=float, default=20.0, help="Porcentaje de regresión tolerado por etapa")
+    args = parser.parse_args()
+
+    reporte = {
+        "commit": commit_actual(),
+        "fecha": datetime.utcnow().isoformat() + "Z",
+        "python": platform.python_version(),
+        "backend": "mongod" if args.mongo_uri else "mongomock",
+        "intervalo_min": args.intervalo_min,
+        "resultados": [],
+    }
+    for n in args.tamanos:
+        print(f"⏱️ Benchmark con {n} dispositivos...")
+        reporte["resultados"].append(benchmark_tamano(n, args))
+
+    texto = json.dumps(reporte, indent=2, ensure_ascii=False)
+    print(texto)
+    if args.salida:
+        Path(args.salida).write_text(texto, encoding="utf-8")
+        print(f"💾 Reporte guardado en {args.salida}")
+
+    if args.comparar:
+        base = json.loads(Path(args.comparar).read_text(encoding="utf-8"))
+        if comparar_reportes(base, reporte, args.umbral):
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
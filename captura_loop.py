@@ -1,24 +1,34 @@
-import time
 from datetime import datetime
-from capturar_imagenes import capturar_y_guardar
+from capturar_imagenes import capturar_y_guardar, cerrar_servicio, reenviar_pendientes
+from database import asegurar_indices_imagenes
+from planificador import programar
+from spool import SPOOL_REENVIO_S
 
 INTERVALO_MINUTOS = 60
 
+def capturar():
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Capturando imagen...")
+    capturar_y_guardar()
+
 def main():
     print("Iniciando loop de captura de imágenes.")
     try:
-        while True:
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Capturando imagen...")
-            try:
-                capturar_y_guardar()
-            except Exception as e:
-                print(f"[ERROR] Falló la captura: {e}")
-
-            print(f"Esperando {INTERVALO_MINUTOS} minutos...\n")
-            time.sleep(INTERVALO_MINUTOS * 60)
-
+        asegurar_indices_imagenes()
+    except Exception as e:
+        print(f"⚠️ No se pudo crear el índice de imágenes: {e}")
+    # Capturas alineadas al reloj (ej. cada hora en punto); si una captura se demora
+    # más que el intervalo, se salta el tick siguiente y queda registrado
+    tarea = programar("captura", capturar, INTERVALO_MINUTOS * 60, ejecutar_al_iniciar=True)
+    # Lo capturado durante un corte de conexión se reenvía en lotes cuando MongoDB vuelve
+    programar("reenviar_spool", reenviar_pendientes, SPOOL_REENVIO_S, ejecutar_al_iniciar=True)
+    try:
+        tarea.esperar()
     except KeyboardInterrupt:
+        tarea.detener()
         print("Captura detenida por el usuario.")
+    finally:
+        # Liberar las cámaras que quedan abiertas entre capturas
+        cerrar_servicio()
 
 if __name__ == "__main__":
     main()
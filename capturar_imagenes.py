@@ -1,56 +1,402 @@
 import cv2
-import base64
-from datetime import datetime
-from pymongo import MongoClient
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
 import pytz
+from bson import ObjectId
+from pymongo.errors import ConnectionFailure
+from database import obtener_db, guardar_imagen, COLECCION_IMAGENES, METRICAS_DOMINIO
+from spool import obtener_spool, insertar_o_encolar, manejador_mongo
 
-# Función para conexión con MongoDB
-def obtener_db():
-    mongo_uri = os.environ.get("MONGO_URI")
-    if not mongo_uri:
-        raise RuntimeError("❌ No se encontró la variable de entorno MONGO_URI")
-    client = MongoClient(mongo_uri)
-    db = client["biorreactor_app"]
-    return db["imagenes_camara"]
+# Cámaras a capturar: lista separada por comas de "nombre=fuente" o solo "fuente".
+# La fuente es el índice del dispositivo (0, 1...) o, con backend "archivo", la ruta de un video o imagen
+CAMARAS = os.environ.get("CAMARAS", "0")
+# Backend de video: dshow (Windows), v4l2 (Linux), msmf, auto, archivo o sintetica (pruebas sin cámara)
+CAMARA_BACKEND = os.environ.get("CAMARA_BACKEND", "dshow" if os.name == "nt" else "v4l2")
+# Frames que se descartan antes de guardar: con la cámara abierta entre capturas el buffer trae frames viejos
+CAMARA_DESCARTE = int(os.environ.get("CAMARA_DESCARTE", "5"))
+CAMARA_REINTENTOS = int(os.environ.get("CAMARA_REINTENTOS", "2"))
+CAPTURA_HILOS = int(os.environ.get("CAPTURA_HILOS", "0"))  # 0 = uno por cámara
 
-def capturar_y_guardar():
-    cap = cv2.VideoCapture(0, cv2.CAP_DSHOW)
-    
-    if not cap.isOpened():
-        print("No se pudo acceder a la cámara.")
-        return
+# Codificación: formato jpg o webp, calidad 1-100 y lado máximo en píxeles (0 = resolución original)
+IMAGEN_FORMATO = os.environ.get("IMAGEN_FORMATO", "jpg")
+IMAGEN_CALIDAD = int(os.environ.get("IMAGEN_CALIDAD", "90"))
+IMAGEN_LADO_MAX = int(os.environ.get("IMAGEN_LADO_MAX", "0"))
 
-    try:
-        ret, frame = cap.read()
-        if not ret:
-            print("Error al capturar imagen.")
+# Supresión de casi duplicados: si el dHash difiere en menos de DUPLICADO_DISTANCIA bits (de 64) respecto
+# de la última imagen guardada, solo se registra un latido. Cada IMAGEN_MAX_OMITIDAS omisiones seguidas
+# se guarda la imagen igual, para no quedar sin imágenes en periodos largos sin cambios
+DUPLICADO_DISTANCIA = int(os.environ.get("DUPLICADO_DISTANCIA", "4"))
+IMAGEN_MAX_OMITIDAS = int(os.environ.get("IMAGEN_MAX_OMITIDAS", "12"))
+
+# Región de interés "x,y,ancho,alto" en fracciones de la imagen (vacío = imagen completa)
+IMAGEN_ROI = os.environ.get("IMAGEN_ROI", "")
+# Nitidez (varianza del laplaciano) con la que el proxy de turbidez vale 0.5
+TURBIDEZ_ESCALA = float(os.environ.get("TURBIDEZ_ESCALA", "100"))
+# Píxeles con menos saturación que esto (0-255) no cuentan en el histograma de tono
+SATURACION_MIN = int(os.environ.get("SATURACION_MIN", "40"))
+# Escrituras que no se pudieron hacer por falta de conexión quedan en este archivo hasta reenviarse
+SPOOL_CAPTURA = os.environ.get("SPOOL_CAPTURA", "spool_captura.sqlite3")
+BINS_TONO = 12
+VERDE_TONO = (35, 85)  # Rango de tono verde en la escala de OpenCV (0-179)
+
+PARAMETROS_CALIDAD = {
+    "jpg": cv2.IMWRITE_JPEG_QUALITY,
+    "webp": cv2.IMWRITE_WEBP_QUALITY,
+}
+
+BACKENDS = {
+    "dshow": cv2.CAP_DSHOW,
+    "v4l2": cv2.CAP_V4L2,
+    "msmf": cv2.CAP_MSMF,
+    "auto": cv2.CAP_ANY,
+}
+
+def parsear_camaras(texto=CAMARAS):
+    """Convierte "reactor_1=0,reactor_2=1" en [("reactor_1", "0"), ("reactor_2", "1")]"""
+    camaras = []
+    for entrada in texto.split(","):
+        entrada = entrada.strip()
+        if not entrada:
+            continue
+        nombre, separador, fuente = entrada.partition("=")
+        if not separador:
+            nombre, fuente = f"camara_{entrada}", entrada
+        camaras.append((nombre.strip(), fuente.strip()))
+    return camaras
+
+# ====================================================
+# CODIFICACIÓN Y DETECCIÓN DE DUPLICADOS
+# ====================================================
+def codificar(frame, formato=IMAGEN_FORMATO, calidad=IMAGEN_CALIDAD, lado_max=IMAGEN_LADO_MAX):
+    """Reduce el frame si supera el lado máximo y lo codifica; devuelve (bytes, ancho, alto)"""
+    if formato not in PARAMETROS_CALIDAD:
+        raise ValueError(f"Formato de imagen no soportado: {formato}")
+    alto, ancho = frame.shape[:2]
+    if lado_max and max(alto, ancho) > lado_max:
+        escala = lado_max / max(alto, ancho)
+        ancho, alto = max(1, round(ancho * escala)), max(1, round(alto * escala))
+        frame = cv2.resize(frame, (ancho, alto), interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode(f".{formato}", frame, [PARAMETROS_CALIDAD[formato], calidad])
+    if not ok:
+        raise ValueError(f"No se pudo codificar la imagen como {formato}")
+    return buffer.tobytes(), ancho, alto
+
+def dhash(frame, lado=8):
+    """Hash perceptual por diferencias: compara píxeles vecinos de la imagen reducida a (lado+1) × lado"""
+    gris = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    reducida = cv2.resize(gris, (lado + 1, lado), interpolation=cv2.INTER_AREA)
+    bits = (reducida[:, 1:] > reducida[:, :-1]).flatten()
+    return int(np.packbits(bits).view(">u8")[0])
+
+def distancia_hash(a, b):
+    """Cantidad de bits distintos entre dos hashes"""
+    return bin(a ^ b).count("1")
+
+# ====================================================
+# MÉTRICAS DEL CULTIVO A PARTIR DEL FRAME
+# ====================================================
+def parsear_roi(texto=IMAGEN_ROI):
+    """Convierte "0.25,0.25,0.5,0.5" en una tupla de fracciones; None si no hay región configurada"""
+    if not texto.strip():
+        return None
+    roi = tuple(float(v) for v in texto.split(","))
+    if len(roi) != 4 or not all(0 <= v <= 1 for v in roi) or roi[2] <= 0 or roi[3] <= 0:
+        raise ValueError(f"IMAGEN_ROI inválida: {texto}")
+    return roi
+
+def recortar_roi(frame, roi):
+    if roi is None:
+        return frame
+    alto, ancho = frame.shape[:2]
+    x, y, w, h = roi
+    x0, y0 = int(x * ancho), int(y * alto)
+    x1, y1 = max(x0 + 1, int((x + w) * ancho)), max(y0 + 1, int((y + h) * alto))
+    return frame[y0:y1, x0:x1]
+
+def calcular_metricas(frame, roi=None):
+    """Métricas escalares de color y turbidez dentro de la región de interés, todas vectorizadas.
+
+    El tono medio es circular (179 y 0 son vecinos); la turbidez es un proxy relativo que crece
+    cuando la imagen pierde nitidez, y el histograma de tono se resume en tono dominante,
+    entropía y fracción de píxeles verdes.
+    """
+    region = recortar_roi(frame, roi)
+    hsv = cv2.cvtColor(region, cv2.COLOR_BGR2HSV)
+    gris = cv2.cvtColor(region, cv2.COLOR_BGR2GRAY)
+    b_media, g_media, r_media, _ = cv2.mean(region)
+    _, s_media, v_media, _ = cv2.mean(hsv)
+
+    # Tono medio circular sobre los píxeles con color (los grises no tienen tono definido)
+    tono = hsv[:, :, 0].astype(np.float32) * (2 * np.pi / 180)
+    con_color = hsv[:, :, 1] >= SATURACION_MIN
+    n_color = int(np.count_nonzero(con_color))
+    if n_color:
+        angulo = np.arctan2(np.sin(tono[con_color]).mean(), np.cos(tono[con_color]).mean())
+        h_media = round(float(np.mod(angulo, 2 * np.pi) * 180 / (2 * np.pi)), 3)
+    else:
+        h_media = None
+
+    histograma = cv2.calcHist([hsv], [0], con_color.astype(np.uint8), [BINS_TONO], [0, 180]).ravel()
+    total = histograma.sum()
+    if total:
+        p = histograma / total
+        entropia = float(-(p[p > 0] * np.log2(p[p > 0])).sum()) + 0.0
+        tono_dominante = float((np.argmax(p) + 0.5) * 180 / BINS_TONO)
+    else:
+        entropia, tono_dominante = 0.0, None
+    verdes = con_color & (hsv[:, :, 0] >= VERDE_TONO[0]) & (hsv[:, :, 0] <= VERDE_TONO[1])
+
+    nitidez = float(cv2.Laplacian(gris, cv2.CV_32F).var())
+    suma = b_media + g_media + r_media
+    return {
+        "h_media": h_media,
+        "s_media": round(s_media, 3),
+        "v_media": round(v_media, 3),
+        "verde_media": round(g_media, 3),
+        "verde_relativo": round(g_media / suma, 4) if suma else None,
+        "turbidez": round(1 / (1 + nitidez / TURBIDEZ_ESCALA), 4),
+        "nitidez": round(nitidez, 3),
+        "contraste": round(float(gris.std()), 3),
+        "tono_dominante": tono_dominante,
+        "entropia_tono": round(entropia, 4),
+        "fraccion_verde": round(np.count_nonzero(verdes) / gris.size, 4),
+        "fraccion_color": round(n_color / gris.size, 4),
+    }
+
+# ====================================================
+# CÁMARA CON CONEXIÓN PERSISTENTE
+# ====================================================
+class Camara:
+    """Mantiene abierta una fuente de video entre capturas y la reabre si falla"""
+
+    def __init__(self, nombre, fuente, backend=CAMARA_BACKEND, descarte=CAMARA_DESCARTE):
+        self.nombre = nombre
+        self.fuente = fuente
+        self.backend = backend
+        self.descarte = descarte
+        self.cap = None
+        self.reconexiones = 0
+        self._imagen_fija = None
+        self._rng = np.random.default_rng()
+
+    def abrir(self):
+        if self.backend == "sintetica":
             return
+        if self.backend == "archivo":
+            # Una imagen fija se lee una vez; un video se recorre en bucle
+            imagen = cv2.imread(self.fuente)
+            if imagen is not None:
+                self._imagen_fija = imagen
+                return
+            self.cap = cv2.VideoCapture(self.fuente)
+        else:
+            if self.backend not in BACKENDS:
+                raise ValueError(f"Backend de cámara desconocido: {self.backend}")
+            self.cap = cv2.VideoCapture(int(self.fuente), BACKENDS[self.backend])
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        if not self.cap.isOpened():
+            self.cap.release()
+            self.cap = None
+            raise ConnectionError(f"No se pudo acceder a la cámara {self.nombre} ({self.fuente})")
+        print(f"📷 Cámara {self.nombre} abierta ({self.backend}: {self.fuente})")
+
+    def cerrar(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+    def _leer_una_vez(self):
+        if self.backend == "sintetica":
+            return self._frame_sintetico()
+        if self.cap is None and self._imagen_fija is None:
+            self.abrir()
+        if self._imagen_fija is not None:
+            return self._imagen_fija.copy()
+        if self.backend == "archivo":
+            ret, frame = self.cap.read()
+            if not ret:
+                # Fin del video: se vuelve al comienzo
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ret, frame = self.cap.read()
+        else:
+            for _ in range(self.descarte):
+                self.cap.grab()
+            ret, frame = self.cap.read()
+        if not ret or frame is None:
+            raise ConnectionError(f"Error al capturar imagen de {self.nombre}")
+        return frame
+
+    def leer(self, reintentos=CAMARA_REINTENTOS):
+        """Devuelve un frame; si la lectura falla se cierra la cámara y se reabre"""
+        for intento in range(reintentos + 1):
+            try:
+                return self._leer_una_vez()
+            except Exception as e:
+                self.cerrar()
+                if intento == reintentos:
+                    raise
+                self.reconexiones += 1
+                print(f"⚠️ {e}. Reconectando cámara {self.nombre} (intento {intento + 1})...")
+                time.sleep(1)
 
-        # Codificar imagen como base64
-        _, buffer = cv2.imencode('.jpg', frame)
-        imagen_base64 = base64.b64encode(buffer).decode('utf-8')
+    def _frame_sintetico(self, alto=480, ancho=640):
+        # Degradado verde con ruido, suficiente para probar el flujo sin cámara
+        degradado = np.linspace(60, 200, ancho, dtype=np.uint8)[np.newaxis, :]
+        frame = np.zeros((alto, ancho, 3), dtype=np.uint8)
+        frame[:, :, 1] = degradado
+        frame[:, :, 0] = degradado // 3
+        ruido = self._rng.integers(0, 20, (alto, ancho, 1), dtype=np.uint8)
+        return cv2.add(frame, np.repeat(ruido, 3, axis=2))
+
+# ====================================================
+# SERVICIO DE CAPTURA
+# ====================================================
+class ServicioCaptura:
+    """Captura todas las cámaras configuradas en paralelo, reutilizando cámaras y conexión a MongoDB"""
+
+    def __init__(self, camaras=None, backend=CAMARA_BACKEND, hilos=CAPTURA_HILOS):
+        camaras = camaras if camaras is not None else parsear_camaras()
+        self.camaras = [Camara(nombre, fuente, backend) for nombre, fuente in camaras]
+        self.pool = ThreadPoolExecutor(max_workers=hilos or max(len(self.camaras), 1),
+                                       thread_name_prefix="captura")
+        self.db = obtener_db()  # Cliente compartido por el proceso
+        # Última imagen guardada por cámara: {nombre: {"id", "hash", "omitidas"}}
+        self.ultimas = {}
+        self.roi = parsear_roi()
+        self.spool = obtener_spool(SPOOL_CAPTURA)
+
+    def guardar_metricas(self, camara, frame, tiempo):
+        """Guarda las métricas del frame con el mismo formato que las lecturas de los sensores"""
+        try:
+            lectura = {"_id": ObjectId(), "tiempo": tiempo, "id_dispositivo": camara.nombre,
+                       **calcular_metricas(frame, self.roi)}
+            insertar_o_encolar(self.spool, self.db, METRICAS_DOMINIO, lectura)
+        except Exception as e:
+            # Un error en las métricas no debe impedir guardar la imagen
+            print(f"⚠️ Error guardando métricas de {camara.nombre}: {e}")
+
+    def es_duplicado(self, camara, hash_frame):
+        """Devuelve la distancia a la última imagen guardada si el frame es casi igual, o None"""
+        ultima = self.ultimas.get(camara.nombre)
+        if ultima is None or ultima["omitidas"] >= IMAGEN_MAX_OMITIDAS:
+            return None
+        distancia = distancia_hash(hash_frame, ultima["hash"])
+        return distancia if distancia < DUPLICADO_DISTANCIA else None
+
+    def capturar(self, camara):
+        frame = camara.leer()
+        hash_frame = dhash(frame)
 
         # Tiempo actual en hora de Chile
         chile_tz = pytz.timezone('America/Santiago')
         tiempo_chile = datetime.now(pytz.utc).astimezone(chile_tz)
+        tiempo_str = tiempo_chile.strftime('%Y-%m-%d %H:%M:%S')
+
+        # Las métricas se guardan siempre, también para frames sin cambios, para una serie regular
+        self.guardar_metricas(camara, frame, tiempo_chile)
+
+        distancia = self.es_duplicado(camara, hash_frame)
+        if distancia is not None:
+            # Casi igual a la anterior: solo un latido que apunta a la imagen guardada
+            ultima = self.ultimas[camara.nombre]
+            ultima["omitidas"] += 1
+            insertar_o_encolar(self.spool, self.db, COLECCION_IMAGENES, {
+                "_id": ObjectId(),
+                "tiempo": tiempo_chile,
+                "camara": camara.nombre,
+                "duplicado_de": ultima["id"],
+                "dhash": f"{hash_frame:016x}",
+                "distancia": distancia,
+            })
+            print(f"Imagen de {camara.nombre} sin cambios a las {tiempo_str} (distancia {distancia}), se registra solo el latido")
+            return tiempo_chile
+
+        # Codificar con el formato configurado (se guarda en binario, sin base64)
+        datos, ancho, alto = codificar(frame)
+
+        # Guardar los bytes en GridFS y los metadatos en "imagenes_camara"
+        metadatos = {"camara": camara.nombre, "ancho": ancho, "alto": alto, "dhash": f"{hash_frame:016x}"}
+        # El _id se asigna aquí: es la clave de idempotencia si la imagen tiene que pasar por el spool
+        doc_id = ObjectId()
+        self.guardar_o_encolar(datos, tiempo_chile, metadatos, doc_id)
+        self.ultimas[camara.nombre] = {"id": doc_id, "hash": hash_frame, "omitidas": 0}
+
+        print(f"Imagen de {camara.nombre} guardada correctamente a las {tiempo_str} (hora Chile, {len(datos) / 1024:.0f} KB)")
+        return tiempo_chile
+
+    def guardar_o_encolar(self, datos, tiempo, metadatos, doc_id):
+        carga = {"datos": datos, "tiempo": tiempo, "formato": IMAGEN_FORMATO, "metadatos": metadatos}
+        if self.spool.pendientes() == 0:
+            try:
+                guardar_imagen(datos, tiempo, IMAGEN_FORMATO, metadatos, db=self.db, doc_id=doc_id)
+                return True
+            except ConnectionFailure as e:
+                print(f"⚠️ MongoDB no disponible, la imagen queda en el spool: {e}")
+        self.spool.agregar("imagen", doc_id, carga)
+        return False
+
+    def _escribir_imagenes(self, entradas):
+        for clave, carga in entradas:
+            guardar_imagen(carga["datos"], carga["tiempo"], carga["formato"], carga["metadatos"],
+                           db=self.db, doc_id=ObjectId(clave))
 
-        doc = {
-            "tiempo": tiempo_chile,
-            "imagen": imagen_base64
-        }
+    def reenviar_pendientes(self):
+        """Reenvía en orden las escrituras que quedaron en el spool durante un corte"""
+        return self.spool.reenviar({"mongo": manejador_mongo(self.db), "imagen": self._escribir_imagenes})
 
-        # Insertar en MongoDB
-        collection = obtener_db()
-        collection.insert_one(doc)
+    def capturar_todas(self):
+        """Captura todas las cámaras a la vez; devuelve {nombre: tiempo o excepción}"""
+        futuros = {camara.nombre: self.pool.submit(self.capturar, camara) for camara in self.camaras}
+        resultados = {}
+        for nombre, futuro in futuros.items():
+            try:
+                resultados[nombre] = futuro.result()
+            except Exception as e:
+                print(f"Error durante la captura o guardado ({nombre}): {e}")
+                resultados[nombre] = e
+        return resultados
 
-        print(f"Imagen guardada correctamente a las {tiempo_chile.strftime('%Y-%m-%d %H:%M:%S')} (hora Chile)")
+    def cerrar(self):
+        self.pool.shutdown(wait=True)
+        for camara in self.camaras:
+            camara.cerrar()
 
+# Servicio compartido por el proceso (las cámaras quedan abiertas entre capturas)
+_servicio = None
+_lock = threading.Lock()
+
+def obtener_servicio():
+    global _servicio
+    with _lock:
+        if _servicio is None:
+            _servicio = ServicioCaptura()
+    return _servicio
+
+def cerrar_servicio():
+    global _servicio
+    with _lock:
+        if _servicio is not None:
+            _servicio.cerrar()
+            _servicio = None
+
+def reenviar_pendientes():
+    try:
+        return obtener_servicio().reenviar_pendientes()
+    except Exception as e:
+        print(f"Error reenviando escrituras pendientes: {e}")
+
+def capturar_y_guardar():
+    try:
+        return obtener_servicio().capturar_todas()
     except Exception as e:
         print(f"Error durante la captura o guardado: {e}")
-    
-    finally:
-        cap.release()
 
 if __name__ == "__main__":
-    capturar_y_guardar()
\ No newline at end of file
+    try:
+        capturar_y_guardar()
+    finally:
+        cerrar_servicio()
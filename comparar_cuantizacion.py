@@ -0,0 +1,145 @@
+"""
+Genera la variante int8 de un modelo ONNX y la compara contra el modelo float.
+
+Uso:
+    python comparar_cuantizacion.py                      # genera (si falta) y compara gru_48
+    python comparar_cuantizacion.py --regenerar --n 2000 --salida comparacion.json
+
+La comparación usa ventanas sintéticas con rangos realistas de pH y oxígeno,
+escaladas con el mismo RobustScaler del servicio. Como no hay etiquetas, la
+"exactitud" se mide como concordancia de la clase predicha respecto al modelo float.
+Para cuantizar se necesita el paquete `onnx` (`pip install onnx==1.16.1`), que no está en
+requirements.txt porque el servicio no lo usa; comparar una variante ya generada no lo requiere.
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+import joblib
+import numpy as np
+
+from app.sesion_onnx import crear_sesion, inferir, ruta_variante_int8
+
+MODELS_DIR = Path(__file__).parent / "app" / "modelos"
+SEQ_LEN = 48
+
+def generar_int8(ruta_modelo, regenerar=False):
+    """Cuantiza los pesos del modelo a int8 (cuantización dinámica) y guarda gru_48.int8.onnx"""
+    ruta_int8 = ruta_variante_int8(ruta_modelo)
+    if ruta_int8.exists() and not regenerar:
+        print(f"ℹ️ Ya existe {ruta_int8.name}, se reutiliza (usar --regenerar para rehacerlo)")
+        return ruta_int8
+    # onnxruntime.quantization importa `onnx`, que solo se instala para esta herramienta
+    try:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+    except ImportError as e:
+        raise SystemExit(f"❌ Para generar {ruta_int8.name} hace falta el paquete onnx "
+                         f"(pip install onnx==1.16.1): {e}")
+    quantize_dynamic(str(ruta_modelo), str(ruta_int8), weight_type=QuantType.QInt8)
+    print(f"💾 Modelo int8 guardado en {ruta_int8}")
+    return ruta_int8
+
+def generar_ventanas(n, semilla=0):
+    """Genera n ventanas (n × 48 × 4) con pH, oxígeno y codificación cíclica de la hora"""
+    rng = np.random.default_rng(semilla)
+    pasos = np.arange(SEQ_LEN)
+
+    # Tendencias suaves + ruido, en rangos similares a los de terreno
+    ph_base = rng.uniform(6.5, 9.0, size=(n, 1))
+    ph_pend = rng.normal(0, 0.01, size=(n, 1))
+    ph = ph_base + ph_pend * pasos + rng.normal(0, 0.05, size=(n, SEQ_LEN))
+
+    ox_base = rng.uniform(4, 20, size=(n, 1))
+    ox_pend = rng.normal(0, 0.05, size=(n, 1))
+    oxigeno = ox_base + ox_pend * pasos + rng.normal(0, 0.3, size=(n, SEQ_LEN))
+
+    hora_inicio = rng.uniform(0, 24, size=(n, 1))
+    hora = (hora_inicio + pasos) % 24
+    hora_sin = np.sin(2 * np.pi * hora / 24)
+    hora_cos = np.cos(2 * np.pi * hora / 24)
+
+    return np.stack([ph, oxigeno, hora_sin, hora_cos], axis=-1)
+
+def medir_latencia(sesion, entradas, repeticiones):
+    """Latencia por inferencia individual (ms) y throughput en lote (ventanas/s)"""
+    tiempos = []
+    for i in range(repeticiones):
+        x = entradas[i % len(entradas)][np.newaxis]
+        t0 = time.perf_counter()
+        inferir(sesion, x)
+        tiempos.append((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    inferir(sesion, entradas)
+    duracion_lote = time.perf_counter() - t0
+
+    tiempos = np.array(tiempos)
+    return {
+        "latencia_media_ms": float(tiempos.mean()),
+        "latencia_p50_ms": float(np.percentile(tiempos, 50)),
+        "latencia_p95_ms": float(np.percentile(tiempos, 95)),
+        "throughput_lote_vps": float(len(entradas) / duracion_lote),
+    }
+
+def medir_arranque(ruta_modelo):
+    """Tiempo de creación de la sesión sin caché de grafo optimizado (arranque en frío)"""
+    t0 = time.perf_counter()
+    sesion = crear_sesion(ruta_modelo, usar_cache=False)
+    return sesion, (time.perf_counter() - t0) * 1000
+
+def comparar(ruta_float, ruta_int8, n, repeticiones, semilla):
+    scaler = joblib.load(MODELS_DIR / "robust_scaler.pkl")
+    ventanas = generar_ventanas(n, semilla)
+    entradas = scaler.transform(ventanas.reshape(-1, ventanas.shape[-1])).reshape(ventanas.shape).astype(np.float32)
+
+    sesion_float, arranque_float = medir_arranque(ruta_float)
+    sesion_int8, arranque_int8 = medir_arranque(ruta_int8)
+
+    proba_float = inferir(sesion_float, entradas)
+    proba_int8 = inferir(sesion_int8, entradas)
+    clases_float = proba_float.argmax(axis=1)
+    clases_int8 = proba_int8.argmax(axis=1)
+    diff = np.abs(proba_float - proba_int8)
+
+    lat_float = medir_latencia(sesion_float, entradas, repeticiones)
+    lat_int8 = medir_latencia(sesion_int8, entradas, repeticiones)
+
+    return {
+        "ventanas": n,
+        "concordancia_clase": float((clases_float == clases_int8).mean()),
+        "diferencia_proba_media": float(diff.mean()),
+        "diferencia_proba_max": float(diff.max()),
+        "tamano_kb": {
+            "float": Path(ruta_float).stat().st_size / 1024,
+            "int8": Path(ruta_int8).stat().st_size / 1024,
+        },
+        "arranque_ms": {"float": arranque_float, "int8": arranque_int8},
+        "float": lat_float,
+        "int8": lat_int8,
+        "delta_latencia_media_pct": 100 * (lat_int8["latencia_media_ms"] / lat_float["latencia_media_ms"] - 1),
+        "delta_throughput_pct": 100 * (lat_int8["throughput_lote_vps"] / lat_float["throughput_lote_vps"] - 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Cuantización int8 y comparación contra el modelo float")
+    parser.add_argument("--modelo", default=str(MODELS_DIR / "gru_48.onnx"))
+    parser.add_argument("--regenerar", action="store_true", help="Rehacer el modelo int8 aunque exista")
+    parser.add_argument("--n", type=int, default=1000, help="Cantidad de ventanas sintéticas")
+    parser.add_argument("--repeticiones", type=int, default=200, help="Inferencias individuales para medir latencia")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--salida", help="Archivo JSON donde guardar el reporte")
+    args = parser.parse_args()
+
+    ruta_float = Path(args.modelo)
+    ruta_int8 = generar_int8(ruta_float, args.regenerar)
+    reporte = comparar(ruta_float, ruta_int8, args.n, args.repeticiones, args.semilla)
+
+    texto = json.dumps(reporte, indent=2, ensure_ascii=False)
+    print(texto)
+    if args.salida:
+        Path(args.salida).write_text(texto, encoding="utf-8")
+        print(f"💾 Reporte guardado en {args.salida}")
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,13 @@
 import streamlit as st
 from streamlit_autorefresh import st_autorefresh
-import pandas as pd
 import pytz
 from pymongo import MongoClient
-from datetime import datetime
-from database import obtener_datos #, obtener_registro_comida
+from datetime import datetime, timedelta
+from database import (
+    leer_lecturas, obtener_dispositivos_dominio, obtener_rango_tiempo, asegurar_indices_dominio,
+    CacheLecturas, inicio_dia_utc, campos_dominio
+    #, obtener_registro_comida
+)
 from funciones_dashboard import (
     mostrar_metricas,
     mostrar_reporte,
@@ -28,9 +31,50 @@ def obtener_hora_chile(dt_utc=None):
         return datetime.now(chile_tz)
     return dt_utc.replace(tzinfo=pytz.utc).astimezone(chile_tz)
 
+# Días que se muestran por defecto (terminando en la última lectura) y tope de lecturas por consulta
+DIAS_POR_DEFECTO = 7
+LIMITE_LECTURAS = 200000
+
+# La caché queda asociada a los parámetros: cada combinación de dominio, fechas y dispositivos es una entrada
+@st.cache_data(ttl=600)
+def cargar_datos_cacheados(dominio='dominio_terreno', fecha_inicio=None, fecha_fin=None, dispositivos=None, limit=LIMITE_LECTURAS):
+    desde = inicio_dia_utc(fecha_inicio) if fecha_inicio else None
+    hasta = inicio_dia_utc(fecha_fin + timedelta(days=1)) if fecha_fin else None
+    # Junta lo archivado en Parquet (rangos antiguos) con lo que sigue en MongoDB
+    return leer_lecturas(dominio, desde=desde, hasta=hasta, dispositivos=dispositivos,
+                         campos=campos_dominio(dominio), limit=limit)
+
 @st.cache_data(ttl=600)
-def cargar_datos_cacheados(dominio='dominio_terreno', limit=5000):
-    return obtener_datos(dominio, limit)
+def cargar_rango_fechas(dominio='dominio_terreno'):
+    # Primera y última fecha (hora de Chile) con lecturas en el dominio
+    primero, ultimo = obtener_rango_tiempo(dominio)
+    if primero is None:
+        return None, None
+    return obtener_hora_chile(primero).date(), obtener_hora_chile(ultimo).date()
+
+@st.cache_data(ttl=600)
+def cargar_dispositivos(dominio='dominio_terreno'):
+    return obtener_dispositivos_dominio(dominio)
+
+@st.cache_resource
+def cache_lecturas(dominio):
+    # Una caché incremental por dominio, compartida por todas las sesiones del proceso
+    return CacheLecturas(dominio)
+
+def cargar_lecturas(dominio, fecha_inicio, fecha_fin, dispositivos):
+    # Rangos dentro de la ventana de la caché se sirven desde memoria (refrescando solo lo nuevo);
+    # los rangos históricos más antiguos se consultan a MongoDB
+    cache = cache_lecturas(dominio)
+    if cache.cubre(fecha_inicio):
+        cache.refrescar()
+        return cache.vista(fecha_inicio, fecha_fin, dispositivos)
+    return cargar_datos_cacheados(dominio, fecha_inicio, fecha_fin, dispositivos)
+
+@st.cache_resource
+def preparar_dominio(dominio):
+    # Índices del dominio, una vez por proceso
+    asegurar_indices_dominio(dominio)
+    return True
 
 # --- CONFIGURACIÓN GENERAL ---
 st.set_page_config(page_title="Dashboard Biorreactor", layout="wide")
@@ -86,33 +130,30 @@ if seccion in ["📊 Métricas", "📋 Reporte", "🍽️ Alimentación", "📈
                 )
 
             with col2:
-                # Cargar los datos desde el dominio seleccionado
-                data = cargar_datos_cacheados(dominio_seleccionado)
-                if not data:
+                # Límites del calendario con dos consultas baratas (primera y última lectura), sin cargar datos
+                try:
+                    preparar_dominio(dominio_seleccionado)
+                except Exception as e:
+                    st.caption(f"⚠️ No se pudieron crear los índices del dominio: {e}")
+                fecha_min, fecha_max = cargar_rango_fechas(dominio_seleccionado)
+                if fecha_min is None:
                     st.warning("⚠️ No hay datos disponibles.")
                     st.stop()
 
-                # Convertir a dataframe y convierte la columna "tiempo" a tipo fecha
-                df = pd.DataFrame(data)
-                df = df[df['tiempo'].notna()]
-                df['tiempo'] = pd.to_datetime(df['tiempo'])
-                df = df.sort_values(by='tiempo')
-
-                # Determinar los límites mínimo y máximo para el calendario 
-                fecha_min = df['tiempo'].min().date()
-                fecha_max = df['tiempo'].max().date()
-            
-                # Obtener valores guardados o usar por defecto
-                fecha_inicio_default = st.session_state.get("fecha_inicio", fecha_min)
-                fecha_fin_default = st.session_state.get("fecha_fin", fecha_max)
+                # Por defecto se muestran los últimos días con datos; cualquier rango histórico se puede elegir
+                fecha_inicio_default = max(fecha_min, fecha_max - timedelta(days=DIAS_POR_DEFECTO - 1))
 
                 # Mostrar un selector donde el usuario elige el rango de fechas
-                fecha_inicio, fecha_fin = st.date_input(
+                # (las fechas guardadas se ajustan a los límites, pueden venir de otro dominio)
+                rango = st.date_input(
                     "📅 Selecciona un rango de fechas:",
-                    value=(fecha_min, fecha_max),
+                    value=(min(max(st.session_state.get("fecha_inicio", fecha_inicio_default), fecha_min), fecha_max),
+                           min(max(st.session_state.get("fecha_fin", fecha_max), fecha_min), fecha_max)),
                     min_value=fecha_min,
                     max_value=fecha_max
                 )
+                # Mientras se elige el rango el selector devuelve una sola fecha
+                fecha_inicio, fecha_fin = rango if len(rango) == 2 else (rango[0], rango[0])
 
             # Botón de formulario para confirmar filtros
             form_enviado = st.form_submit_button("Aplicar filtros")
@@ -133,30 +174,35 @@ if seccion in ["📊 Métricas", "📋 Reporte", "🍽️ Alimentación", "📈
 
     # Si el usuario no ha enviado el formulario, tomar valores de session_state o usar por defecto
     dominio_seleccionado = st.session_state.get("dominio_seleccionado", dominios_disponibles[indice_por_defecto])
-    fecha_inicio = st.session_state.get("fecha_inicio", fecha_min)
+    fecha_min, fecha_max = cargar_rango_fechas(dominio_seleccionado)
+    if fecha_min is None:
+        st.warning("⚠️ No hay datos disponibles.")
+        st.stop()
+    fecha_inicio_default = max(fecha_min, fecha_max - timedelta(days=DIAS_POR_DEFECTO - 1))
+    fecha_inicio = st.session_state.get("fecha_inicio", fecha_inicio_default)
     fecha_fin = st.session_state.get("fecha_fin", fecha_max)
 
-    # Filtrar el dataframe por fechas, se filtra por el rango de fechas elegido, si no hay datos en ese rango, se muestra una advertencia
-    df = df[(df['tiempo'].dt.date >= fecha_inicio) & (df['tiempo'].dt.date <= fecha_fin)]
-    if df.empty:
-        st.warning("⚠️ No hay datos dentro del rango de fechas seleccionado.")
+    # Se muestra el filtro global para permitir al usuario seleccionar dispositivos (lista obtenida con distinct)
+    ids_filtrados = mostrar_filtro_global(cargar_dispositivos(dominio_seleccionado), dominio_seleccionado)
+    if not ids_filtrados:
+        st.warning("⚠️ No hay datos para los dispositivos seleccionados.")
         st.stop()
 
-    # Se muestra el filtro global para permitir al usuario seleccionar dispositivos
-    ids_filtrados = mostrar_filtro_global(df, dominio_seleccionado)
-
-    # Luego filtrar el df para usar los dispositivos seleccionados
-    df = df[df["id_dispositivo"].isin(ids_filtrados)]
-
-    # Si no hay datos luego del filtro, se muestra advertencia y se detiene la ejecución
+    # Cargar solo el tramo pedido: fechas y dispositivos van en la consulta a MongoDB
+    # (llega como DataFrame tipado y ordenado por tiempo, sin pasar por textos)
+    df = cargar_lecturas(dominio_seleccionado, fecha_inicio, fecha_fin, tuple(sorted(ids_filtrados)))
     if df.empty:
-        st.warning("⚠️ No hay datos para los dispositivos seleccionados.")
+        st.warning("⚠️ No hay datos dentro del rango de fechas seleccionado.")
         st.stop()
+    if len(df) >= LIMITE_LECTURAS:
+        st.info(f"ℹ️ Se muestran las {LIMITE_LECTURAS} lecturas más recientes del rango; acota las fechas para ver el resto.")
 
 # --- BOTONES DE ACCIÓN ---
-# Botón para limpiar caché y actualizar datos
+# Botón para actualizar datos: la caché del dominio solo pide las lecturas nuevas; el resto se recalcula
 if st.sidebar.button("🔄 Actualizar datos"):
     st.cache_data.clear()
+    if "dominio_seleccionado" in st.session_state:
+        cache_lecturas(st.session_state["dominio_seleccionado"]).refrescar(forzar=True)
     st.session_state.ultima_actualizacion = obtener_hora_chile()
     st.rerun()
 
@@ -194,9 +240,8 @@ elif seccion == "🤖 Modelo":
 
 # elif seccion == "🍽️ Alimentación":
 #     dominio_seleccionado = st.session_state.get("dominio_seleccionado", "dominio_terreno")
-#     registros = obtener_registro_comida(limit=5000)
 #     ids_filtrados = st.session_state.get(f"ids_filtrados_{dominio_seleccionado}", [])
-#     mostrar_registro_comida(registros, dominio_seleccionado, ids_filtrados=ids_filtrados)
+#     mostrar_registro_comida(dominio_seleccionado, ids_filtrados=ids_filtrados)
 
 # elif seccion == "🖼️ Imágenes":
 #     mostrar_imagenes(db)
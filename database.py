@@ -1,5 +1,18 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from gridfs import GridFSBucket
+from io import BytesIO
+from PIL import Image
+import base64
 import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 import pytz
 
 # Conversión centralizada a horario chileno
@@ -11,38 +24,419 @@ def convertir_a_chile(fecha_utc):
         fecha_utc = fecha_utc.replace(tzinfo=pytz.utc)
     return fecha_utc.astimezone(chile_tz)
 
-def obtener_datos(dominio='dominio_terreno', limit=5000):
-    # Usar variable de entorno "MONGO_URI" para conectarse a MongoDB, si no se encuentra la variable, lanza un error
-    mongo_uri = os.environ.get("MONGO_URI")
-    if not mongo_uri:
-        raise RuntimeError("❌ No se encontró la variable de entorno MONGO_URI")
-    
-    # Conectarse a la base de datos, y seleccionar la colección al dominio pasado por parámetro o por defecto "dominio_terreno"
-    client = MongoClient(mongo_uri)
-    db = client["biorreactor_app"]
+# Variables de las lecturas de sensores
+CAMPOS_SENSORES = ("temperatura", "ph", "oxigeno", "luz")
+
+# Métricas de las imágenes (capturar_imagenes.calcular_metricas), guardadas como lecturas en su propio dominio
+# con la cámara como id_dispositivo
+METRICAS_DOMINIO = os.environ.get("METRICAS_DOMINIO", "dominio_camara")
+CAMPOS_METRICAS_IMAGEN = (
+    "h_media", "s_media", "v_media", "verde_media", "verde_relativo", "turbidez", "nitidez",
+    "contraste", "tono_dominante", "entropia_tono", "fraccion_verde", "fraccion_color",
+)
+
+def campos_dominio(dominio):
+    # Variables de las lecturas de un dominio: las métricas de imagen en el de la cámara, los sensores en los demás
+    return CAMPOS_METRICAS_IMAGEN if dominio == METRICAS_DOMINIO else CAMPOS_SENSORES
+
+def filtro_lecturas(desde=None, hasta=None, dispositivos=None):
+    # Filtro de MongoDB para un rango de tiempo [desde, hasta) en UTC y una lista de dispositivos
+    filtro = {}
+    if desde is not None or hasta is not None:
+        filtro["tiempo"] = {}
+        if desde is not None:
+            filtro["tiempo"]["$gte"] = desde
+        if hasta is not None:
+            filtro["tiempo"]["$lt"] = hasta
+    if dispositivos is not None:
+        filtro["id_dispositivo"] = {"$in": list(dispositivos)}
+    return filtro
+
+def inicio_dia_utc(fecha):
+    # Medianoche de una fecha de Chile expresada en UTC (sin zona), para consultar MongoDB
+    chile_tz = pytz.timezone("America/Santiago")
+    inicio = chile_tz.localize(datetime.combine(fecha, datetime.min.time()))
+    return inicio.astimezone(pytz.utc).replace(tzinfo=None)
+
+def obtener_datos(dominio='dominio_terreno', limit=5000, desde=None, hasta=None, dispositivos=None,
+                  campos=CAMPOS_SENSORES, db=None):
+    # Lecturas del dominio: el rango de tiempo (UTC), los dispositivos y los campos se aplican en la
+    # consulta de MongoDB, así solo viaja el tramo pedido. Sin rango se devuelven las últimas "limit"
+    db = db if db is not None else obtener_db()
     collection = db[dominio]
-    
-    # Consultar los documentos desde MongoDB ordenados por campo "tiempo" de más reciente a más antiguo (por defecto 5000)
-    cursor = collection.find().sort("tiempo", -1).limit(limit)
+    campos = list(campos)
+    proyeccion = {"_id": 0, "tiempo": 1, "id_dispositivo": 1, **{campo: 1 for campo in campos}}
+
+    # Consultar los documentos ordenados por campo "tiempo" de más reciente a más antiguo (usa el índice id_dispositivo + tiempo)
+    cursor = collection.find(filtro_lecturas(desde, hasta, dispositivos), proyeccion).sort("tiempo", -1)
+    if limit:
+        cursor = cursor.limit(limit)
     datos = []
 
     # Iterar los documentos obtenidos, convirtiendo la hora UTC a hora de Chile usando la función convertir_a_chile()
     # Extraer y guardar los valores en un diccionario
     for doc in cursor:
         tiempo_chile = convertir_a_chile(doc.get("tiempo"))
-        datos.append({
+        fila = {
             'tiempo': tiempo_chile.strftime('%Y-%m-%d %H:%M:%S'),
             'id_dispositivo': doc.get('id_dispositivo'),
-            'temperatura': doc.get('temperatura'),
-            'ph': doc.get('ph'),
-            'oxigeno': doc.get('oxigeno'),
-            'luz': doc.get('luz')
-        })
+        }
+        for campo in campos:
+            fila[campo] = doc.get(campo)
+        datos.append(fila)
 
-    # Cierra la conexión a la base de datos, e invierte el orden de los datos para que queden del más antiguo al más reciente y los retorna
-    client.close()
+    # Invertir el orden de los datos para que queden del más antiguo al más reciente
     return list(reversed(datos))
 
+def obtener_datos_df(dominio='dominio_terreno', limit=5000, desde=None, hasta=None, dispositivos=None,
+                     campos=CAMPOS_SENSORES, db=None, tamano_lote=5000, incluir_id=False):
+    # Igual que obtener_datos, pero arma directamente un DataFrame por columnas: los documentos del
+    # cursor se copian a arreglos NumPy preasignados (sin un diccionario ni un texto por fila) y la hora
+    # se convierte a Chile de una vez. "tiempo" queda en hora de Chile sin zona, como antes, las
+    # mediciones en float32 y "id_dispositivo" como categoría. Con "incluir_id" se agrega "_id" como texto
+    db = db if db is not None else obtener_db()
+    collection = db[dominio]
+    campos = list(campos)
+    filtro = filtro_lecturas(desde, hasta, dispositivos)
+    proyeccion = {"_id": 1 if incluir_id else 0, "tiempo": 1, "id_dispositivo": 1, **{campo: 1 for campo in campos}}
+
+    # Capacidad inicial con un conteo sobre el índice; si llegan más documentos se duplica
+    capacidad = collection.count_documents(filtro, limit=limit) if limit else collection.count_documents(filtro)
+    capacidad = max(capacidad, 1)
+    tiempos = np.full(capacidad, np.datetime64("NaT"), dtype="datetime64[ms]")
+    ids = np.empty(capacidad, dtype=object)
+    ids_docs = np.empty(capacidad, dtype=object) if incluir_id else None
+    valores = {campo: np.full(capacidad, np.nan, dtype=np.float32) for campo in campos}
+
+    cursor = collection.find(filtro, proyeccion, batch_size=tamano_lote).sort("tiempo", -1)
+    if limit:
+        cursor = cursor.limit(limit)
+    n = 0
+    for doc in cursor:
+        if n == len(tiempos):
+            tiempos = np.concatenate([tiempos, np.full(n, np.datetime64("NaT"), dtype="datetime64[ms]")])
+            ids = np.concatenate([ids, np.empty(n, dtype=object)])
+            if incluir_id:
+                ids_docs = np.concatenate([ids_docs, np.empty(n, dtype=object)])
+            valores = {c: np.concatenate([v, np.full(n, np.nan, dtype=np.float32)]) for c, v in valores.items()}
+        tiempo = doc.get("tiempo")
+        if tiempo is not None:
+            tiempos[n] = tiempo
+        ids[n] = doc.get("id_dispositivo")
+        if incluir_id:
+            ids_docs[n] = str(doc["_id"])
+        for campo in campos:
+            valor = doc.get(campo)
+            if valor is not None:
+                try:
+                    valores[campo][n] = valor
+                except (TypeError, ValueError):
+                    pass  # Valor no numérico: queda como NaN
+        n += 1
+
+    # Del más antiguo al más reciente
+    orden = slice(n - 1, None, -1) if n else slice(0, 0)
+    tiempo_chile = (
+        pd.DatetimeIndex(tiempos[orden]).tz_localize("UTC").tz_convert("America/Santiago").tz_localize(None)
+    )
+    df = pd.DataFrame({
+        "tiempo": tiempo_chile,
+        "id_dispositivo": pd.Categorical(ids[orden]),
+        **{campo: valores[campo][orden] for campo in campos},
+    })
+    if incluir_id:
+        df.insert(0, "_id", ids_docs[orden])
+    return df[df["tiempo"].notna()].reset_index(drop=True)
+
+# --- ARCHIVO PARQUET ---
+# Las lecturas antiguas se archivan (archivar_parquet.py) en archivos Parquet particionados por
+# dominio y mes (UTC): ARCHIVO_PARQUET_DIR/dominio=<dominio>/mes=<AAAA-MM>/parte-*.parquet
+ARCHIVO_PARQUET_DIR = os.environ.get("ARCHIVO_PARQUET_DIR", "archivo_parquet")
+
+def directorio_particion(dominio, mes, directorio=ARCHIVO_PARQUET_DIR):
+    return Path(directorio) / f"dominio={dominio}" / f"mes={mes}"
+
+def meses_entre(desde, hasta):
+    # Meses "AAAA-MM" que toca el rango [desde, hasta) (None si el rango no tiene límite)
+    if desde is None or hasta is None:
+        return None
+    return [p.strftime("%Y-%m") for p in pd.period_range(pd.Timestamp(desde), pd.Timestamp(hasta), freq="M")]
+
+def leer_archivo(dominio, desde=None, hasta=None, dispositivos=None, campos=CAMPOS_SENSORES,
+                 directorio=ARCHIVO_PARQUET_DIR):
+    # Lecturas archivadas en Parquet con el mismo formato que obtener_datos_df(incluir_id=True).
+    # Se abren solo las carpetas de los meses del rango (poda de particiones), solo las columnas
+    # pedidas, y el filtro de tiempo y dispositivos se aplica con las estadísticas de cada archivo
+    campos = list(campos)
+    base = Path(directorio) / f"dominio={dominio}"
+    meses = meses_entre(desde, hasta)
+    carpetas = [base / f"mes={mes}" for mes in meses] if meses is not None else sorted(base.glob("mes=*"))
+    archivos = [str(f) for carpeta in carpetas if carpeta.is_dir() for f in sorted(carpeta.glob("*.parquet"))]
+    vacio = pd.DataFrame({
+        "_id": pd.Series(dtype=object), "tiempo": pd.Series(dtype="datetime64[ms]"),
+        "id_dispositivo": pd.Categorical([]), **{c: pd.Series(dtype=np.float32) for c in campos}
+    })
+    if not archivos:
+        return vacio
+
+    # Cada archivo se lee con su propio esquema (pueden faltar variables nuevas, o un archivo antiguo tener
+    # una variable como texto) y se convierte al formato común; un archivo distinto no impide leer los demás
+    partes = []
+    for archivo in archivos:
+        esquema = pq.read_schema(archivo)
+        condiciones = []
+        if desde is not None:
+            condiciones.append(ds.field("tiempo") >= pa.scalar(pd.Timestamp(desde), type=esquema.field("tiempo").type))
+        if hasta is not None:
+            condiciones.append(ds.field("tiempo") < pa.scalar(pd.Timestamp(hasta), type=esquema.field("tiempo").type))
+        if dispositivos is not None:
+            condiciones.append(ds.field("id_dispositivo").isin(list(dispositivos)))
+        filtro = None
+        for condicion in condiciones:
+            filtro = condicion if filtro is None else filtro & condicion
+        columnas = ["_id", "tiempo", "id_dispositivo"] + [c for c in campos if c in esquema.names]
+        tabla = pq.read_table(archivo, columns=columnas, filters=filtro)
+        if tabla.num_rows == 0:
+            continue
+        parte = tabla.to_pandas()
+        for campo in campos:
+            # Igual que obtener_datos_df: un valor no numérico queda como NaN
+            if campo in parte.columns:
+                parte[campo] = pd.to_numeric(parte[campo], errors="coerce").astype(np.float32)
+            else:
+                parte[campo] = np.float32(np.nan)
+        partes.append(parte[["_id", "tiempo", "id_dispositivo", *campos]])
+    if not partes:
+        return vacio
+
+    df = pd.concat(partes, ignore_index=True) if len(partes) > 1 else partes[0]
+    # Un archivado interrumpido puede haber escrito los mismos documentos en dos archivos; vale el más reciente
+    # (los nombres terminan en la marca de escritura, así que el orden de lectura es el de escritura dentro del mes)
+    df = df.drop_duplicates(subset="_id", keep="last").sort_values("tiempo", kind="stable")
+    df["tiempo"] = (
+        pd.DatetimeIndex(df["tiempo"]).tz_localize("UTC").tz_convert("America/Santiago").tz_localize(None)
+    )
+    df["id_dispositivo"] = df["id_dispositivo"].astype(str).astype("category")
+    return df.reset_index(drop=True)
+
+def leer_lecturas(dominio='dominio_terreno', desde=None, hasta=None, dispositivos=None, campos=CAMPOS_SENSORES,
+                  limit=None, db=None, directorio=ARCHIVO_PARQUET_DIR):
+    # Lector unificado: junta lo archivado en Parquet con lo que sigue en MongoDB y elimina los
+    # duplicados por _id (un documento archivado sin borrar está en ambos lados; vale la versión de MongoDB).
+    # Devuelve el mismo DataFrame que obtener_datos_df; con "limit" se quedan las más recientes
+    campos = list(campos)
+    archivadas = leer_archivo(dominio, desde, hasta, dispositivos, campos, directorio)
+    vivas = obtener_datos_df(dominio, limit, desde=desde, hasta=hasta, dispositivos=dispositivos,
+                             campos=campos, db=db, incluir_id=True)
+    if archivadas.empty:
+        df = vivas
+    elif vivas.empty:
+        df = archivadas
+    else:
+        df = pd.concat([archivadas, vivas], ignore_index=True)
+    # Siempre se descartan los _id repetidos, aunque solo haya lecturas de un lado
+    df = df.drop_duplicates(subset="_id", keep="last").sort_values("tiempo", kind="stable")
+    df["id_dispositivo"] = df["id_dispositivo"].astype(str).astype("category")
+    if limit:
+        df = df.tail(limit)
+    return df.drop(columns="_id").reset_index(drop=True)
+
+# Cache incremental: se guarda una ventana de lecturas por dominio y al refrescar solo se piden las nuevas
+CACHE_RETENCION_DIAS = int(os.environ.get("CACHE_RETENCION_DIAS", "30"))
+CACHE_INTERVALO_S = int(os.environ.get("CACHE_INTERVALO_S", "60"))
+# Se vuelve a pedir este tramo antes de la última lectura, para recoger escrituras que llegan con atraso
+# (por ejemplo las reenviadas desde un spool con su hora original)
+CACHE_SOLAPE_S = int(os.environ.get("CACHE_SOLAPE_S", "600"))
+
+class CacheLecturas:
+    """Lecturas de los últimos `retencion_dias` de un dominio, actualizadas por incrementos.
+
+    La primera carga trae la ventana completa; cada refresco pide solo lo posterior a la última
+    lectura (con un pequeño solape), lo agrega y descarta lo que sale de la ventana. Entre refrescos
+    pasan al menos `intervalo_s` segundos, así varias sesiones que comparten la caché no multiplican
+    las consultas. El DataFrame se reemplaza entero en cada refresco: quien lo leyó antes sigue
+    usando su copia sin bloqueos.
+    """
+
+    def __init__(self, dominio, retencion_dias=CACHE_RETENCION_DIAS, intervalo_s=CACHE_INTERVALO_S,
+                 solape_s=CACHE_SOLAPE_S, campos=None, db=None):
+        self.dominio = dominio
+        self.campos = tuple(campos) if campos is not None else campos_dominio(dominio)
+        self.retencion = pd.Timedelta(days=retencion_dias)
+        self.intervalo_s = intervalo_s
+        self.solape = pd.Timedelta(seconds=solape_s)
+        self.db = db
+        self.df = None
+        self.ultimo_utc = None
+        self.refrescado = None
+        self.leidas_ultimo_refresco = 0
+        self._lock = threading.Lock()
+
+    def inicio_ventana(self):
+        """Primera hora (Chile, sin zona) que cubre la caché"""
+        ahora = pd.Timestamp.now(tz="America/Santiago").tz_localize(None)
+        return ahora - self.retencion
+
+    def refrescar(self, forzar=False):
+        """Trae las lecturas nuevas; devuelve cuántas se leyeron de MongoDB"""
+        with self._lock:
+            ahora = time.monotonic()
+            if not forzar and self.refrescado is not None and ahora - self.refrescado < self.intervalo_s:
+                return 0
+            db = self.db if self.db is not None else obtener_db()
+            if self.df is None:
+                desde = datetime.utcnow() - self.retencion.to_pytimedelta()
+            else:
+                desde = (self.ultimo_utc - self.solape).to_pydatetime()
+            # Con _id: dos lecturas distintas pueden compartir hora y dispositivo (ej. una manual y una del sensor)
+            nuevos = obtener_datos_df(self.dominio, limit=None, desde=desde, campos=self.campos, db=db,
+                                      incluir_id=True)
+
+            if self.df is None:
+                df = nuevos
+            else:
+                df = pd.concat([self.df, nuevos], ignore_index=True)
+                # Las lecturas del solape ya estaban: se queda la última versión de cada una
+                df = df.drop_duplicates(subset="_id", keep="last")
+                df = df[df["tiempo"] >= self.inicio_ventana()]
+                df = df.sort_values("tiempo", kind="stable").reset_index(drop=True)
+                df["id_dispositivo"] = df["id_dispositivo"].astype("category")
+            if not df.empty:
+                # En la hora ambigua del cambio de horario se toma la interpretación más temprana (solo
+                # agranda el solape)
+                ultimo = df["tiempo"].iloc[-1].tz_localize("America/Santiago", ambiguous=True, nonexistent="shift_forward")
+                self.ultimo_utc = ultimo.tz_convert("UTC").tz_localize(None)
+            elif self.ultimo_utc is None:
+                self.ultimo_utc = pd.Timestamp(desde)
+
+            self.df = df
+            self.refrescado = ahora
+            self.leidas_ultimo_refresco = len(nuevos)
+            return len(nuevos)
+
+    def cubre(self, fecha_inicio):
+        """True si un rango que empieza en esa fecha (Chile) está dentro de la ventana de la caché"""
+        return pd.Timestamp(fecha_inicio) >= self.inicio_ventana()
+
+    def vista(self, fecha_inicio=None, fecha_fin=None, dispositivos=None):
+        """Lecturas entre dos fechas de Chile (ambas incluidas) de los dispositivos indicados"""
+        df = self.df
+        if df is None:
+            self.refrescar()
+            df = self.df
+        mascara = np.ones(len(df), dtype=bool)
+        if fecha_inicio is not None:
+            mascara &= (df["tiempo"] >= pd.Timestamp(fecha_inicio)).to_numpy()
+        if fecha_fin is not None:
+            mascara &= (df["tiempo"] < pd.Timestamp(fecha_fin) + pd.Timedelta(days=1)).to_numpy()
+        if dispositivos is not None:
+            mascara &= df["id_dispositivo"].isin(list(dispositivos)).to_numpy()
+        return df.loc[mascara, df.columns != "_id"].reset_index(drop=True)
+
+def obtener_dispositivos_dominio(dominio='dominio_terreno', db=None):
+    # Dispositivos con lecturas en el dominio (resuelto con el índice, sin leer documentos)
+    db = db if db is not None else obtener_db()
+    return sorted(d for d in db[dominio].distinct("id_dispositivo") if d is not None)
+
+def obtener_rango_tiempo(dominio='dominio_terreno', db=None):
+    # Primera y última lectura del dominio (UTC) con dos consultas de un documento sobre el índice de tiempo
+    db = db if db is not None else obtener_db()
+    collection = db[dominio]
+    primero = collection.find_one({"tiempo": {"$ne": None}}, {"_id": 0, "tiempo": 1}, sort=[("tiempo", ASCENDING)])
+    ultimo = collection.find_one({"tiempo": {"$ne": None}}, {"_id": 0, "tiempo": 1}, sort=[("tiempo", DESCENDING)])
+    if primero is None:
+        return None, None
+    return primero["tiempo"], ultimo["tiempo"]
+
+def asegurar_indices_dominio(dominio='dominio_terreno', db=None):
+    # Índices para leer un tramo de tiempo de algunos dispositivos y los extremos de la serie
+    db = db if db is not None else obtener_db()
+    db[dominio].create_index([("id_dispositivo", ASCENDING), ("tiempo", DESCENDING)], name="id_dispositivo_tiempo")
+    db[dominio].create_index([("tiempo", DESCENDING)], name="tiempo")
+
+def obtener_comparacion_manual(id_dispositivo, dominio='dominio_terreno', desde=None, hasta=None,
+                               campos=CAMPOS_SENSORES, zona="America/Santiago", db=None):
+    # Comparación diaria de un dispositivo: promedio de las lecturas de sensores y primer registro manual
+    # de cada día (en hora de Chile). MongoDB agrupa por día, así que viaja una fila por día y no el historial
+    db = db if db is not None else obtener_db()
+    collection = db[dominio]
+    campos = list(campos)
+    fecha = {"format": "%Y-%m-%d", "date": "$tiempo"}
+    if zona:
+        fecha["timezone"] = zona
+    filtro = filtro_lecturas(desde, hasta, [id_dispositivo])
+
+    # Sensores: promedio por día ($avg ignora los campos ausentes o no numéricos)
+    sensores = collection.aggregate([
+        {"$match": {**filtro, "manual": {"$ne": True}}},
+        {"$group": {
+            "_id": {"$dateToString": fecha},
+            "n": {"$sum": 1},
+            **{campo: {"$avg": f"${campo}"} for campo in campos}
+        }},
+    ])
+    # Manuales: pocos por día; se juntan en orden y se toma el primer valor no vacío de cada variable
+    manuales = collection.aggregate([
+        {"$match": {**filtro, "manual": True}},
+        {"$sort": {"tiempo": ASCENDING}},
+        {"$group": {
+            "_id": {"$dateToString": fecha},
+            "n": {"$sum": 1},
+            **{campo: {"$push": {"$ifNull": [f"${campo}", None]}} for campo in campos}
+        }},
+    ])
+
+    dias = {}
+    for doc in sensores:
+        fila = dias.setdefault(doc["_id"], {"fecha": doc["_id"], "n_sensor": 0, "n_manual": 0})
+        fila["n_sensor"] = doc["n"]
+        for campo in campos:
+            fila[f"{campo}_sensor"] = doc.get(campo)
+    for doc in manuales:
+        fila = dias.setdefault(doc["_id"], {"fecha": doc["_id"], "n_sensor": 0, "n_manual": 0})
+        fila["n_manual"] = doc["n"]
+        for campo in campos:
+            fila[f"{campo}_manual"] = next((v for v in doc.get(campo, []) if isinstance(v, (int, float))), None)
+
+    filas = []
+    for dia in sorted(dias):
+        fila = dias[dia]
+        for campo in campos:
+            manual, sensor = fila.get(f"{campo}_manual"), fila.get(f"{campo}_sensor")
+            manual = round(manual, 2) if manual is not None else None
+            sensor = round(sensor, 2) if sensor is not None else None
+            fila[f"{campo}_manual"], fila[f"{campo}_sensor"] = manual, sensor
+            fila[f"{campo}_diff"] = round(manual - sensor, 2) if manual is not None and sensor is not None else None
+        filas.append(fila)
+    return filas
+
+# --- ESTADO DE ALIMENTACIÓN ---
+def asegurar_indices_registro_comida(db=None):
+    # Con este índice el $group por dispositivo y el historial por dispositivo no recorren la colección
+    db = db if db is not None else obtener_db()
+    db["registro_comida"].create_index(
+        [("id_dispositivo", ASCENDING), ("tiempo", DESCENDING)],
+        name="id_dispositivo_tiempo"
+    )
+
+def obtener_estado_alimentacion(dispositivos=None, db=None):
+    # Última alimentación (UTC) y cantidad de eventos por dispositivo, en una sola agregación.
+    # Devuelve {id_dispositivo: {"ultima": datetime, "n": int}}; los dispositivos sin eventos no aparecen
+    db = db if db is not None else obtener_db()
+    filtro = {"id_dispositivo": {"$in": list(dispositivos)}} if dispositivos is not None else {}
+    cursor = db["registro_comida"].aggregate([
+        {"$match": filtro},
+        {"$group": {"_id": "$id_dispositivo", "ultima": {"$max": "$tiempo"}, "n": {"$sum": 1}}},
+    ])
+    return {doc["_id"]: {"ultima": doc["ultima"], "n": doc["n"]} for doc in cursor if doc["_id"] is not None}
+
+def obtener_historial_alimentacion(dispositivos=None, limit=200, db=None):
+    # Últimos "limit" eventos de alimentación (del más reciente al más antiguo), con la hora en Chile
+    db = db if db is not None else obtener_db()
+    filtro = {"id_dispositivo": {"$in": list(dispositivos)}} if dispositivos is not None else {}
+    cursor = db["registro_comida"].find(filtro, {"_id": 0, "tiempo": 1, "id_dispositivo": 1}).sort("tiempo", DESCENDING).limit(limit)
+    return [{"tiempo": convertir_a_chile(doc.get("tiempo")), "id_dispositivo": doc.get("id_dispositivo")} for doc in cursor]
+
 def obtener_registro_comida(limit=5000):
     # Usar variable de entorno "MONGO_URI" para conectarse a MongoDB, si no se encuentra la variable, lanza un error
     mongo_uri = os.environ.get("MONGO_URI")
@@ -72,3 +466,162 @@ def obtener_registro_comida(limit=5000):
     # Cierra la conexión a la base de datos, e invierte el orden del más antiguo al más reciente y los retorna
     client.close()
     return list(reversed(registros))
+
+# --- CLASIFICACIONES DEL MODELO ---
+# Las funciones reciben opcionalmente "db" para que la API pueda reutilizarlas con su propia conexión
+_client = None
+MONGO_TIMEOUT_MS = int(os.environ.get("MONGO_TIMEOUT_MS", "5000"))
+
+def obtener_db():
+    # Cliente compartido por el proceso, se crea una sola vez
+    global _client
+    if _client is None:
+        mongo_uri = os.environ.get("MONGO_URI")
+        if not mongo_uri:
+            raise RuntimeError("❌ No se encontró la variable de entorno MONGO_URI")
+        # Sin conexión se falla en segundos (y no en 30 s) para que la escritura pase al spool
+        _client = MongoClient(mongo_uri, serverSelectionTimeoutMS=MONGO_TIMEOUT_MS)
+    return _client["biorreactor_app"]
+
+# Las clasificaciones del servicio no tienen "origen"; las reconstruidas por el backfill (una por lectura)
+# tienen origen="backfill". Por defecto se leen solo las del servicio, para que el historial
+# reconstruido no desplace a las clasificaciones en vivo del límite de la consulta
+ORIGENES_CLASIFICACION = ("servicio", "backfill", "todos")
+
+def filtro_origen(origen="servicio"):
+    if origen not in ORIGENES_CLASIFICACION:
+        raise ValueError(f"Origen desconocido: {origen}")
+    if origen == "todos":
+        return {}
+    return {"origen": None if origen == "servicio" else origen}
+
+def filtro_dominio_clasificacion(dominio=None):
+    # Sin dominio no se filtra. Las clasificaciones guardadas antes de existir varios dominios no tienen
+    # "dominio": son del dominio por defecto (igual que los estados en servicio_clasificaciones)
+    if dominio is None:
+        return {}
+    return {"dominio": {"$in": [dominio, None]} if dominio == "dominio_terreno" else dominio}
+
+def asegurar_indices_clasificaciones(db=None):
+    # Índices para leer las últimas clasificaciones de un dispositivo (de un origen) sin recorrer la colección
+    db = db if db is not None else obtener_db()
+    db["clasificaciones"].create_index(
+        [("id_dispositivo", ASCENDING), ("timestamp", DESCENDING)],
+        name="id_dispositivo_timestamp"
+    )
+    db["clasificaciones"].create_index(
+        [("id_dispositivo", ASCENDING), ("origen", ASCENDING), ("timestamp", DESCENDING)],
+        name="id_dispositivo_origen_timestamp"
+    )
+
+def obtener_dispositivos_clasificados(db=None, dominio=None):
+    # Lista de dispositivos con clasificaciones (del dominio, si se indica), resuelta con el índice
+    db = db if db is not None else obtener_db()
+    return sorted(d for d in db["clasificaciones"].distinct("id_dispositivo", filtro_dominio_clasificacion(dominio)) if d)
+
+def obtener_clasificaciones(id_dispositivo, limit=50, db=None, origen="servicio", dominio=None):
+    # Últimas "limit" clasificaciones del dispositivo (en un dominio, si se indica: el mismo id puede
+    # existir en dos dominios), devueltas de la más antigua a la más reciente
+    db = db if db is not None else obtener_db()
+    cursor = db["clasificaciones"].find(
+        {"id_dispositivo": id_dispositivo, **filtro_origen(origen), **filtro_dominio_clasificacion(dominio)},
+        {"_id": 0, "fase": 1, "proba": 1, "timestamp": 1, "version_modelo": 1, "dominio": 1, "calidad": 1}
+    ).sort("timestamp", DESCENDING).limit(limit)
+    return list(reversed(list(cursor)))
+
+def obtener_timeline_fases(id_dispositivo, limit=1000, db=None, origen="servicio", dominio=None):
+    # Historial de fases comprimido por tramos (run-length): cada tramo agrupa clasificaciones
+    # consecutivas con la misma fase, con su inicio, fin y cantidad de clasificaciones
+    tramos = []
+    for doc in obtener_clasificaciones(id_dispositivo, limit=limit, db=db, origen=origen, dominio=dominio):
+        fase, tiempo = doc.get("fase"), doc.get("timestamp")
+        if tramos and tramos[-1]["fase"] == fase:
+            tramos[-1]["fin"] = tiempo
+            tramos[-1]["n"] += 1
+        else:
+            tramos.append({"fase": fase, "inicio": tiempo, "fin": tiempo, "n": 1})
+    return tramos
+
+# --- IMÁGENES DE LA CÁMARA ---
+# Los bytes de cada imagen van a GridFS (bucket "imagenes") y en "imagenes_camara" queda solo un
+# documento pequeño de metadatos con "archivo_id". Los documentos antiguos guardan la imagen
+# en base64 en el campo "imagen" hasta que se ejecute migrar_imagenes.py
+COLECCION_IMAGENES = "imagenes_camara"
+BUCKET_IMAGENES = "imagenes"
+TIPOS_CONTENIDO = {"jpg": "image/jpeg", "webp": "image/webp", "png": "image/png"}
+# Miniaturas JPEG guardadas en el mismo documento de metadatos (unos pocos KB cada una)
+MINIATURA_LADO_MAX = int(os.environ.get("MINIATURA_LADO_MAX", "320"))
+MINIATURA_CALIDAD = int(os.environ.get("MINIATURA_CALIDAD", "70"))
+# Campos que necesita la galería: nunca la imagen completa
+PROYECCION_GALERIA = {"tiempo": 1, "camara": 1, "archivo_id": 1, "formato": 1, "bytes": 1, "ancho": 1, "alto": 1, "miniatura": 1}
+
+def asegurar_indices_imagenes(db=None):
+    db = db if db is not None else obtener_db()
+    db[COLECCION_IMAGENES].create_index([("tiempo", DESCENDING)], name="tiempo")
+
+def crear_miniatura(archivo, lado_max=MINIATURA_LADO_MAX, calidad=MINIATURA_CALIDAD):
+    # Reduce la imagen (bytes u objeto tipo archivo) a un JPEG pequeño manteniendo la proporción
+    if isinstance(archivo, (bytes, bytearray)):
+        archivo = BytesIO(archivo)
+    imagen = Image.open(archivo)
+    imagen.draft("RGB", (lado_max, lado_max))  # En JPEG decodifica directo a menor resolución
+    imagen = imagen.convert("RGB")
+    imagen.thumbnail((lado_max, lado_max))
+    salida = BytesIO()
+    imagen.save(salida, format="JPEG", quality=calidad)
+    return salida.getvalue()
+
+def guardar_imagen(datos, tiempo, formato="jpg", metadatos=None, db=None, doc_id=None):
+    # Sube los bytes de la imagen a GridFS y guarda su documento de metadatos con la miniatura;
+    # devuelve el _id del documento. Con "doc_id" (clave de idempotencia) se puede reintentar sin
+    # duplicar: el archivo y el documento usan ese _id y si el documento ya existe no se hace nada
+    db = db if db is not None else obtener_db()
+    if doc_id is not None and db[COLECCION_IMAGENES].find_one({"_id": doc_id}, {"_id": 1}):
+        return doc_id
+    bucket = GridFSBucket(db, bucket_name=BUCKET_IMAGENES)
+    metadatos = metadatos or {}
+    nombre = f"captura_{tiempo.strftime('%Y%m%d_%H%M%S')}.{formato}"
+    metadatos_archivo = {"tiempo": tiempo, "content_type": TIPOS_CONTENIDO.get(formato), **metadatos}
+    if doc_id is None:
+        archivo_id = bucket.upload_from_stream(nombre, datos, metadata=metadatos_archivo)
+    else:
+        archivo_id = doc_id
+        if db[f"{BUCKET_IMAGENES}.files"].find_one({"_id": doc_id}, {"_id": 1}) is None:
+            # Restos de una subida interrumpida: GridFS escribe el documento del archivo al final
+            db[f"{BUCKET_IMAGENES}.chunks"].delete_many({"files_id": doc_id})
+            bucket.upload_from_stream_with_id(doc_id, nombre, datos, metadata=metadatos_archivo)
+    doc = {"tiempo": tiempo, "archivo_id": archivo_id, "formato": formato, "bytes": len(datos), **metadatos}
+    if doc_id is not None:
+        doc["_id"] = doc_id
+    try:
+        doc["miniatura"] = crear_miniatura(datos)
+    except Exception as e:
+        # Sin miniatura la galería la genera la primera vez que se muestre
+        print(f"⚠️ No se pudo generar la miniatura: {e}")
+    return db[COLECCION_IMAGENES].insert_one(doc).inserted_id
+
+def obtener_miniatura(doc, db=None):
+    # Miniatura del documento; si no la tiene (imágenes anteriores) se genera una vez y se guarda
+    if doc.get("miniatura"):
+        return doc["miniatura"]
+    db = db if db is not None else obtener_db()
+    archivo = abrir_imagen(doc, db=db)
+    if archivo is None:
+        return None
+    miniatura = crear_miniatura(archivo)
+    db[COLECCION_IMAGENES].update_one({"_id": doc["_id"]}, {"$set": {"miniatura": miniatura}})
+    return miniatura
+
+def abrir_imagen(doc, db=None):
+    # Devuelve un objeto tipo archivo con la imagen: en GridFS se lee por partes (streaming);
+    # en documentos antiguos se decodifica el base64 (si no vino en "doc" se pide solo ese campo)
+    db = db if db is not None else obtener_db()
+    if doc.get("archivo_id") is not None:
+        return GridFSBucket(db, bucket_name=BUCKET_IMAGENES).open_download_stream(doc["archivo_id"])
+    imagen = doc.get("imagen")
+    if imagen is None:
+        legado = db[COLECCION_IMAGENES].find_one({"_id": doc["_id"]}, {"imagen": 1})
+        imagen = legado.get("imagen") if legado else None
+    if imagen is None:
+        return None
+    return BytesIO(base64.b64decode(imagen))
@@ -1,19 +1,41 @@
+import hashlib
+import os
 import streamlit as st
 from streamlit_autorefresh import st_autorefresh
 import pandas as pd
 import plotly.graph_objects as go
-import requests
 from pymongo import MongoClient
-from datetime import datetime
+from datetime import datetime, timedelta
 import pytz
 from PIL import Image
-import base64
-from io import BytesIO
 import numpy as np
+from database import (
+    obtener_dispositivos_clasificados, obtener_clasificaciones, obtener_timeline_fases,
+    abrir_imagen, obtener_miniatura, PROYECCION_GALERIA,
+    obtener_comparacion_manual, inicio_dia_utc,
+    obtener_estado_alimentacion, obtener_historial_alimentacion, convertir_a_chile, METRICAS_DOMINIO
+)
+from planificador import programar
+from reduccion_series import lttb
+from spool import obtener_spool, enviar_o_encolar, manejador_http, SPOOL_REENVIO_S
 
 # --- CREDENCIALES PARA BASE DE DATOS ---
 MONGO_URI = st.secrets["MONGO_URI"]
 
+# --- API DE REGISTROS ---
+# URL base de la API Flask a la que se envían los registros (alimentación y manuales)
+API_BASE_URL = (os.environ.get("API_BASE_URL") or st.secrets.get("API_BASE_URL", "http://localhost:5000")).rstrip("/")
+
+# --- REGISTROS PENDIENTES ---
+# Los registros que no llegan a la API (sin conexión) quedan en este archivo y se reenvían en segundo plano
+SPOOL_DASHBOARD = os.environ.get("SPOOL_DASHBOARD", "spool_dashboard.sqlite3")
+
+def enviar_registro(url, datos):
+    # Envía el registro a la API; si no hay conexión queda pendiente (devuelve None) y se programa el reenvío
+    spool = obtener_spool(SPOOL_DASHBOARD)
+    programar("reenviar_spool_dashboard", lambda: spool.reenviar({"http": manejador_http}), SPOOL_REENVIO_S)
+    return enviar_o_encolar(spool, url, datos)
+
 # --- UMBRALES DE VARIABLES AMBIENTALES ---
 UMBRAL = {
     "temperatura": (18, 27),
@@ -22,6 +44,33 @@ UMBRAL = {
     "luz": (0, 5000)
 }
 
+# --- VARIABLES POR DOMINIO ---
+# Nombre, unidad y color de cada variable graficada
+VARIABLES_SENSORES = {
+    "temperatura": ("🌡️ Temperatura", "°C", "red"),
+    "ph": ("🌊 pH", "pH", "purple"),
+    "oxigeno": ("🫁 Oxígeno", "mg/L", "green"),
+    "luz": ("⚡ Luz", "lux", "orange"),
+}
+# Métricas de las imágenes de la cámara (dominio METRICAS_DOMINIO, una serie por cámara)
+VARIABLES_IMAGEN = {
+    "verde_relativo": ("🟢 Verde relativo", "G/(R+G+B)", "green"),
+    "fraccion_verde": ("🌿 Fracción verde", "fracción", "darkgreen"),
+    "turbidez": ("🌫️ Turbidez", "0–1", "gray"),
+    "nitidez": ("🔍 Nitidez", "var. laplaciano", "black"),
+    "contraste": ("◐ Contraste", "desv. gris", "brown"),
+    "h_media": ("🎨 Tono medio", "0–179", "teal"),
+    "tono_dominante": ("🎯 Tono dominante", "0–179", "darkcyan"),
+    "entropia_tono": ("📶 Entropía de tono", "bits", "purple"),
+    "s_media": ("💧 Saturación media", "0–255", "blue"),
+    "v_media": ("💡 Brillo medio", "0–255", "orange"),
+    "verde_media": ("🟩 Canal verde", "0–255", "limegreen"),
+    "fraccion_color": ("🌈 Fracción con color", "fracción", "magenta"),
+}
+
+def variables_dominio(dominio):
+    return VARIABLES_IMAGEN if dominio == METRICAS_DOMINIO else VARIABLES_SENSORES
+
 # --- UTILIDADES ---
 def parsear_decimal(valor_str, nombre_campo):
     if not valor_str:
@@ -43,10 +92,44 @@ def evaluar_alertas_dispositivo(row):
             )
     return alertas
 
+# --- REDUCCIÓN DE PUNTOS PARA GRÁFICOS ---
+# Un gráfico no puede mostrar más puntos que píxeles de ancho: las series largas se reducen con LTTB
+# a PUNTOS_GRAFICO puntos, y por encima de UMBRAL_WEBGL puntos la traza se dibuja con WebGL (Scattergl)
+PUNTOS_GRAFICO = int(os.environ.get("DASHBOARD_PUNTOS_GRAFICO", "1500"))
+UMBRAL_WEBGL = int(os.environ.get("DASHBOARD_UMBRAL_WEBGL", "1000"))
+
+@st.cache_data(ttl=600, max_entries=256)
+def _reducir_cacheado(dispositivo, variable, inicio, fin, n_filas, huella, n_puntos, _tiempos, _valores):
+    # La clave es (dispositivo, variable, rango, cantidad de filas, huella de los valores, puntos): los arreglos
+    # no se hashean en Streamlit. La huella distingue series con el mismo nombre y rango (ej. otro dominio)
+    indices = lttb(_tiempos.astype("int64"), _valores, n_puntos)
+    return _tiempos[indices], _valores[indices]
+
+def reducir_serie(tiempos, valores, dispositivo, variable, n_puntos=PUNTOS_GRAFICO):
+    """Serie sin NaN reducida con LTTB para graficar (cacheada por dispositivo, variable, rango y contenido)"""
+    tiempos = np.asarray(tiempos, dtype="datetime64[ns]")
+    valores = np.asarray(valores, dtype=np.float64)
+    validos = ~np.isnan(valores)
+    tiempos, valores = tiempos[validos], valores[validos]
+    if len(valores) <= n_puntos:
+        return tiempos, valores
+    # Huella del contenido (blake2b sobre los bytes): bastante más barata que reducir la serie con LTTB
+    huella = hashlib.blake2b(valores.tobytes(), digest_size=8).hexdigest()
+    return _reducir_cacheado(str(dispositivo), variable, tiempos[0], tiempos[-1], len(valores), huella, n_puntos,
+                             tiempos, valores)
+
+def traza_serie(x, y, reducida=False, **kwargs):
+    """Traza de Plotly: WebGL si hay muchos puntos, y sin marcadores si la serie fue reducida"""
+    clase = go.Scattergl if len(x) > UMBRAL_WEBGL else go.Scatter
+    kwargs.setdefault("mode", "lines" if reducida else "lines+markers")
+    if reducida:
+        kwargs.pop("marker", None)
+    return clase(x=x, y=y, **kwargs)
+
 # --- FILTRO GLOBAL DE DISPOSITIVOS ---
-def mostrar_filtro_global(df, dominio_actual):
-    # Obtener la lista única de dispositivos ordenada
-    dispositivos = sorted(df["id_dispositivo"].dropna().unique())
+def mostrar_filtro_global(dispositivos, dominio_actual):
+    # Lista de dispositivos del dominio, ordenada
+    dispositivos = sorted(dispositivos)
 
     # Define claves únicas para session_state
     clave_ids = f"ids_filtrados_{dominio_actual}"
@@ -141,6 +224,15 @@ def mostrar_metricas(df):
         # Mostrar título de dispositivo y última medición
         st.markdown(f"**🔎 Dispositivo:** `{disp}`  \n🕒 Última medición: `{tiempo_str}`")
 
+        # Cámara: últimas métricas de imagen, sin umbrales de alerta
+        if dominio_actual == METRICAS_DOMINIO:
+            columnas = st.columns(4)
+            for i, (var, (nombre, unidad, _)) in enumerate(VARIABLES_IMAGEN.items()):
+                valor = df_disp[var].iloc[0] if var in df_disp.columns else None
+                columnas[i % 4].metric(nombre, "—" if pd.isna(valor) else f"{valor:.3f} {unidad}")
+            st.markdown("---")
+            continue
+
         # Mostrar últimas métricas de cada variable en columnas 
         col1, col2, col3, col4 = st.columns(4)
         col1.metric("🌡️ Temperatura", f"{df_disp['temperatura'].iloc[0]:.2f} °C")
@@ -265,13 +357,9 @@ def mostrar_graficos(df):
         mime='text/csv'
     )
 
-    # Diccionario de las variables para graficar
-    variables = {
-        "temperatura": ("🌡️ Temperatura", "°C", "red"),
-        "ph": ("🌊 pH", "pH", "purple"),
-        "oxigeno": ("🫁 Oxígeno", "mg/L", "green"),
-        "luz": ("⚡ Luz", "lux", "orange"),
-    }
+    # Diccionario de las variables para graficar (sensores, o métricas de imagen en el dominio de la cámara)
+    dominio_actual = st.session_state.get("dominio_seleccionado", "dominio_terreno")
+    variables = variables_dominio(dominio_actual)
 
     # Crear pestañas: una por variable + comparación múltiple + comparación de variables
     tab_labels = list([nombre for (nombre, _, _) in variables.values()])
@@ -283,15 +371,19 @@ def mostrar_graficos(df):
     for i, (var, (nombre, unidad, color)) in enumerate(variables.items()):
         with tabs[i]:
             if var in df_id.columns:
+                x, y = reducir_serie(df_id["tiempo"], df_id[var], id_seleccionado, var)
+                reducida = len(x) < df_id[var].notna().sum()
                 fig = go.Figure()
-                fig.add_trace(go.Scatter(
-                    x=df_id["tiempo"], y=df_id[var],
-                    mode="lines+markers",
+                fig.add_trace(traza_serie(
+                    x, y, reducida,
                     name=nombre,
                     line=dict(color=color, width=2),
                     marker=dict(size=6, opacity=0.7)
                 ))
-                fig.update_layout(title=f"{nombre} - {id_seleccionado}", xaxis_title="Tiempo", yaxis_title=unidad, height=400)
+                titulo = f"{nombre} - {id_seleccionado}"
+                if reducida:
+                    titulo += f" ({len(x)} de {df_id[var].notna().sum()} puntos)"
+                fig.update_layout(title=titulo, xaxis_title="Tiempo", yaxis_title=unidad, height=400)
                 fig.update_xaxes(tickformat="%d-%m %H:%M", tickangle=45)
                 fig.update_yaxes(showgrid=True)
                 st.plotly_chart(fig, use_container_width=True)
@@ -308,10 +400,8 @@ def mostrar_graficos(df):
             fig = go.Figure()
             for disp in seleccionados:
                 df_disp = df[df["id_dispositivo"] == disp]
-                fig.add_trace(go.Scatter(
-                    x=df_disp["tiempo"], y=df_disp[var_multi],
-                    mode="lines+markers", name=disp
-                ))
+                x, y = reducir_serie(df_disp["tiempo"], df_disp[var_multi], disp, var_multi)
+                fig.add_trace(traza_serie(x, y, len(x) < df_disp[var_multi].notna().sum(), name=disp))
             fig.update_layout(
                 title=f"Comparación de {variables[var_multi][0]} entre múltiples dispositivos",
                 xaxis_title="Tiempo", yaxis_title=variables[var_multi][1], height=450)
@@ -326,7 +416,7 @@ def mostrar_graficos(df):
         vars_seleccionadas = st.multiselect(
             "Variables a graficar:",
             list(variables.keys()),
-            default=["ph", "oxigeno"],
+            default=[v for v in ("ph", "oxigeno") if v in variables] or list(variables)[:2],
             format_func=lambda x: variables[x][0]
         )
 
@@ -375,9 +465,10 @@ def mostrar_graficos(df):
                         if serie_plot is None or serie_plot.dropna().empty:
                             st.warning(f"⚠ '{nombre}' no tiene datos suficientes tras normalización.")
                             continue
-                        fig.add_trace(go.Scatter(
-                            x=serie_plot.index, y=serie_plot,
-                            mode="lines+markers",
+                        # La clave de caché incluye el suavizado, que cambia la serie normalizada
+                        x, y = reducir_serie(serie_plot.index, serie_plot, id_seleccionado, f"{var}_z{ventana}")
+                        fig.add_trace(traza_serie(
+                            x, y, len(x) < serie_plot.notna().sum(),
                             name=f"{nombre} (Z-score norm.)",
                             line=dict(width=2, color=color) if color else dict(width=2),
                             hovertemplate="%{x|%d-%m %H:%M}<br>%{y:.3f}<extra></extra>"
@@ -398,40 +489,26 @@ def mostrar_graficos(df):
 def mostrar_modelo():
     st.subheader("🤖 Clasificación de fase del cultivo (Modelo GRU)")
 
-    # Consulta a colección clasificaciones
-    client = MongoClient(MONGO_URI)
-    db = client["biorreactor_app"]
-    df_clasificaciones = pd.DataFrame(list(db["clasificaciones"].find()))
-
-    df = df_clasificaciones.copy()
-
-    # Asegurarse de que existan las columnas
-    for col in ["fase", "proba", "timestamp"]:
-        if col not in df.columns:
-            df[col] = df.apply(lambda row: row.get(col, None), axis=1)
-
-    # Selección de dispositivo
-    dispositivos = sorted(df["id_dispositivo"].dropna().unique())
+    # Lista de dispositivos del dominio seleccionado resuelta con "distinct" (no se cargan documentos)
+    dominio_actual = st.session_state.get("dominio_seleccionado", "dominio_terreno")
+    dispositivos = obtener_dispositivos_clasificados(dominio=dominio_actual)
     if not dispositivos:
         st.warning("No hay dispositivos disponibles.")
         return
 
     dispositivo = st.selectbox("📟 Selecciona un dispositivo:", dispositivos)
-    df_disp = df[df["id_dispositivo"] == dispositivo].copy()
 
-    # Convertir timestamp a datetime
-    df_disp["timestamp"] = df_disp["timestamp"].apply(
-        lambda x: pd.to_datetime(x.get("$date")) if isinstance(x, dict) else pd.to_datetime(x, errors="coerce")
-    )
-    df_disp = df_disp.dropna(subset=["timestamp"])  # eliminar filas sin timestamp
+    # Consultar solo las últimas clasificaciones del dispositivo (índice id_dispositivo + timestamp)
+    df_disp = pd.DataFrame(obtener_clasificaciones(dispositivo, limit=10, dominio=dominio_actual),
+                           columns=["timestamp", "fase", "proba"])
 
     # Convertir a hora chilena y renombrar columna
-    df_disp["tiempo"] = df_disp["timestamp"].dt.tz_localize("UTC").dt.tz_convert("America/Santiago")
-    df_disp = df_disp.sort_values("tiempo")
+    df_disp["tiempo"] = pd.to_datetime(df_disp["timestamp"], errors="coerce", utc=True).dt.tz_convert("America/Santiago")
+    df_disp = df_disp.dropna(subset=["tiempo"]).sort_values("tiempo")
 
     # Mostrar últimas clasificaciones
     st.markdown("### 📊 Últimas clasificaciones guardadas")
-    st.dataframe(df_disp[["tiempo", "fase", "proba"]].tail(10))
+    st.dataframe(df_disp[["tiempo", "fase", "proba"]])
 
     # Mostrar última clasificación
     if not df_disp.empty:
@@ -466,66 +543,56 @@ def mostrar_modelo():
         )
         st.plotly_chart(fig, use_container_width=True)
 
+    # Historial de fases por tramos (cada tramo agrupa clasificaciones consecutivas de la misma fase)
+    with st.expander("🕰️ Historial de fases"):
+        # Por defecto solo las clasificaciones en vivo; el historial reconstruido (backfill) se ve aparte
+        origen = "backfill" if st.checkbox("Ver historial reconstruido (backfill)", key="historial_backfill") else "servicio"
+        tramos = pd.DataFrame(obtener_timeline_fases(dispositivo, limit=1000, origen=origen, dominio=dominio_actual),
+                              columns=["fase", "inicio", "fin", "n"])
+        for col in ["inicio", "fin"]:
+            tramos[col] = pd.to_datetime(tramos[col], utc=True).dt.tz_convert("America/Santiago")
+        st.dataframe(tramos.iloc[::-1].rename(columns={"n": "clasificaciones"}), use_container_width=True)
+
     # Refrescar automáticamente cada 60 segundos
     st_autorefresh(interval=60000, key="refresh_modelo")
 
 # --- REGISTRO DE ALIMENTACIÓN ---
-def mostrar_registro_comida(registros, dominio_seleccionado, ids_filtrados=None):
+def mostrar_registro_comida(dominio_seleccionado, ids_filtrados=None):
     st.subheader("🍽️ Registro de Alimentación")
 
-    # Verificar que lista de dispositivos seleccionados esté definida
-    if ids_filtrados is None:
-        ids_filtrados = []
-
-    # Mostrar historial de alimentación expandible
-    if registros:
-        with st.expander("📄 Historial de alimentación por dispositivo"):
-            # Si hay registros, convertir en dataframe
-            df_comida = pd.DataFrame(registros)
-
-            # Filtrar por dispositivos seleccionados
-            df_comida = df_comida[df_comida["id_dispositivo"].isin(ids_filtrados)]
-
-            # Ordenar los registros por fecha descendente
-            df_comida["tiempo"] = pd.to_datetime(df_comida["tiempo"])
-            df_ordenado = df_comida.sort_values("tiempo", ascending=False)
-            df_ordenado["tiempo"] = df_ordenado["tiempo"].dt.strftime("%Y-%m-%d %H:%M:%S")
-
-            # Mostrar solamente las columnas de tiempo e id_dispositivo
-            st.dataframe(df_ordenado[["tiempo", "id_dispositivo"]], use_container_width=True)
-    else:
-        st.info("ℹ️ No hay registros de alimentación aún.")
+    # Dispositivos seleccionados en el filtro global (ya pertenecen al dominio seleccionado)
+    dispositivos_ordenados = sorted(d for d in (ids_filtrados or []) if d)
+    if not dispositivos_ordenados:
+        st.info(f"ℹ️ No hay dispositivos seleccionados para registrar alimentación en '{dominio_seleccionado}'.")
         return
 
     try:
-        # Conexión a base de datos para obtener dispositivos dentro del dominio seleccionado
-        client = MongoClient(MONGO_URI)
-        db = client["biorreactor_app"]
-        collection = db[dominio_seleccionado]
-        dispositivos_db = collection.distinct("id_dispositivo")
-
-        # Filtrar solo los que están en ids_filtrados
-        dispositivos_ordenados = sorted([d for d in dispositivos_db if d and d in ids_filtrados])
+        # Última alimentación y cantidad de eventos de cada dispositivo, agrupados en MongoDB (una fila por dispositivo)
+        estado = obtener_estado_alimentacion(dispositivos_ordenados)
     except Exception as e:
-        st.error(f"❌ Error al obtener dispositivos del dominio '{dominio_seleccionado}': {e}")
+        st.error(f"❌ Error al obtener el estado de alimentación: {e}")
         return
 
-    if not dispositivos_ordenados:
-        st.info("ℹ️ No hay dispositivos disponibles para registrar alimentación en este dominio.")
-        return
+    # Mostrar historial de alimentación expandible (solo los últimos eventos, leídos con el índice)
+    with st.expander("📄 Historial de alimentación por dispositivo"):
+        historial = obtener_historial_alimentacion(dispositivos_ordenados)
+        if historial:
+            df_comida = pd.DataFrame(historial)
+            df_comida["tiempo"] = df_comida["tiempo"].map(lambda t: t.strftime("%Y-%m-%d %H:%M:%S") if t else "Sin tiempo")
+            st.dataframe(df_comida[["tiempo", "id_dispositivo"]], use_container_width=True)
+        else:
+            st.info("ℹ️ No hay registros de alimentación aún.")
 
     st.markdown("### 📋 Estado actual de alimentación por dispositivo")
     ahora_chile = datetime.now(pytz.timezone("America/Santiago"))
 
-    # Para cada dispositivo, obtener el último registro de alimentación
     for dispositivo in dispositivos_ordenados:
-        registros_dispositivo = [r for r in registros if r["id_dispositivo"] == dispositivo]
-        if registros_dispositivo:
-            #Calcular cuántos días han pasado desde ese último evento
-            ultimo = max(registros_dispositivo, key=lambda x: x["tiempo"])
-            ultima_fecha = pd.to_datetime(ultimo["tiempo"])
+        ultimo = estado.get(dispositivo)
+        if ultimo and ultimo["ultima"] is not None:
+            # Calcular cuántos días han pasado desde ese último evento (en hora de Chile)
+            ultima_fecha = convertir_a_chile(ultimo["ultima"])
             dias_sin_alimentar = (ahora_chile.date() - ultima_fecha.date()).days
-            ultima_str = ultima_fecha.strftime("%Y-%m-%d %H:%M:%S")
+            ultima_str = f"{ultima_fecha:%Y-%m-%d %H:%M:%S} ({ultimo['n']} en total)"
         else:
             ultima_str = "Sin registros"
             dias_sin_alimentar = None
@@ -555,12 +622,15 @@ def mostrar_registro_comida(registros, dominio_seleccionado, ids_filtrados=None)
             with col4:
                 if st.button("🍽️ Alimentar", key=f"alimentar_{dispositivo}"):
                     # Enviar un POST a la API para registrar el evento de alimentación
-                    response = requests.post(
-                        "https://biorreactor-app.onrender.com/api/registro_comida",
-                        json={"evento": "comida", "id_dispositivo": dispositivo}
+                    response = enviar_registro(
+                        f"{API_BASE_URL}/api/registro_comida",
+                        {"evento": "comida", "id_dispositivo": dispositivo}
                     )
+                    # Sin conexión el registro queda pendiente y se envía cuando vuelva
+                    if response is None:
+                        st.warning(f"📥 Sin conexión: la alimentación de {dispositivo} se enviará cuando vuelva la conexión.")
                     # Si responde con éxito (201), muestra un mensaje y refresca la página
-                    if response.status_code == 201:
+                    elif response.status_code == 201:
                         st.success(f"✅ Alimentación registrada para {dispositivo}.")
                         st.rerun()
                     else:
@@ -585,7 +655,8 @@ def mostrar_imagenes(db):
     # Consulta a MongoDB
     # Al seleccionar una fecha, se filtra imágenes dentro de ese rango horario (desde el inicio al fin del día), 
     # convirtiendo las zonas horarias desde Santiago a UTC, ya que MongoDB guarda en UTC
-    query = {}
+    # Los latidos de imágenes sin cambios (duplicado_de) no tienen imagen propia y no se muestran
+    query = {"duplicado_de": {"$exists": False}}
     if fecha_filtrada:
         inicio_dia = datetime.combine(fecha_filtrada, datetime.min.time()).replace(tzinfo=pytz.timezone("America/Santiago"))
         fin_dia = datetime.combine(fecha_filtrada, datetime.max.time()).replace(tzinfo=pytz.timezone("America/Santiago"))
@@ -595,26 +666,41 @@ def mostrar_imagenes(db):
         }
 
     # Buscar con el filtro anterior, y se ordenan por tiempo descendente 
-    # y se limita el número de resultados según el valor ingresado del usuario
-    documentos = list(collection.find(query).sort("tiempo", -1).limit(cantidad))
+    # y se limita el número de resultados según el valor ingresado del usuario.
+    # Solo se traen los metadatos y la miniatura, nunca la imagen completa
+    documentos = list(collection.find(query, PROYECCION_GALERIA).sort("tiempo", -1).limit(cantidad))
 
     if not documentos:
         st.info("⚠️ No hay imágenes para mostrar con los filtros seleccionados.")
         return
 
-    # Mostrar imágenes en columnas dinámicas
+    # Convertir la hora UTC a horario de Chile
+    chile_tz = pytz.timezone("America/Santiago")
+    def texto_tiempo(doc):
+        return doc["tiempo"].replace(tzinfo=pytz.utc).astimezone(chile_tz).strftime('%Y-%m-%d %H:%M:%S')
+
+    # Mostrar miniaturas en columnas dinámicas (las que falten se generan una vez y quedan guardadas)
     cols = st.columns(len(documentos))
     for idx, doc in enumerate(documentos):
-        if 'imagen' in doc and 'tiempo' in doc:
-            # Decodificar la cadena Base64 y se convierte a formato PIL.Image para mostrarla
-            imagen_bytes = base64.b64decode(doc['imagen'])
-            imagen = Image.open(BytesIO(imagen_bytes))
-            # Convertir la hora UTC a horario de Chile
-            chile_tz = pytz.timezone("America/Santiago")
-            tiempo_chile = doc["tiempo"].replace(tzinfo=pytz.utc).astimezone(chile_tz)
-            tiempo_str = tiempo_chile.strftime('%Y-%m-%d %H:%M:%S')
-            # Mostrar la imagen junto con su fecha y hora en que fue tomada
-            cols[idx].image(imagen, caption=f"Capturada el {tiempo_str}", use_container_width=True)
+        if 'tiempo' in doc:
+            miniatura = obtener_miniatura(doc, db=db)
+            if miniatura is None:
+                continue
+            # Mostrar la miniatura junto con su fecha y hora en que fue tomada
+            camara = f"{doc['camara']} · " if doc.get("camara") else ""
+            cols[idx].image(miniatura, caption=f"{camara}Capturada el {texto_tiempo(doc)}", use_container_width=True)
+            if cols[idx].button("🔍 Ver original", key=f"ver_imagen_{doc['_id']}"):
+                st.session_state["imagen_abierta"] = doc["_id"]
+
+    # La imagen completa se lee desde GridFS solo para la que se abrió
+    abierta = next((doc for doc in documentos if doc["_id"] == st.session_state.get("imagen_abierta")), None)
+    if abierta:
+        archivo = abrir_imagen(abierta, db=db)
+        if archivo is not None:
+            st.image(Image.open(archivo), caption=f"Original capturada el {texto_tiempo(abierta)}", use_container_width=True)
+        if st.button("✖️ Cerrar imagen", key="cerrar_imagen"):
+            st.session_state.pop("imagen_abierta")
+            st.rerun()
 
 # --- REGISTRO MANUAL ---
 def mostrar_registro_manual():
@@ -678,10 +764,13 @@ def mostrar_registro_manual():
                     data[campo] = parsear_decimal(valor, campo.capitalize())
 
             # Hacer petición POST a la API
-            response = requests.post("https://biorreactor-app.onrender.com/api/registro_manual", json=data)
+            response = enviar_registro(f"{API_BASE_URL}/api/registro_manual", data)
 
+            # Sin conexión el registro queda pendiente y se envía cuando vuelva
+            if response is None:
+                st.warning(f"📥 Sin conexión: el registro de `{dispositivo}` se enviará cuando vuelva la conexión.")
             # Si el servidor responde con éxito (201)
-            if response.status_code == 201:
+            elif response.status_code == 201:
                 # Mostrar mensaje de éxito
                 st.success(f"✅ Registro enviado correctamente para `{dispositivo}`.")
                 st.session_state["registro_manual_exitoso"] = True
@@ -855,49 +944,33 @@ def mostrar_registro_manual_vs_sensor():
     # Selección del dispositivo
     dispositivo = st.selectbox("📟 Selecciona un dispositivo:", ids)
 
+    # Rango de fechas elegido en los filtros (si no hay, todo el historial)
+    fecha_inicio = st.session_state.get("fecha_inicio")
+    fecha_fin = st.session_state.get("fecha_fin")
+    desde = inicio_dia_utc(fecha_inicio) if fecha_inicio else None
+    hasta = inicio_dia_utc(fecha_fin + timedelta(days=1)) if fecha_fin else None
+
     try:
         # Conexión a la base de datos con el dominio actual
         client = MongoClient(MONGO_URI)
         db = client["biorreactor_app"]
-        collection = db[dominio_actual]
 
-        # Buscar todos los registros del dispositivo seleccionado
-        registros = list(collection.find({"id_dispositivo": dispositivo}))
-        if not registros:
+        # MongoDB agrupa por día: llega una fila por día con el promedio de sensores y el primer registro manual
+        filas = obtener_comparacion_manual(dispositivo, dominio_actual, desde, hasta, db=db)
+        if not filas:
             st.info("ℹ️ No hay registros para este dispositivo.")
             return
-        
-        # Convertir los datos a un dataframe, transformando la columna "tiempo" y extrayendo la fecha
-        df = pd.DataFrame(registros)
-        df["tiempo"] = pd.to_datetime(df["tiempo"])
-        df["fecha"] = df["tiempo"].dt.date
 
         # Variables a comparar
         vars_medibles = ["temperatura", "ph", "oxigeno", "luz"]
 
-        # Separar registros manuales y automáticos
-        df_manual = df[df["manual"] == True].copy()
-        df_auto = df[(df["manual"] != True)].copy()
-
-        if df_manual.empty or df_auto.empty:
+        # Solo los días con registros manuales y automáticos
+        df_comp = pd.DataFrame(filas)
+        df_comp = df_comp[(df_comp["n_manual"] > 0) & (df_comp["n_sensor"] > 0)]
+        if df_comp.empty:
             st.info("ℹ️ Se necesitan registros manuales y automáticos para comparar.")
             return
-        
-        # Agrupar automáticos por día, calculando la mediana o promedio
-        df_auto_grouped = df_auto.groupby("fecha")[vars_medibles].mean().round(2).reset_index() #.median() - Mediana
-
-        # Agrupar manuales por día, tomando el primer registro del día 
-        df_manual_grouped = df_manual.groupby("fecha")[vars_medibles].first().round(2).reset_index()
-
-        # Combinar ambas tablas por la columna "fecha"
-        df_comp = pd.merge(df_manual_grouped, df_auto_grouped, on="fecha", suffixes=("_manual","_sensor"))
-
-        # Calcular diferencia por variable medible, se calcula la diferencia diaria entre el registro manual y el automático
-        for var in vars_medibles:
-            col_manual = f"{var}_manual"
-            col_sensor = f"{var}_sensor"
-            if col_manual in df_comp.columns and col_sensor in df_comp.columns:
-                df_comp[f"{var}_diff"] = (df_comp[col_manual] - df_comp[col_sensor]).round(2)
+        df_comp["fecha"] = pd.to_datetime(df_comp["fecha"]).dt.date
 
         # Mostrar tabla comparativa
         columnas_mostrar = ["fecha"]
@@ -0,0 +1,87 @@
+"""
+Migra las imágenes guardadas en base64 dentro de "imagenes_camara" a GridFS.
+
+Cada documento antiguo ({"tiempo", "imagen": <base64>}) se sube como binario al
+bucket "imagenes" y el documento queda solo con sus metadatos, "archivo_id" y
+una miniatura para la galería.
+Se puede interrumpir y volver a ejecutar: solo procesa documentos que aún
+tienen el campo "imagen".
+
+Uso (desde la raíz del repo):
+    python migrar_imagenes.py --simular
+    python migrar_imagenes.py --lote 50
+
+MongoDB no devuelve al sistema el espacio liberado hasta ejecutar `compact`
+sobre la colección (o resincronizar el nodo en Atlas).
+"""
+import argparse
+import base64
+import time
+
+from gridfs import GridFSBucket
+
+from database import (
+    obtener_db, asegurar_indices_imagenes, crear_miniatura,
+    COLECCION_IMAGENES, BUCKET_IMAGENES, TIPOS_CONTENIDO
+)
+
+def migrar(db, lote=50, simular=False):
+    collection = db[COLECCION_IMAGENES]
+    bucket = GridFSBucket(db, bucket_name=BUCKET_IMAGENES)
+    filtro = {"imagen": {"$exists": True}, "archivo_id": {"$exists": False}}
+
+    total = collection.count_documents(filtro)
+    print(f"🖼️ {total} imágenes en base64 por migrar")
+    if simular or total == 0:
+        return 0
+
+    migradas, bytes_base64, bytes_binario = 0, 0, 0
+    t0 = time.perf_counter()
+    while True:
+        # Se leen solo los _id del lote; cada imagen se trae de a una para no cargar el lote completo en memoria
+        ids = [doc["_id"] for doc in collection.find(filtro, {"_id": 1}).limit(lote)]
+        if not ids:
+            break
+        for _id in ids:
+            doc = collection.find_one({"_id": _id, **filtro})
+            if doc is None:
+                continue
+            datos = base64.b64decode(doc["imagen"])
+            tiempo = doc.get("tiempo")
+            nombre = f"captura_{tiempo.strftime('%Y%m%d_%H%M%S')}.jpg" if tiempo else f"captura_{_id}.jpg"
+            archivo_id = bucket.upload_from_stream(
+                nombre, datos, metadata={"tiempo": tiempo, "content_type": TIPOS_CONTENIDO["jpg"]}
+            )
+            # El $exists en el filtro evita pisar un documento que otro proceso ya migró
+            cambios = {"archivo_id": archivo_id, "formato": "jpg", "bytes": len(datos)}
+            try:
+                cambios["miniatura"] = crear_miniatura(datos)
+            except Exception as e:
+                print(f"⚠️ Sin miniatura para {_id}: {e}")
+            resultado = collection.update_one(
+                {"_id": _id, "imagen": {"$exists": True}},
+                {"$set": cambios, "$unset": {"imagen": ""}}
+            )
+            if resultado.modified_count == 0:
+                bucket.delete(archivo_id)
+                continue
+            migradas += 1
+            bytes_base64 += len(doc["imagen"])
+            bytes_binario += len(datos)
+        print(f"  {migradas}/{total} migradas ({time.perf_counter() - t0:.1f} s)")
+
+    print(f"✔️ {migradas} imágenes migradas: {bytes_base64 / 1e6:.1f} MB en base64 → {bytes_binario / 1e6:.1f} MB en binario")
+    return migradas
+
+def main():
+    parser = argparse.ArgumentParser(description="Migra las imágenes en base64 de imagenes_camara a GridFS")
+    parser.add_argument("--lote", type=int, default=50, help="Documentos por lote")
+    parser.add_argument("--simular", action="store_true", help="Solo contar las imágenes por migrar")
+    args = parser.parse_args()
+
+    db = obtener_db()
+    asegurar_indices_imagenes(db)
+    migrar(db, args.lote, args.simular)
+
+if __name__ == "__main__":
+    main()
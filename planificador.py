@@ -0,0 +1,142 @@
+import random
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+
+# Registro de tareas del proceso, para exponer su estado (por ejemplo desde la API)
+TAREAS = {}
+_lock_registro = threading.Lock()
+
+class Tarea:
+    """Ejecuta una función en ticks alineados al reloj (múltiplos del intervalo desde la época).
+
+    A diferencia de `while True: trabajo(); sleep(intervalo)`, el horario no se desplaza
+    con la duración del trabajo. Si al llegar un tick la ejecución anterior sigue en curso,
+    el tick se salta y se cuenta. Se guarda la duración y el resultado de las últimas ejecuciones.
+    """
+
+    def __init__(self, nombre, funcion, intervalo_s, jitter_s=0, ejecutar_al_iniciar=False,
+                 max_historial=50):
+        if intervalo_s <= 0:
+            raise ValueError("El intervalo debe ser mayor que 0")
+        self.nombre = nombre
+        self.funcion = funcion
+        self.intervalo_s = intervalo_s
+        self.jitter_s = jitter_s
+        self.ejecutar_al_iniciar = ejecutar_al_iniciar
+        self.historial = deque(maxlen=max_historial)
+
+        self.ejecuciones = 0
+        self.errores = 0
+        self.saltos = 0
+        self.proximo_tick = None
+
+        self._en_curso = threading.Lock()
+        self._detener = threading.Event()
+        self._hilo = None
+
+    # --- CÁLCULO DE TICKS ---
+    def siguiente_tick(self, ahora=None):
+        """Próximo múltiplo del intervalo (en tiempo Unix) posterior a "ahora" """
+        ahora = time.time() if ahora is None else ahora
+        return (int(ahora // self.intervalo_s) + 1) * self.intervalo_s
+
+    # --- EJECUCIÓN ---
+    def _ejecutar(self, programado):
+        inicio = time.time()
+        registro = {
+            "programado": datetime.utcfromtimestamp(programado).isoformat() + "Z",
+            "inicio": datetime.utcfromtimestamp(inicio).isoformat() + "Z",
+            "retraso_s": round(inicio - programado, 3),
+        }
+        try:
+            self.funcion()
+            registro["resultado"] = "ok"
+        except Exception as e:
+            self.errores += 1
+            registro["resultado"] = "error"
+            registro["error"] = repr(e)
+            print(f"❌ Error en tarea '{self.nombre}': {e}")
+            traceback.print_exc()
+        finally:
+            registro["duracion_s"] = round(time.time() - inicio, 3)
+            self.ejecuciones += 1
+            self.historial.append(registro)
+            self._en_curso.release()
+
+    def disparar(self, programado=None):
+        """Lanza una ejecución en un hilo aparte; si la anterior sigue en curso, salta el tick"""
+        programado = time.time() if programado is None else programado
+        if not self._en_curso.acquire(blocking=False):
+            self.saltos += 1
+            print(f"⏭️ Tarea '{self.nombre}' sigue en ejecución, se salta el tick ({self.saltos} saltos)")
+            return False
+        hilo = threading.Thread(target=self._ejecutar, args=(programado,), name=f"tarea_{self.nombre}", daemon=True)
+        hilo.start()
+        return True
+
+    def _bucle(self):
+        if self.ejecutar_al_iniciar:
+            self.disparar()
+        previo = None
+        while not self._detener.is_set():
+            # Los ticks solo avanzan: si el reloj se atrasa (NTP) no se repite el último
+            tick = self.siguiente_tick()
+            if previo is not None:
+                tick = max(previo + self.intervalo_s, tick)
+            self.proximo_tick = tick
+            objetivo = tick + (random.uniform(0, self.jitter_s) if self.jitter_s else 0)
+            # La espera puede terminar antes de la hora (ajustes del reloj): se vuelve a esperar lo que falte
+            while not self._detener.is_set() and time.time() < objetivo:
+                self._detener.wait(objetivo - time.time())
+            if self._detener.is_set():
+                break
+            self.disparar(tick)
+            previo = tick
+
+    def iniciar(self):
+        if self._hilo is None or not self._hilo.is_alive():
+            self._detener.clear()
+            self._hilo = threading.Thread(target=self._bucle, name=f"planificador_{self.nombre}", daemon=True)
+            self._hilo.start()
+        return self
+
+    def detener(self):
+        self._detener.set()
+
+    def esperar(self):
+        """Bloquea el hilo actual mientras la tarea esté activa (permite Ctrl+C)"""
+        while self._hilo is not None and self._hilo.is_alive():
+            self._hilo.join(timeout=1)
+
+    # --- TELEMETRÍA ---
+    def estado(self):
+        duraciones = [r["duracion_s"] for r in self.historial]
+        return {
+            "nombre": self.nombre,
+            "intervalo_s": self.intervalo_s,
+            "en_curso": self._en_curso.locked(),
+            "proximo_tick": datetime.utcfromtimestamp(self.proximo_tick).isoformat() + "Z" if self.proximo_tick else None,
+            "ejecuciones": self.ejecuciones,
+            "errores": self.errores,
+            "saltos": self.saltos,
+            "duracion_media_s": round(sum(duraciones) / len(duraciones), 3) if duraciones else None,
+            "duracion_max_s": max(duraciones) if duraciones else None,
+            "historial": list(self.historial),
+        }
+
+def programar(nombre, funcion, intervalo_s, jitter_s=0, ejecutar_al_iniciar=False):
+    """Crea, registra e inicia una tarea periódica; si ya existe una con ese nombre se devuelve esa"""
+    with _lock_registro:
+        if nombre in TAREAS:
+            return TAREAS[nombre]
+        tarea = Tarea(nombre, funcion, intervalo_s, jitter_s, ejecutar_al_iniciar)
+        TAREAS[nombre] = tarea
+    print(f"🧵 Tarea '{nombre}' programada cada {intervalo_s:g} s")
+    return tarea.iniciar()
+
+def estado_tareas():
+    """Estado y telemetría de todas las tareas registradas en el proceso"""
+    return [tarea.estado() for tarea in TAREAS.values()]
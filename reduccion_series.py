@@ -0,0 +1,38 @@
+import numpy as np
+
+# Reducción de series largas para graficar (sin dependencias de Streamlit, la usa funciones_dashboard)
+
+def lttb(x, y, n_puntos):
+    """Largest-Triangle-Three-Buckets: índices de los n_puntos que conservan la forma de la serie.
+
+    El primer y el último punto se mantienen; en cada tramo intermedio se elige el punto que forma
+    el triángulo de mayor área con el punto elegido en el tramo anterior y el promedio del siguiente.
+    Las áreas de cada tramo se calculan de una vez con NumPy (solo se recorren los tramos).
+    """
+    n = len(x)
+    if n_puntos >= n or n_puntos < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # Límites de los n_puntos - 2 tramos intermedios y promedio de cada uno (con sumas acumuladas)
+    bordes = np.linspace(1, n - 1, n_puntos - 1).astype(np.int64)
+    suma_x = np.concatenate(([0.0], np.cumsum(x)))
+    suma_y = np.concatenate(([0.0], np.cumsum(y)))
+    largos = np.diff(bordes)
+    media_x = (suma_x[bordes[1:]] - suma_x[bordes[:-1]]) / largos
+    media_y = (suma_y[bordes[1:]] - suma_y[bordes[:-1]]) / largos
+    # El "siguiente" del último tramo es el último punto
+    media_x = np.append(media_x, x[-1])
+    media_y = np.append(media_y, y[-1])
+
+    indices = np.empty(n_puntos, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    anterior = 0
+    for i in range(n_puntos - 2):
+        inicio, fin = bordes[i], bordes[i + 1]
+        ax, ay = x[anterior], y[anterior]
+        areas = np.abs((ax - media_x[i + 1]) * (y[inicio:fin] - ay) - (ax - x[inicio:fin]) * (media_y[i + 1] - ay))
+        anterior = inicio + int(np.argmax(areas))
+        indices[i + 1] = anterior
+    return indices
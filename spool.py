@@ -0,0 +1,289 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import bson
+import requests
+from bson.errors import InvalidBSON, InvalidDocument
+from pymongo.errors import BulkWriteError, ConnectionFailure, DocumentTooLarge, DuplicateKeyError, WriteError
+
+# Cola local (SQLite) para las escrituras que no se pudieron hacer por falta de conexión.
+# Cada entrada tiene una clave de idempotencia que al reenviar se usa como _id (MongoDB) o
+# como cabecera Idempotency-Key (API), así un reenvío repetido nunca duplica datos
+SPOOL_MAX_MB = float(os.environ.get("SPOOL_MAX_MB", "200"))
+SPOOL_LOTE = int(os.environ.get("SPOOL_LOTE", "200"))
+SPOOL_REENVIO_S = int(os.environ.get("SPOOL_REENVIO_S", "30"))
+HTTP_TIMEOUT_S = float(os.environ.get("HTTP_TIMEOUT_S", "10"))
+# Una entrada que falla por otro motivo que la conexión se reintenta hasta este número de veces
+SPOOL_MAX_INTENTOS = int(os.environ.get("SPOOL_MAX_INTENTOS", "5"))
+
+# Errores que indican que el destino no está disponible (la entrada se guarda para reintentar)
+ERRORES_CONEXION = (ConnectionFailure, requests.ConnectionError, requests.Timeout)
+
+class DestinoNoDisponible(Exception):
+    """El destino respondió, pero no puede recibir la escritura ahora (ej. HTTP 5xx)"""
+
+# Al reenviar, estos errores detienen la cola hasta el próximo intento sin culpar a la entrada
+ERRORES_TRANSITORIOS = (*ERRORES_CONEXION, DestinoNoDisponible, ConnectionError, TimeoutError)
+# Estos no se arreglan reintentando (documento inválido, rechazado por la validación, destino desconocido):
+# la entrada pasa directo a la tabla de fallidas
+ERRORES_PERMANENTES = (BulkWriteError, WriteError, DocumentTooLarge, InvalidDocument, InvalidBSON, KeyError)
+
+class Spool:
+    """Cola persistente, ordenada y de tamaño acotado.
+
+    Las entradas se reenvían en el orden en que llegaron; si el destino no está disponible, el
+    reenvío se detiene ahí para no adelantar entradas posteriores. Una entrada que falla por un
+    error permanente, o más de `max_intentos` veces por otro motivo, se mueve a la tabla "fallidas"
+    (con el error) para que no bloquee la cola. Al superar el tamaño máximo se descartan las
+    más antiguas, dejando constancia en el log.
+    """
+
+    def __init__(self, ruta, max_mb=SPOOL_MAX_MB, max_intentos=SPOOL_MAX_INTENTOS):
+        self.ruta = ruta
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.max_intentos = max_intentos
+        self.descartadas = 0
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(ruta, check_same_thread=False, isolation_level=None)
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.execute("PRAGMA synchronous=NORMAL")
+        self._conexion.execute("""
+            CREATE TABLE IF NOT EXISTS pendientes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                clave TEXT UNIQUE NOT NULL,
+                destino TEXT NOT NULL,
+                carga BLOB NOT NULL,
+                bytes INTEGER NOT NULL,
+                creado REAL NOT NULL,
+                intentos INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._conexion.execute("""
+            CREATE TABLE IF NOT EXISTS fallidas (
+                seq INTEGER PRIMARY KEY,
+                clave TEXT NOT NULL,
+                destino TEXT NOT NULL,
+                carga BLOB NOT NULL,
+                creado REAL NOT NULL,
+                intentos INTEGER NOT NULL,
+                error TEXT NOT NULL,
+                fallido REAL NOT NULL
+            )
+        """)
+        self._bytes = self._conexion.execute("SELECT COALESCE(SUM(bytes), 0) FROM pendientes").fetchone()[0]
+
+    def agregar(self, destino, clave, carga):
+        """Guarda una escritura pendiente; una clave repetida se ignora"""
+        datos = bson.encode(carga)
+        with self._lock:
+            cursor = self._conexion.execute(
+                "INSERT OR IGNORE INTO pendientes (clave, destino, carga, bytes, creado) VALUES (?, ?, ?, ?, ?)",
+                (str(clave), destino, datos, len(datos), time.time())
+            )
+            if cursor.rowcount:
+                self._bytes += len(datos)
+                self._recortar()
+
+    def _recortar(self):
+        # Descarta las entradas más antiguas mientras se supere el tamaño máximo (siempre queda la última)
+        while self._bytes > self.max_bytes:
+            fila = self._conexion.execute("SELECT seq, bytes FROM pendientes ORDER BY seq LIMIT 1").fetchone()
+            total = self._conexion.execute("SELECT COUNT(*) FROM pendientes").fetchone()[0]
+            if fila is None or total <= 1:
+                break
+            self._conexion.execute("DELETE FROM pendientes WHERE seq = ?", fila[:1])
+            self._bytes -= fila[1]
+            self.descartadas += 1
+            print(f"⚠️ Spool lleno ({self.ruta}): se descarta la entrada más antigua ({self.descartadas} descartadas)")
+
+    def pendientes(self):
+        with self._lock:
+            return self._conexion.execute("SELECT COUNT(*) FROM pendientes").fetchone()[0]
+
+    def fallidas(self):
+        """Entradas apartadas por errores que no se arreglan reintentando: [(clave, destino, carga, intentos, error)]"""
+        with self._lock:
+            filas = self._conexion.execute(
+                "SELECT clave, destino, carga, intentos, error FROM fallidas ORDER BY seq"
+            ).fetchall()
+        return [(clave, destino, bson.decode(carga), intentos, error) for clave, destino, carga, intentos, error in filas]
+
+    def reenviar(self, manejadores, tamano_lote=SPOOL_LOTE):
+        """Reenvía las entradas en orden y en lotes; devuelve cuántas se confirmaron.
+
+        `manejadores` asocia cada destino a una función que recibe [(clave, carga), ...] y escribe
+        todo el grupo, o lanza una excepción: ERRORES_TRANSITORIOS si el destino no está disponible
+        (el reenvío se detiene) y cualquier otra si alguna entrada no se puede escribir.
+        """
+        enviadas = 0
+        while True:
+            with self._lock:
+                filas = self._conexion.execute(
+                    "SELECT seq, clave, destino, carga, bytes FROM pendientes ORDER BY seq LIMIT ?", (tamano_lote,)
+                ).fetchall()
+            if not filas:
+                break
+
+            # Entradas consecutivas con el mismo destino se escriben juntas
+            grupos = []
+            for fila in filas:
+                if grupos and grupos[-1][0] == fila[2]:
+                    grupos[-1][1].append(fila)
+                else:
+                    grupos.append((fila[2], [fila]))
+
+            for destino, grupo in grupos:
+                # Si el grupo falla por otro motivo que la conexión, se reenvía de a una entrada para aislar la culpable
+                partes = [grupo]
+                while partes:
+                    parte = partes.pop(0)
+                    try:
+                        self._escribir(manejadores, destino, parte)
+                    except ERRORES_TRANSITORIOS as e:
+                        print(f"⚠️ Reenvío del spool detenido ({destino}, {self.pendientes()} pendientes): {e}")
+                        return enviadas
+                    except Exception as e:
+                        if len(parte) > 1:
+                            partes = [[fila] for fila in parte] + partes
+                        elif not self._registrar_fallo(parte[0], e):
+                            print(f"⚠️ Reenvío del spool detenido ({destino}, {self.pendientes()} pendientes): {e}")
+                            return enviadas
+                        continue
+                    self._confirmar(parte)
+                    enviadas += len(parte)
+
+        if enviadas:
+            print(f"📤 Spool: {enviadas} escrituras reenviadas ({self.ruta})")
+        return enviadas
+
+    @staticmethod
+    def _escribir(manejadores, destino, grupo):
+        manejadores[destino]([(clave, bson.decode(carga)) for _, clave, _, carga, _ in grupo])
+
+    def _registrar_fallo(self, fila, error):
+        """Cuenta el intento fallido de una entrada; si el error es permanente o se agotaron los intentos,
+        la mueve a "fallidas" y devuelve True (el reenvío puede seguir con las siguientes)"""
+        seq, clave, destino, _, bytes_ = fila
+        with self._lock:
+            self._conexion.execute("UPDATE pendientes SET intentos = intentos + 1 WHERE seq = ?", (seq,))
+            fila_intentos = self._conexion.execute("SELECT intentos FROM pendientes WHERE seq = ?", (seq,)).fetchone()
+            if fila_intentos is None:
+                # Ya se descartó por tamaño mientras se reenviaba
+                return True
+            intentos = fila_intentos[0]
+            if not isinstance(error, ERRORES_PERMANENTES) and intentos < self.max_intentos:
+                return False
+            self._conexion.execute("BEGIN")
+            self._conexion.execute(
+                "INSERT OR REPLACE INTO fallidas (seq, clave, destino, carga, creado, intentos, error, fallido) "
+                "SELECT seq, clave, destino, carga, creado, intentos, ?, ? FROM pendientes WHERE seq = ?",
+                (f"{type(error).__name__}: {error}", time.time(), seq)
+            )
+            self._conexion.execute("DELETE FROM pendientes WHERE seq = ?", (seq,))
+            self._conexion.execute("COMMIT")
+            self._bytes -= bytes_
+        print(f"❌ Spool ({self.ruta}): la entrada {clave} ({destino}) pasa a fallidas tras {intentos} intentos: {error}")
+        return True
+
+    def _confirmar(self, grupo):
+        with self._lock:
+            self._conexion.execute(
+                f"DELETE FROM pendientes WHERE seq IN ({','.join('?' * len(grupo))})", [fila[0] for fila in grupo]
+            )
+            self._bytes -= sum(fila[4] for fila in grupo)
+
+    def cerrar(self):
+        with self._lock:
+            self._conexion.close()
+
+# ====================================================
+# DESTINOS
+# ====================================================
+def insertar_documentos(coleccion, documentos):
+    """insert_many sin orden que ignora los _id ya existentes (escrituras repetidas por un reenvío)"""
+    try:
+        coleccion.insert_many(documentos, ordered=False)
+    except BulkWriteError as e:
+        otros = [error for error in e.details.get("writeErrors", []) if error.get("code") != 11000]
+        if otros:
+            raise
+
+def manejador_mongo(db):
+    """Destino "mongo": cada carga es {"coleccion", "doc"} con el _id ya asignado"""
+    def escribir(entradas):
+        # Se agrupan por colección conservando el orden
+        grupos = []
+        for _, carga in entradas:
+            if grupos and grupos[-1][0] == carga["coleccion"]:
+                grupos[-1][1].append(carga["doc"])
+            else:
+                grupos.append((carga["coleccion"], [carga["doc"]]))
+        for coleccion, documentos in grupos:
+            insertar_documentos(db[coleccion], documentos)
+    return escribir
+
+def insertar_o_encolar(spool, db, coleccion, doc):
+    """Inserta el documento (que debe traer _id); si MongoDB no responde, queda en el spool.
+
+    Mientras haya pendientes las escrituras nuevas van directo al spool, para no adelantarse
+    a las anteriores. Devuelve True si se escribió en MongoDB.
+    """
+    if spool.pendientes() == 0:
+        try:
+            db[coleccion].insert_one(doc)
+            return True
+        except DuplicateKeyError:
+            return True
+        except ConnectionFailure as e:
+            print(f"⚠️ MongoDB no disponible, la escritura en {coleccion} queda en el spool: {e}")
+    spool.agregar("mongo", doc["_id"], {"coleccion": coleccion, "doc": doc})
+    return False
+
+def enviar_http(url, datos, clave, tiempo=None):
+    """POST a la API con clave de idempotencia; devuelve la respuesta si fue aceptada o rechazada
+    por el cliente (4xx), o lanza una excepción si la API no está disponible"""
+    cabeceras = {"Idempotency-Key": str(clave)}
+    if tiempo is not None:
+        # Hora original del registro, para que un reenvío tardío no quede con la hora de llegada
+        cabeceras["X-Tiempo-Original"] = tiempo
+    respuesta = requests.post(url, json=datos, headers=cabeceras, timeout=HTTP_TIMEOUT_S)
+    if respuesta.status_code >= 500 or respuesta.status_code in (408, 429):
+        raise DestinoNoDisponible(f"HTTP {respuesta.status_code}")
+    return respuesta
+
+def manejador_http(entradas):
+    """Destino "http": cada carga es {"url", "datos", "tiempo"}"""
+    for clave, carga in entradas:
+        respuesta = enviar_http(carga["url"], carga["datos"], clave, carga.get("tiempo"))
+        if respuesta.status_code >= 400:
+            # Un error del cliente no se arregla reintentando: se descarta para no bloquear la cola
+            print(f"⚠️ Registro {clave} rechazado por la API ({respuesta.status_code}), se descarta: {respuesta.text}")
+
+def enviar_o_encolar(spool, url, datos):
+    """POST a la API; si no está disponible queda en el spool con su hora original.
+
+    Devuelve la respuesta, o None si la escritura quedó pendiente.
+    """
+    clave = uuid.uuid4().hex
+    if spool.pendientes() == 0:
+        try:
+            return enviar_http(url, datos, clave)
+        except (*ERRORES_CONEXION, DestinoNoDisponible) as e:
+            print(f"⚠️ API no disponible, el registro queda en el spool: {e}")
+    tiempo = datetime.utcnow().isoformat() + "Z"
+    spool.agregar("http", clave, {"url": url, "datos": datos, "tiempo": tiempo})
+    return None
+
+# Un spool por archivo y proceso
+_spools = {}
+_lock_spools = threading.Lock()
+
+def obtener_spool(ruta):
+    with _lock_spools:
+        if ruta not in _spools:
+            _spools[ruta] = Spool(ruta)
+        return _spools[ruta]
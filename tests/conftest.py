@@ -0,0 +1,10 @@
+"""
+Pruebas del repo (pytest). Desde la raíz del repo:
+    pip install pytest mongomock
+    python -m pytest -q tests
+"""
+import sys
+from pathlib import Path
+
+# Los módulos del repo (database, spool, planificador, app...) se importan desde la raíz
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
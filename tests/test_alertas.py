@@ -0,0 +1,151 @@
+import json
+
+import requests
+
+from app.alertas import (
+    DespachadorAlertas, SinkMemoria, SinkTelegram, LARGO_MAX_MENSAJE, configurar_despachador, enviar_alerta
+)
+
+def despachador(sink, **kwargs):
+    # Sin espera entre reintentos para que las pruebas no tarden
+    return DespachadorAlertas(sink, espera_max=0, **kwargs)
+
+def test_agrupa_mensajes_pendientes_en_uno():
+    sink = SinkMemoria()
+    d = despachador(sink)
+    for mensaje in ["a", "b", "c"]:
+        d.encolar(mensaje)
+    d.iniciar()
+    d.esperar()
+    d.detener(timeout=2)
+    assert sink.mensajes == ["a\n\nb\n\nc"]
+    assert d.estado()["enviadas"] == 3
+
+def test_agrupacion_respeta_largo_maximo():
+    sink = SinkMemoria()
+    d = despachador(sink)
+    largo = LARGO_MAX_MENSAJE // 2
+    for letra in "xyz":
+        d.encolar(letra * largo)
+    d.iniciar()
+    d.esperar()
+    d.detener(timeout=2)
+    # Dos mensajes de la mitad del máximo más el separador ya no caben juntos: se conserva el orden
+    assert [m[0] for m in sink.mensajes] == ["x", "y", "z"]
+    assert all(len(m) <= LARGO_MAX_MENSAJE for m in sink.mensajes)
+
+def test_reintenta_hasta_enviar():
+    sink = SinkMemoria(fallar_veces=2)
+    d = despachador(sink, reintentos=3)
+    d.encolar("hola")
+    d.iniciar()
+    d.esperar()
+    d.detener(timeout=2)
+    assert sink.mensajes == ["hola"]
+    assert d.estado()["enviadas"] == 1
+    assert d.estado()["fallidas"] == 0
+
+def test_agotar_reintentos_cuenta_fallida_y_sigue():
+    sink = SinkMemoria(fallar_veces=3)
+    d = despachador(sink, reintentos=3)
+    d.encolar("perdida")
+    d.iniciar()
+    d.esperar()
+    # La alerta que agotó los reintentos no bloquea a las siguientes
+    d.encolar("siguiente")
+    d.esperar()
+    d.detener(timeout=2)
+    assert sink.mensajes == ["siguiente"]
+    assert d.estado()["fallidas"] == 1
+    assert d.estado()["enviadas"] == 1
+
+def test_cola_llena_descarta_sin_bloquear():
+    d = despachador(SinkMemoria(), max_cola=2)
+    assert d.encolar("1") and d.encolar("2")
+    assert not d.encolar("3")
+    assert d.estado()["descartadas"] == 1
+    assert d.estado()["pendientes"] == 2
+
+def test_configurar_despachador_reemplaza_el_compartido():
+    sink = SinkMemoria()
+    d = configurar_despachador(despachador(sink))
+    try:
+        enviar_alerta("cambio de fase")
+        d.esperar()
+        assert sink.mensajes == ["cambio de fase"]
+    finally:
+        d.detener(timeout=2)
+
+def test_mensaje_que_no_cabe_no_pasa_el_tamano_de_la_cola():
+    sink = SinkMemoria()
+    d = despachador(sink, max_cola=2)
+    largo = LARGO_MAX_MENSAJE // 2
+    assert d.encolar("x" * largo) and d.encolar("y" * largo)
+    assert d._tomar_lote(d.cola.get()) == ["x" * largo]
+    # El que no cupo queda aparte: la cola no pasa de su máximo
+    assert d.encolar("z") and d.encolar("w") and not d.encolar("v")
+    assert d.cola.qsize() == 2
+    assert d.estado()["pendientes"] == 3
+    d.cola.task_done()  # El primer lote se da por enviado
+    d.iniciar()
+    d.esperar()
+    d.detener(timeout=2)
+    assert [m[0] for m in sink.mensajes] == ["y"]
+    assert sink.mensajes[0].endswith("\n\nz\n\nw")
+
+# --- Telegram, con respuestas simuladas ---
+def respuesta(codigo, cuerpo=None):
+    r = requests.Response()
+    r.status_code = codigo
+    r._content = json.dumps(cuerpo or {"ok": codigo < 400}).encode()
+    r.url = "https://api.telegram.org/bot/sendMessage"
+    return r
+
+class SesionFalsa:
+    def __init__(self, *respuestas):
+        self.respuestas = list(respuestas)
+        self.enviados = []
+
+    def post(self, url, data, timeout):
+        self.enviados.append(data)
+        siguiente = self.respuestas.pop(0)
+        if isinstance(siguiente, Exception):
+            raise siguiente
+        return siguiente
+
+def telegram(*respuestas):
+    sink = SinkTelegram("token", "chat")
+    sink.sesion = SesionFalsa(*respuestas)
+    return sink
+
+def enviar_con_despachador(sink, mensaje, reintentos=3):
+    d = despachador(sink, reintentos=reintentos)
+    d.encolar(mensaje)
+    d.iniciar()
+    d.esperar()
+    d.detener(timeout=2)
+    return d.estado()
+
+def test_telegram_reintenta_red_5xx_y_429():
+    sink = telegram(
+        requests.ConnectionError("sin red"),
+        respuesta(502),
+        respuesta(429, {"ok": False, "parameters": {"retry_after": 0}}),
+        respuesta(200),
+    )
+    estado = enviar_con_despachador(sink, "alerta", reintentos=4)
+    assert estado["enviadas"] == 1
+    assert len(sink.sesion.enviados) == 4
+
+def test_telegram_no_reintenta_errores_permanentes():
+    sink = telegram(respuesta(403, {"ok": False, "description": "bot was blocked"}), respuesta(200))
+    estado = enviar_con_despachador(sink, "alerta", reintentos=4)
+    assert estado["fallidas"] == 1
+    assert len(sink.sesion.enviados) == 1
+
+def test_telegram_markdown_invalido_se_envia_como_texto():
+    sink = telegram(respuesta(400, {"ok": False, "description": "can't parse entities"}), respuesta(200))
+    estado = enviar_con_despachador(sink, "nivel_ph *bajo\n\ntemp_alta")
+    assert estado["enviadas"] == 1
+    assert [envio.get("parse_mode") for envio in sink.sesion.enviados] == ["Markdown", None]
+    assert sink.sesion.enviados[1]["text"] == "nivel_ph *bajo\n\ntemp_alta"
@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+
+from database import asegurar_indices_registro_comida, obtener_estado_alimentacion, obtener_historial_alimentacion
+
+T0 = datetime(2025, 5, 1, 12, 0)
+
+@pytest.fixture
+def db():
+    db = mongomock.MongoClient().db
+    asegurar_indices_registro_comida(db)
+    db.registro_comida.insert_many(
+        [{"id_dispositivo": "r1", "tiempo": T0 + timedelta(hours=6 * k)} for k in range(5)]
+        + [{"id_dispositivo": "r2", "tiempo": T0 - timedelta(days=2)}]
+        + [{"tiempo": T0}]  # Registro antiguo sin dispositivo
+    )
+    return db
+
+def test_estado_por_dispositivo_en_una_agregacion(db):
+    estado = obtener_estado_alimentacion(db=db)
+    assert estado == {
+        "r1": {"ultima": T0 + timedelta(hours=24), "n": 5},
+        "r2": {"ultima": T0 - timedelta(days=2), "n": 1},
+    }
+    # Solo los dispositivos pedidos; los que no tienen eventos no aparecen
+    assert obtener_estado_alimentacion(["r2", "r3"], db=db) == {"r2": {"ultima": T0 - timedelta(days=2), "n": 1}}
+
+def test_historial_mas_reciente_primero_y_en_hora_de_chile(db):
+    historial = obtener_historial_alimentacion(["r1", "r2"], limit=3, db=db)
+    assert [h["id_dispositivo"] for h in historial] == ["r1", "r1", "r1"]
+    tiempos = [h["tiempo"] for h in historial]
+    assert tiempos == sorted(tiempos, reverse=True)
+    # 12:00 UTC del 2 de mayo son las 08:00 en Chile (UTC-4)
+    assert tiempos[0].strftime("%Y-%m-%d %H:%M") == "2025-05-02 08:00"
+    assert len(obtener_historial_alimentacion(["r2"], db=db)) == 1
@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta
+
+import mongomock
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.anomalias import DetectorAnomalias
+
+T0 = datetime(2026, 1, 1)
+
+def historial(n=300, semilla=0):
+    # Dos dispositivos con lecturas intercaladas, un pico, un salto brusco y un tramo congelado
+    rng = np.random.default_rng(semilla)
+    filas = []
+    for disp, desfase in (("r1", 0), ("r2", 30)):
+        ph = 7 + rng.normal(0, 0.05, n)
+        temperatura = 22 + rng.normal(0, 0.2, n)
+        oxigeno = 8 + rng.normal(0, 0.3, n)
+        ph[120] = 9.5
+        temperatura[200:] += 30
+        oxigeno[240:270] = 8.123
+        for k in range(n):
+            filas.append({
+                "id_dispositivo": disp,
+                "tiempo": T0 + timedelta(minutes=10 * k, seconds=desfase),
+                "ph": float(ph[k]), "temperatura": float(temperatura[k]), "oxigeno": float(oxigeno[k]),
+            })
+    return pd.DataFrame(filas)
+
+def resumen(anomalias):
+    return sorted(
+        (a["id_dispositivo"], a["variable"], a["tipo"], a["tiempo"], round(a["valor"], 9), round(a["z"], 9))
+        for a in anomalias
+    )
+
+def mezclar_tipos(df):
+    # Como llegan a veces por la API: números como texto, booleanos, textos, nulos, NaN y enteros
+    df = df.astype({"ph": object, "temperatura": object, "oxigeno": object})
+    df.loc[df.index[::7], "ph"] = df.loc[df.index[::7], "ph"].map(lambda v: f"{v:.4f}")
+    df.loc[df.index[5::40], "ph"] = True
+    df.loc[df.index[9::60], "temperatura"] = "error"
+    df.loc[df.index[11::45], "temperatura"] = None
+    df.loc[df.index[13::35], "oxigeno"] = float("nan")
+    df.loc[df.index[2::25], "oxigeno"] = df.loc[df.index[2::25], "oxigeno"].map(round)
+    return df
+
+@pytest.mark.parametrize("tipos_mezclados", [False, True])
+def test_streaming_y_lote_detectan_lo_mismo(tipos_mezclados):
+    df = mezclar_tipos(historial()) if tipos_mezclados else historial()
+    en_lote = DetectorAnomalias().procesar_lote("dominio_terreno", df)
+
+    streaming = DetectorAnomalias()
+    en_vivo = []
+    for lectura in df.sort_values("tiempo").to_dict("records"):
+        en_vivo.extend(streaming.procesar("dominio_terreno", lectura))
+
+    assert en_lote
+    assert resumen(en_lote) == resumen(en_vivo)
+
+def test_detecta_los_tres_tipos():
+    anomalias = DetectorAnomalias().procesar_lote("dominio_terreno", historial())
+    tipos = {(a["id_dispositivo"], a["variable"], a["tipo"]) for a in anomalias}
+    assert ("r1", "ph", "pico") in tipos
+    assert ("r1", "oxigeno", "valor_congelado") in tipos
+    pico = next(a for a in anomalias if a["tipo"] == "pico" and a["variable"] == "ph" and a["id_dispositivo"] == "r1")
+    assert pico["tiempo"] == T0 + timedelta(minutes=1200)
+
+def test_cambio_brusco_por_tasa_por_minuto():
+    # Sin evaluar picos (que tienen prioridad), el salto de 30 °C en 10 minutos supera los 2 °C/min
+    anomalias = DetectorAnomalias(min_muestras=10**6).procesar_lote("dominio_terreno", historial())
+    bruscos = [a for a in anomalias if a["tipo"] == "cambio_brusco" and a["variable"] == "temperatura"]
+    assert [(a["id_dispositivo"], a["tiempo"]) for a in bruscos] == [
+        ("r1", T0 + timedelta(minutes=2000)), ("r2", T0 + timedelta(minutes=2000, seconds=30))
+    ]
+    assert bruscos[0]["tasa_por_min"] > 2.0
+
+def test_valor_congelado_se_informa_una_vez_por_tramo():
+    anomalias = DetectorAnomalias(repeticiones=5).procesar_lote("dominio_terreno", historial())
+    congelados = [a for a in anomalias if a["tipo"] == "valor_congelado" and a["id_dispositivo"] == "r1"]
+    assert len(congelados) == 1
+
+def test_ewma_coincide_con_la_formula():
+    detector = DetectorAnomalias(alfa=0.2)
+    valores = [1.0, 3.0, 2.0, 5.0]
+    for k, v in enumerate(valores):
+        detector.procesar("d", {"id_dispositivo": "r1", "ph": v, "tiempo": T0 + timedelta(minutes=k)})
+    media, varianza = valores[0], 0.0
+    for v in valores[1:]:
+        diferencia = v - media
+        media += 0.2 * diferencia
+        varianza = 0.8 * (varianza + 0.2 * diferencia ** 2)
+    fila = detector.fila("d", "r1", "ph")
+    assert np.isclose(detector.media[fila], media)
+    assert np.isclose(detector.varianza[fila], varianza)
+
+def test_tabla_crece_y_vaciar_escribe_pendientes():
+    detector = DetectorAnomalias(capacidad=2, min_muestras=1, umbral_z=0.5)
+    for k in range(5):
+        detector.procesar("d", {"id_dispositivo": f"r{k}", "ph": 7.0, "oxigeno": 8.0, "tiempo": T0})
+    assert len(detector) == 10
+    assert len(detector.n) >= 10
+    for k, ph in enumerate([7.0, 7.1, 6.9, 12.0]):
+        detector.procesar("d", {"id_dispositivo": "r0", "ph": ph, "tiempo": T0 + timedelta(minutes=k + 1)})
+    col = mongomock.MongoClient().db.anomalias
+    escritas = detector.vaciar(col)
+    assert escritas == col.count_documents({}) > 0
+    assert detector.estado()["pendientes"] == 0
@@ -0,0 +1,65 @@
+import json
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+
+import archivar_parquet
+from archivar_parquet import archivar_dominio, ARCHIVO_ESTADO
+from database import leer_lecturas
+
+DOMINIO = "dominio_terreno"
+INICIO = datetime(2024, 1, 10)
+CORTE = datetime(2024, 3, 1)
+
+@pytest.fixture
+def db():
+    db = mongomock.MongoClient().db
+    db[DOMINIO].insert_many([
+        {"tiempo": INICIO + timedelta(hours=6 * i), "id_dispositivo": "esp32_1", "temperatura": float(i)}
+        for i in range(20)
+    ])
+    return db
+
+def archivos(directorio):
+    return sorted((directorio / f"dominio={DOMINIO}").glob("mes=*/*.parquet"))
+
+def test_archivar_dos_veces_no_duplica_lecturas(db, tmp_path):
+    assert archivar_dominio(db, DOMINIO, CORTE, tmp_path, lote=8) == 20
+    # Una ejecución interrumpida antes de guardar la marca vuelve a escribir lo mismo en otros archivos
+    (tmp_path / ARCHIVO_ESTADO).unlink()
+    assert archivar_dominio(db, DOMINIO, CORTE, tmp_path, lote=8) == 20
+    assert len(archivos(tmp_path)) == 6
+
+    # Documentos en dos archivos y también en MongoDB
+    df = leer_lecturas(DOMINIO, db=db, directorio=tmp_path)
+    assert len(df) == 20
+    assert df["temperatura"].tolist() == [float(i) for i in range(20)]
+
+    # Solo en el archivo (como tras un --borrar interrumpido y repetido)
+    assert archivar_dominio(db, DOMINIO, CORTE, tmp_path, lote=8, borrar=True) == 20
+    assert db[DOMINIO].count_documents({}) == 0
+    df = leer_lecturas(DOMINIO, db=db, directorio=tmp_path)
+    assert len(df) == 20
+    assert df["tiempo"].is_monotonic_increasing
+
+def test_la_marca_avanza_con_cada_archivo(db, tmp_path, monkeypatch):
+    escribir = archivar_parquet.escribir_lote
+    escritos = []
+
+    def escribir_y_cortar(dominio, documentos, directorio):
+        if escritos:
+            raise KeyboardInterrupt
+        escritos.append(documentos[-1]["tiempo"])
+        return escribir(dominio, documentos, directorio)
+
+    monkeypatch.setattr(archivar_parquet, "escribir_lote", escribir_y_cortar)
+    with pytest.raises(KeyboardInterrupt):
+        archivar_dominio(db, DOMINIO, CORTE, tmp_path, lote=8)
+    estado = json.loads((tmp_path / ARCHIVO_ESTADO).read_text())
+    assert estado[DOMINIO] == escritos[0].isoformat()
+
+    # La siguiente ejecución sigue desde la marca: solo repite la lectura de ese instante
+    monkeypatch.setattr(archivar_parquet, "escribir_lote", escribir)
+    assert archivar_dominio(db, DOMINIO, CORTE, tmp_path, lote=8) == 13
+    assert len(leer_lecturas(DOMINIO, db=db, directorio=tmp_path)) == 20
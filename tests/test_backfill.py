@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+
+import mongomock
+import numpy as np
+import pytest
+
+import app.sesion_onnx as sesion_onnx
+from app import backfill_clasificaciones as backfill
+from app import servicio_clasificaciones as svc
+from database import obtener_clasificaciones
+
+T0 = datetime(2025, 1, 1)
+N_LECTURAS = 60
+
+@pytest.fixture
+def db(monkeypatch):
+    cliente = mongomock.MongoClient()
+    monkeypatch.setattr(backfill, "_client", cliente)
+    # El grafo optimizado no se guarda junto al modelo del repo
+    monkeypatch.setattr(sesion_onnx, "ORT_CACHE_OPTIMIZADO", False)
+    # Un segundo dominio con el mismo modelo, para comprobar que no se pisan
+    monkeypatch.setitem(svc.CATALOGO.configuracion, "dominio_laboratorio", svc.CATALOGO.configuracion[svc.COLECCION_DATOS])
+    db = cliente[svc.DB_NAME]
+    rng = np.random.default_rng(0)
+    for dominio in (svc.COLECCION_DATOS, "dominio_laboratorio"):
+        db[dominio].insert_many([
+            {"id_dispositivo": "reactor_1", "tiempo": T0 + timedelta(hours=k),
+             "ph": float(7 + rng.normal(0, 0.1)), "oxigeno": float(8 + rng.normal(0, 0.5))}
+            for k in range(N_LECTURAS)
+        ])
+    backfill.asegurar_indice(db)
+    return db
+
+def test_repetir_el_backfill_no_duplica(db):
+    ventanas = N_LECTURAS - svc.SEQ_LEN + 1
+    primero = backfill.backfill_dispositivo("reactor_1", svc.COLECCION_DATOS)
+    assert primero["ventanas"] == ventanas
+    assert primero["escritos"] == ventanas
+
+    segundo = backfill.backfill_dispositivo("reactor_1", svc.COLECCION_DATOS)
+    assert segundo["ventanas"] == ventanas
+    assert db[svc.COLECCION_CLASIFICACIONES].count_documents({}) == ventanas
+    fines = db[svc.COLECCION_CLASIFICACIONES].distinct("fin_ventana")
+    assert min(fines) == T0 + timedelta(hours=svc.SEQ_LEN - 1)
+    assert max(fines) == T0 + timedelta(hours=N_LECTURAS - 1)
+
+def test_mismo_dispositivo_en_otro_dominio_no_se_pisa(db):
+    backfill.backfill_dispositivo("reactor_1", svc.COLECCION_DATOS)
+    backfill.backfill_dispositivo("reactor_1", "dominio_laboratorio")
+    ventanas = N_LECTURAS - svc.SEQ_LEN + 1
+    clasificaciones = db[svc.COLECCION_CLASIFICACIONES]
+    assert clasificaciones.count_documents({"dominio": svc.COLECCION_DATOS}) == ventanas
+    assert clasificaciones.count_documents({"dominio": "dominio_laboratorio"}) == ventanas
+
+def test_backfill_no_aparece_en_las_consultas_en_vivo(db):
+    backfill.backfill_dispositivo("reactor_1", svc.COLECCION_DATOS)
+    assert obtener_clasificaciones("reactor_1", db=db) == []
+    reconstruidas = obtener_clasificaciones("reactor_1", db=db, origen="backfill", limit=100)
+    assert len(reconstruidas) == N_LECTURAS - svc.SEQ_LEN + 1
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+from bson import ObjectId
+
+from database import CacheLecturas
+
+DOMINIO = "dominio_terreno"
+
+def lectura(disp, tiempo, ph):
+    return {"_id": ObjectId(), "id_dispositivo": disp, "tiempo": tiempo, "ph": ph, "temperatura": 20.0}
+
+@pytest.fixture
+def db():
+    db = mongomock.MongoClient().db
+    ahora = datetime.utcnow()
+    db[DOMINIO].insert_many([lectura("r1", ahora - timedelta(minutes=10 * k), 7.0) for k in range(1, 13)])
+    return db
+
+def test_refresco_incremental_solo_lee_lo_nuevo(db):
+    cache = CacheLecturas(DOMINIO, retencion_dias=1, intervalo_s=0, solape_s=60, db=db)
+    assert cache.refrescar() == 12
+    assert len(cache.vista()) == 12
+
+    ahora = datetime.utcnow()
+    db[DOMINIO].insert_many([lectura("r1", ahora, 7.5), lectura("r2", ahora, 6.8)])
+    # Solo se piden las lecturas desde la última (menos el solape, que la incluye), no la ventana completa
+    assert cache.refrescar() == 3
+    vista = cache.vista()
+    assert len(vista) == 14
+    assert vista["tiempo"].is_monotonic_increasing
+    assert "_id" not in vista.columns
+    assert vista[vista["id_dispositivo"] == "r2"]["ph"].tolist() == [pytest.approx(6.8)]
+
+def test_solape_no_duplica_y_conserva_lecturas_con_la_misma_hora(db):
+    cache = CacheLecturas(DOMINIO, retencion_dias=1, intervalo_s=0, solape_s=3600, db=db)
+    cache.refrescar()
+    ultima = db[DOMINIO].find_one(sort=[("tiempo", -1)])
+    # Una lectura manual con la misma hora y dispositivo que la última del sensor es otra lectura
+    db[DOMINIO].insert_one(lectura("r1", ultima["tiempo"], 8.2))
+    # El solape vuelve a leer la última hora: lo repetido se descarta por _id
+    assert cache.refrescar() > 1
+    vista = cache.vista()
+    assert len(vista) == 13
+    assert sorted(vista["ph"].round(1).tolist())[-1] == pytest.approx(8.2)
+
+def test_intervalo_minimo_entre_refrescos(db):
+    cache = CacheLecturas(DOMINIO, retencion_dias=1, intervalo_s=3600, db=db)
+    assert cache.refrescar() == 12
+    db[DOMINIO].insert_one(lectura("r1", datetime.utcnow(), 7.1))
+    # Otra sesión que pide refrescar enseguida usa lo que ya hay
+    assert cache.refrescar() == 0
+    assert len(cache.vista()) == 12
+    assert cache.refrescar(forzar=True) >= 1
+    assert len(cache.vista()) == 13
+
+def test_vista_filtra_fechas_y_dispositivos(db):
+    db[DOMINIO].insert_one(lectura("r2", datetime.utcnow(), 6.9))
+    cache = CacheLecturas(DOMINIO, retencion_dias=1, intervalo_s=0, db=db)
+    assert cache.cubre(datetime.now().date())
+    assert not cache.cubre((datetime.now() - timedelta(days=3)).date())
+    assert set(cache.vista(dispositivos=["r2"])["id_dispositivo"]) == {"r2"}
+    assert len(cache.vista(fecha_inicio=datetime.now().date() + timedelta(days=2))) == 0
@@ -0,0 +1,64 @@
+import numpy as np
+
+from app.calidad_datos import filtro_hampel, imputar_huecos, limpiar_ventanas, recortar_limites, calidad_a_dict
+
+def test_recorta_al_rango_fisico():
+    x = np.array([[-1.0, 7.0, 15.0, np.nan]])
+    recortado, mascara = recortar_limites(x, 0.0, 14.0)
+    np.testing.assert_array_equal(recortado[0, :3], [0.0, 7.0, 14.0])
+    assert np.isnan(recortado[0, 3])
+    assert mascara.tolist() == [[True, False, True, False]]
+
+def test_hampel_reemplaza_atipico_por_mediana():
+    x = np.array([[7.0, 7.1, 6.9, 7.0, 12.0, 7.1, 6.9, 7.0, 7.1, 7.0]])
+    filtrado, atipicos = filtro_hampel(x, media_ventana=3, n_sigmas=3)
+    assert atipicos.tolist() == [[False] * 4 + [True] + [False] * 5]
+    assert filtrado[0, 4] == np.median([7.1, 6.9, 7.0, 12.0, 7.1, 6.9, 7.0])
+    np.testing.assert_array_equal(np.delete(filtrado, 4), np.delete(x, 4))
+
+def test_hampel_serie_constante_sin_atipicos():
+    x = np.full((1, 12), 7.0)
+    _, atipicos = filtro_hampel(x, media_ventana=3)
+    assert not atipicos.any()
+
+def test_imputa_huecos_cortos_y_deja_los_largos():
+    nan = np.nan
+    x = np.array([
+        [1.0, nan, nan, 4.0, 5.0, 6.0],    # Hueco interior de 2: interpolación lineal
+        [nan, 2.0, 3.0, 4.0, 5.0, nan],    # Bordes: se repite el valor más cercano
+        [1.0, nan, nan, nan, nan, 6.0],    # Hueco de 4 > máximo: queda sin imputar
+    ])
+    imputado, mascara = imputar_huecos(x, max_hueco=3)
+    np.testing.assert_allclose(imputado[0], [1, 2, 3, 4, 5, 6])
+    np.testing.assert_allclose(imputado[1], [2, 2, 3, 4, 5, 5])
+    assert np.isnan(imputado[2, 1:5]).all()
+    assert mascara.sum(axis=1).tolist() == [2, 2, 0]
+
+def test_limpiar_ventanas_y_calidad():
+    nan = np.nan
+    largo = 12
+    ph = 7.0 + np.random.default_rng(0).normal(0, 0.05, largo)
+    esperado_ph = ph.copy()
+    ph[3] = 20.0                          # Fuera de rango: se recorta a 14 y luego es atípico
+    oxigeno = np.linspace(8, 9, largo)
+    oxigeno[[5, 6]] = nan                 # Hueco corto: se interpola
+    hora = np.linspace(0, 1, largo)       # Columna extra que no se limpia
+    buena = np.column_stack([ph, oxigeno, hora])
+    sin_datos = buena.copy()
+    sin_datos[:, 1] = nan                 # Sin oxígeno: ventana inválida
+
+    ventanas, validas, calidad = limpiar_ventanas(np.stack([buena, sin_datos]), ("ph", "oxigeno"))
+
+    assert validas.tolist() == [True, False]
+    # El atípico queda en la mediana de su ventana; el resto no cambia
+    np.testing.assert_allclose(np.delete(ventanas[0, :, 0], 3), np.delete(esperado_ph, 3))
+    assert abs(ventanas[0, 3, 0] - np.median(esperado_ph)) < 0.1
+    np.testing.assert_allclose(ventanas[0, :, 1], np.linspace(8, 9, largo))
+    np.testing.assert_array_equal(ventanas[:, :, 2], np.stack([hora, hora]))
+
+    fila = calidad_a_dict(calidad[0])
+    assert fila == {
+        "calidad": round(1 - 3 / (2 * largo), 4),
+        "faltantes": 2, "imputados": 2, "recortados": 1, "atipicos": 1,
+    }
+    assert calidad_a_dict(calidad[1])["faltantes"] == largo
@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta
+
+import mongomock
+
+from database import obtener_clasificaciones, obtener_dispositivos_clasificados, obtener_timeline_fases
+
+T0 = datetime(2025, 1, 1)
+
+def clasificacion(disp, fase, minutos, dominio=None, **extra):
+    doc = {"id_dispositivo": disp, "fase": fase, "timestamp": T0 + timedelta(minutes=minutos), **extra}
+    if dominio is not None:
+        doc["dominio"] = dominio
+    return doc
+
+def test_filtro_por_dominio_y_origen():
+    db = mongomock.MongoClient().db
+    db.clasificaciones.insert_many([
+        clasificacion("reactor_1", "crecimiento", 0),  # anterior a los dominios: es del dominio por defecto
+        clasificacion("reactor_1", "crecimiento", 10, "dominio_terreno"),
+        clasificacion("reactor_1", "declive", 20, "dominio_laboratorio"),
+        clasificacion("reactor_1", "estacionaria", 30, "dominio_terreno"),
+        clasificacion("reactor_1", "declive", 5, "dominio_terreno", origen="backfill"),
+        clasificacion("reactor_2", "crecimiento", 0, "dominio_laboratorio"),
+    ])
+    assert obtener_dispositivos_clasificados(db=db) == ["reactor_1", "reactor_2"]
+    assert obtener_dispositivos_clasificados(db=db, dominio="dominio_terreno") == ["reactor_1"]
+
+    # Sin dominio se mezclan los dos; con dominio solo las suyas (y las antiguas sin dominio en el por defecto)
+    assert [d["fase"] for d in obtener_clasificaciones("reactor_1", db=db)] == \
+        ["crecimiento", "crecimiento", "declive", "estacionaria"]
+    assert [d["fase"] for d in obtener_clasificaciones("reactor_1", db=db, dominio="dominio_terreno")] == \
+        ["crecimiento", "crecimiento", "estacionaria"]
+    assert [d["fase"] for d in obtener_clasificaciones("reactor_1", db=db, dominio="dominio_laboratorio")] == ["declive"]
+    assert [d["fase"] for d in obtener_clasificaciones("reactor_1", db=db, origen="backfill",
+                                                       dominio="dominio_terreno")] == ["declive"]
+
+    tramos = obtener_timeline_fases("reactor_1", db=db, dominio="dominio_terreno")
+    assert [(t["fase"], t["n"]) for t in tramos] == [("crecimiento", 2), ("estacionaria", 1)]
@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+
+from database import obtener_comparacion_manual
+
+DOMINIO = "dominio_terreno"
+DIA = datetime(2025, 3, 10)
+
+@pytest.fixture
+def db():
+    db = mongomock.MongoClient().db
+    db[DOMINIO].insert_many([
+        # Día 1: sensores (uno con un valor no numérico) y dos registros manuales
+        {"id_dispositivo": "r1", "tiempo": DIA + timedelta(hours=1), "ph": 7.0, "temperatura": 20.0},
+        {"id_dispositivo": "r1", "tiempo": DIA + timedelta(hours=2), "ph": 7.2, "temperatura": 22.0},
+        {"id_dispositivo": "r1", "tiempo": DIA + timedelta(hours=3), "ph": "error"},
+        {"id_dispositivo": "r1", "tiempo": DIA + timedelta(hours=4), "manual": True, "temperatura": 21.5},
+        {"id_dispositivo": "r1", "tiempo": DIA + timedelta(hours=5), "manual": True, "ph": 7.5, "temperatura": 30.0},
+        # Día 2: solo sensores
+        {"id_dispositivo": "r1", "tiempo": DIA + timedelta(days=1, hours=1), "ph": 6.9},
+        # Otro dispositivo, que no debe mezclarse
+        {"id_dispositivo": "r2", "tiempo": DIA + timedelta(hours=1), "ph": 9.9, "manual": True},
+    ])
+    return db
+
+def test_un_registro_por_dia_con_promedio_y_primer_manual(db):
+    # mongomock no implementa la zona horaria de $dateToString: los días se agrupan en UTC
+    filas = obtener_comparacion_manual("r1", DOMINIO, zona=None, db=db)
+    assert [f["fecha"] for f in filas] == ["2025-03-10", "2025-03-11"]
+
+    dia1, dia2 = filas
+    assert (dia1["n_sensor"], dia1["n_manual"]) == (3, 2)
+    assert dia1["ph_sensor"] == pytest.approx(7.1)
+    assert dia1["temperatura_sensor"] == pytest.approx(21.0)
+    # De cada variable vale el primer valor manual del día que la tiene
+    assert dia1["ph_manual"] == 7.5
+    assert dia1["temperatura_manual"] == 21.5
+    assert dia1["ph_diff"] == pytest.approx(0.4)
+    assert dia1["oxigeno_manual"] is None and dia1["oxigeno_diff"] is None
+
+    assert (dia2["n_sensor"], dia2["n_manual"]) == (1, 0)
+    assert dia2["ph_sensor"] == pytest.approx(6.9)
+    assert dia2.get("ph_manual") is None and dia2["ph_diff"] is None
+
+def test_rango_de_fechas(db):
+    filas = obtener_comparacion_manual("r1", DOMINIO, desde=DIA + timedelta(days=1), hasta=DIA + timedelta(days=2),
+                                       zona=None, db=db)
+    assert [f["fecha"] for f in filas] == ["2025-03-11"]
+    assert obtener_comparacion_manual("r3", DOMINIO, zona=None, db=db) == []
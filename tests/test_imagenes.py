@@ -0,0 +1,82 @@
+import base64
+from datetime import datetime, timedelta
+from io import BytesIO
+
+import cv2
+import gridfs
+import mongomock
+import mongomock.gridfs
+import numpy as np
+import pytest
+from PIL import Image
+
+import database
+import migrar_imagenes
+from database import (
+    abrir_imagen, crear_miniatura, guardar_imagen, obtener_miniatura,
+    COLECCION_IMAGENES, MINIATURA_LADO_MAX, PROYECCION_GALERIA
+)
+from migrar_imagenes import migrar
+
+T0 = datetime(2025, 1, 1)
+
+class BucketMongomock(gridfs.GridFSBucket):
+    # mongomock no acepta el timeout de operación que GridFSBucket pasa en cada consulta
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._timeout = None
+
+@pytest.fixture
+def db(monkeypatch):
+    mongomock.gridfs.enable_gridfs_integration()
+    monkeypatch.setattr(database, "GridFSBucket", BucketMongomock)
+    monkeypatch.setattr(migrar_imagenes, "GridFSBucket", BucketMongomock)
+    return mongomock.MongoClient()["biorreactor_app"]
+
+def jpeg(ancho=640, alto=480, semilla=0):
+    imagen = np.random.default_rng(semilla).integers(0, 255, (alto, ancho, 3), dtype=np.uint8)
+    return cv2.imencode(".jpg", imagen)[1].tobytes()
+
+def tamano(archivo):
+    return Image.open(BytesIO(archivo) if isinstance(archivo, bytes) else archivo).size
+
+def test_imagen_en_gridfs_con_miniatura_en_el_documento(db):
+    datos = jpeg()
+    _id = guardar_imagen(datos, T0, "jpg", {"ancho": 640, "alto": 480}, db=db)
+    doc = db[COLECCION_IMAGENES].find_one({"_id": _id})
+    # El documento solo tiene metadatos y la miniatura; los bytes están en GridFS
+    assert "imagen" not in doc and doc["bytes"] == len(datos)
+    assert max(tamano(doc["miniatura"])) == MINIATURA_LADO_MAX
+    assert len(doc["miniatura"]) < len(datos)
+    assert abrir_imagen(doc, db=db).read() == datos
+
+def test_galeria_no_trae_la_imagen_y_genera_la_miniatura_que_falta(db):
+    _id = guardar_imagen(jpeg(), T0, "jpg", db=db)
+    db[COLECCION_IMAGENES].update_one({"_id": _id}, {"$unset": {"miniatura": ""}})
+    doc = db[COLECCION_IMAGENES].find_one({"_id": _id}, PROYECCION_GALERIA)
+    miniatura = obtener_miniatura(doc, db=db)
+    assert max(tamano(miniatura)) == MINIATURA_LADO_MAX
+    # Queda guardada para la próxima vez
+    assert db[COLECCION_IMAGENES].find_one({"_id": _id})["miniatura"] == miniatura
+
+def test_miniatura_mantiene_la_proporcion():
+    assert tamano(crear_miniatura(jpeg(1920, 1080))) == (MINIATURA_LADO_MAX, MINIATURA_LADO_MAX * 1080 // 1920)
+
+def test_migracion_de_base64_a_gridfs_es_repetible(db):
+    originales = [jpeg(160, 120, semilla=k) for k in range(5)]
+    db[COLECCION_IMAGENES].insert_many([
+        {"tiempo": T0 + timedelta(hours=k), "imagen": base64.b64encode(datos).decode()}
+        for k, datos in enumerate(originales)
+    ])
+    # Los documentos antiguos se leen igual antes de migrar
+    legado = db[COLECCION_IMAGENES].find_one({}, PROYECCION_GALERIA)
+    assert abrir_imagen(legado, db=db).read() == originales[0]
+
+    assert migrar(db, lote=2) == 5
+    assert migrar(db) == 0
+    assert db[COLECCION_IMAGENES].count_documents({"imagen": {"$exists": True}}) == 0
+    assert db["imagenes.files"].count_documents({}) == 5
+    for doc in db[COLECCION_IMAGENES].find().sort("tiempo", 1):
+        k = int((doc["tiempo"] - T0).total_seconds() // 3600)
+        assert abrir_imagen(doc, db=db).read() == originales[k]
+        assert "miniatura" in doc and doc["formato"] == "jpg"
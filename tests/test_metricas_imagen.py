@@ -0,0 +1,50 @@
+import cv2
+import numpy as np
+import pytest
+
+from capturar_imagenes import calcular_metricas, parsear_roi
+from database import CAMPOS_METRICAS_IMAGEN, METRICAS_DOMINIO, campos_dominio
+
+def frame_color(bgr, alto=40, ancho=60):
+    return np.full((alto, ancho, 3), bgr, dtype=np.uint8)
+
+def test_campos_son_los_del_dominio_de_la_camara():
+    metricas = calcular_metricas(frame_color((0, 200, 0)))
+    assert tuple(metricas) == CAMPOS_METRICAS_IMAGEN
+    assert campos_dominio(METRICAS_DOMINIO) == CAMPOS_METRICAS_IMAGEN
+
+def test_frame_verde_uniforme():
+    m = calcular_metricas(frame_color((0, 200, 0)))
+    assert m["h_media"] == pytest.approx(60, abs=0.5)
+    assert m["fraccion_verde"] == 1.0
+    assert m["fraccion_color"] == 1.0
+    assert m["verde_relativo"] == 1.0
+    assert m["verde_media"] == 200
+    # Sin bordes: nitidez nula, turbidez máxima y un solo tono en el histograma
+    assert m["nitidez"] == 0
+    assert m["turbidez"] == 1.0
+    assert m["contraste"] == 0
+    assert m["entropia_tono"] == 0
+
+def test_frame_gris_no_tiene_tono():
+    m = calcular_metricas(frame_color((128, 128, 128)))
+    assert m["h_media"] is None
+    assert m["tono_dominante"] is None
+    assert m["fraccion_color"] == 0
+    assert m["fraccion_verde"] == 0
+
+def test_tono_medio_es_circular():
+    # Mitad con tono 2 y mitad con tono 178 (rojos a ambos lados del 0): la media es ~0, no ~90
+    hsv = np.zeros((20, 20, 3), dtype=np.uint8)
+    hsv[:, :10] = (2, 255, 255)
+    hsv[:, 10:] = (178, 255, 255)
+    m = calcular_metricas(cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR))
+    assert min(m["h_media"], 180 - m["h_media"]) < 1
+
+def test_region_de_interes():
+    frame = frame_color((128, 128, 128))
+    frame[:, 30:] = (0, 200, 0)
+    assert calcular_metricas(frame)["fraccion_verde"] == 0.5
+    assert calcular_metricas(frame, parsear_roi("0.5,0,0.5,1"))["fraccion_verde"] == 1.0
+    with pytest.raises(ValueError):
+        parsear_roi("0.5,0,0,1")
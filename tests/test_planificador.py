@@ -0,0 +1,97 @@
+import threading
+import time
+
+import pytest
+
+import planificador
+from planificador import Tarea
+
+def test_siguiente_tick_alineado_al_reloj():
+    tarea = Tarea("prueba", lambda: None, intervalo_s=60)
+    # Múltiplos del intervalo desde la época, siempre estrictamente posteriores a "ahora"
+    assert tarea.siguiente_tick(ahora=3600.0) == 3660
+    assert tarea.siguiente_tick(ahora=3601.5) == 3660
+    assert tarea.siguiente_tick(ahora=3659.999) == 3660
+    # El horario no depende de cuándo terminó la ejecución anterior
+    assert Tarea("otra", lambda: None, intervalo_s=3600).siguiente_tick(ahora=7265.0) == 10800
+
+def test_intervalo_invalido():
+    with pytest.raises(ValueError):
+        Tarea("prueba", lambda: None, intervalo_s=0)
+
+def test_salta_tick_si_la_ejecucion_anterior_sigue():
+    liberar = threading.Event()
+    tarea = Tarea("lenta", lambda: liberar.wait(5), intervalo_s=60)
+
+    assert tarea.disparar(programado=time.time())
+    # Mientras la primera ejecución sigue en curso, los ticks siguientes se saltan
+    assert not tarea.disparar(programado=time.time())
+    assert not tarea.disparar(programado=time.time())
+    assert tarea.saltos == 2
+    assert tarea.estado()["en_curso"]
+
+    liberar.set()
+    for _ in range(100):
+        if tarea.ejecuciones:
+            break
+        time.sleep(0.01)
+    assert tarea.ejecuciones == 1
+    assert not tarea.estado()["en_curso"]
+    # Terminada la anterior, el siguiente tick vuelve a ejecutarse
+    assert tarea.disparar(programado=time.time())
+
+def test_error_se_registra_y_libera_la_tarea():
+    hecho = threading.Event()
+
+    def falla():
+        hecho.set()
+        raise RuntimeError("fallo")
+
+    tarea = Tarea("falla", falla, intervalo_s=60)
+    assert tarea.disparar(programado=time.time())
+    hecho.wait(1)
+    for _ in range(100):
+        if tarea.ejecuciones:
+            break
+        time.sleep(0.01)
+    assert tarea.errores == 1
+    assert tarea.historial[-1]["resultado"] == "error"
+    assert "fallo" in tarea.historial[-1]["error"]
+    assert not tarea.estado()["en_curso"]
+
+class RelojFalso:
+    """Reemplaza time.time y la espera de la tarea: cada espera despierta un poco antes de lo pedido"""
+
+    def __init__(self, ahora, tarea, ajustes=None):
+        self.ahora = ahora
+        self.tarea = tarea
+        self.ajustes = ajustes or {}  # {n° de disparo: segundos que salta el reloj después}
+        self.disparos = []
+
+    def time(self):
+        return self.ahora
+
+    def wait(self, espera):
+        self.ahora += espera - 0.001 if espera > 0.01 else espera
+        return self.tarea._detener.is_set()
+
+    def disparar(self, programado=None):
+        self.disparos.append((programado, self.ahora))
+        self.ahora += self.ajustes.get(len(self.disparos), 0)
+        if len(self.disparos) == 4:
+            self.tarea.detener()
+        return True
+
+def test_ticks_no_se_repiten_aunque_el_reloj_retroceda_o_despierte_antes(monkeypatch):
+    tarea = Tarea("reloj", lambda: None, intervalo_s=60)
+    # Tras el segundo disparo el reloj se atrasa 30 s (ajuste NTP) y tras el tercero se adelanta 150 s
+    reloj = RelojFalso(3590.0, tarea, ajustes={2: -30, 3: 150})
+    monkeypatch.setattr(planificador.time, "time", reloj.time)
+    monkeypatch.setattr(tarea._detener, "wait", reloj.wait)
+    monkeypatch.setattr(tarea, "disparar", reloj.disparar)
+
+    tarea._bucle()
+    ticks = [tick for tick, _ in reloj.disparos]
+    assert ticks == [3600, 3660, 3720, 3900]
+    # Nunca se dispara antes de la hora programada
+    assert all(ahora >= tick for tick, ahora in reloj.disparos)
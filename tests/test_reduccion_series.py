@@ -0,0 +1,52 @@
+import math
+
+import numpy as np
+import pytest
+
+from reduccion_series import lttb
+
+def lttb_referencia(x, y, n_puntos):
+    """Implementación original de LTTB (Steinarsson, 2013), punto a punto"""
+    n = len(x)
+    cada = (n - 2) / (n_puntos - 2)
+    elegidos = [0]
+    a = 0
+    for i in range(n_puntos - 2):
+        inicio_sig = math.floor((i + 1) * cada) + 1
+        fin_sig = min(math.floor((i + 2) * cada) + 1, n)
+        media_x = sum(x[inicio_sig:fin_sig]) / (fin_sig - inicio_sig)
+        media_y = sum(y[inicio_sig:fin_sig]) / (fin_sig - inicio_sig)
+
+        inicio = math.floor(i * cada) + 1
+        fin = math.floor((i + 1) * cada) + 1
+        area_max, elegido = -1.0, inicio
+        for j in range(inicio, fin):
+            area = abs((x[a] - media_x) * (y[j] - y[a]) - (x[a] - x[j]) * (media_y - y[a])) * 0.5
+            if area > area_max:
+                area_max, elegido = area, j
+        elegidos.append(elegido)
+        a = elegido
+    elegidos.append(n - 1)
+    return np.array(elegidos)
+
+@pytest.mark.parametrize("n, n_puntos", [(1000, 100), (997, 37), (5000, 1500), (50, 3)])
+def test_coincide_con_la_implementacion_de_referencia(n, n_puntos):
+    rng = np.random.default_rng(n)
+    x = np.sort(rng.uniform(0, 1e6, n))
+    y = np.cumsum(rng.normal(0, 1, n))
+    y[n // 3] += 25  # Un pico que la reducción debe conservar
+    indices = lttb(x, y, n_puntos)
+    np.testing.assert_array_equal(indices, lttb_referencia(x.tolist(), y.tolist(), n_puntos))
+    assert n // 3 in indices
+
+def test_conserva_extremos_y_orden():
+    x = np.arange(10000, dtype=float)
+    y = np.sin(x / 100)
+    indices = lttb(x, y, 200)
+    assert len(indices) == 200
+    assert indices[0] == 0 and indices[-1] == len(x) - 1
+    assert np.all(np.diff(indices) > 0)
+
+def test_series_cortas_no_se_reducen():
+    assert lttb([1, 2, 3], [4, 5, 6], 10).tolist() == [0, 1, 2]
+    assert lttb(range(100), range(100), 2).tolist() == list(range(100))
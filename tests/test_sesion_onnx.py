@@ -0,0 +1,63 @@
+import os
+
+import numpy as np
+import pytest
+
+onnx = pytest.importorskip("onnx")  # Solo para construir modelos de prueba; el servicio no lo necesita
+from onnx import TensorProto, helper, numpy_helper
+
+from app.sesion_onnx import crear_sesion, inferir, ruta_cache_optimizado, huella_modelo
+
+def guardar_modelo(ruta, peso):
+    # Y = X * W, con W como inicializador: dos pesos distintos son dos modelos distintos del mismo tamaño
+    grafo = helper.make_graph(
+        [helper.make_node("Mul", ["X", "W"], ["Y"])], "escala",
+        [helper.make_tensor_value_info("X", TensorProto.FLOAT, [None, 3])],
+        [helper.make_tensor_value_info("Y", TensorProto.FLOAT, [None, 3])],
+        [numpy_helper.from_array(np.full(3, peso, dtype=np.float32), "W")],
+    )
+    modelo = helper.make_model(grafo, opset_imports=[helper.make_opsetid("", 13)])
+    modelo.ir_version = 8
+    onnx.save(modelo, str(ruta))
+
+def en_cache(ruta):
+    return sorted(p.name for p in (ruta.parent / ".cache").glob("*.onnx"))
+
+def test_cache_se_reutiliza_mientras_el_modelo_no_cambia(tmp_path):
+    ruta = tmp_path / "modelo.onnx"
+    guardar_modelo(ruta, 2.0)
+    entrada = np.ones((1, 3), dtype=np.float32)
+
+    assert inferir(crear_sesion(ruta, usar_cache=True), entrada).tolist() == [[2.0, 2.0, 2.0]]
+    cache = ruta_cache_optimizado(ruta, "todo")
+    assert cache.exists() and huella_modelo(ruta) in cache.name
+    modificado = cache.stat().st_mtime_ns
+    assert inferir(crear_sesion(ruta, usar_cache=True), entrada).tolist() == [[2.0, 2.0, 2.0]]
+    assert cache.stat().st_mtime_ns == modificado
+
+def test_modelo_reemplazado_con_la_misma_fecha_invalida_la_cache(tmp_path):
+    ruta = tmp_path / "modelo.onnx"
+    guardar_modelo(ruta, 2.0)
+    entrada = np.ones((1, 3), dtype=np.float32)
+    crear_sesion(ruta, usar_cache=True)
+    anterior = en_cache(ruta)
+
+    # Reemplazo conservando tamaño y fecha de modificación (como cp -p o rsync -a)
+    fecha = os.stat(ruta).st_mtime_ns
+    guardar_modelo(ruta, 3.0)
+    os.utime(ruta, ns=(fecha, fecha))
+
+    assert inferir(crear_sesion(ruta, usar_cache=True), entrada).tolist() == [[3.0, 3.0, 3.0]]
+    # Queda solo el grafo del modelo nuevo
+    assert len(en_cache(ruta)) == 1 and en_cache(ruta) != anterior
+
+def test_cache_por_nivel_de_optimizacion(tmp_path):
+    ruta = tmp_path / "modelo.onnx"
+    guardar_modelo(ruta, 2.0)
+    # "todo" se guarda como "extendido" (lo dependiente del hardware se aplica al cargar)
+    assert ruta_cache_optimizado(ruta, "todo") == ruta_cache_optimizado(ruta, "extendido")
+    assert ruta_cache_optimizado(ruta, "basico") != ruta_cache_optimizado(ruta, "extendido")
+    # Sin caché, o con nivel "ninguno", no se escribe nada en disco
+    crear_sesion(ruta, usar_cache=False)
+    crear_sesion(ruta, nivel="ninguno", usar_cache=True)
+    assert en_cache(ruta) == []
@@ -0,0 +1,168 @@
+import mongomock
+import pytest
+import requests
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, ServerSelectionTimeoutError
+
+import spool as modulo_spool
+from spool import Spool, insertar_o_encolar, manejador_mongo, enviar_o_encolar, manejador_http
+
+@pytest.fixture
+def cola(tmp_path):
+    s = Spool(str(tmp_path / "spool.sqlite3"))
+    yield s
+    s.cerrar()
+
+class ColeccionCaida:
+    def insert_one(self, doc):
+        raise ServerSelectionTimeoutError("sin conexión")
+
+class DbCaida:
+    def __getitem__(self, nombre):
+        return ColeccionCaida()
+
+class DbCaidaLote:
+    def __getitem__(self, nombre):
+        coleccion = ColeccionCaida()
+        coleccion.insert_many = lambda documentos, ordered: coleccion.insert_one(documentos[0])
+        return coleccion
+
+def test_reenvio_en_orden_y_agrupado_por_destino(cola):
+    recibidos = []
+    manejadores = {
+        "a": lambda entradas: recibidos.append(("a", [c["i"] for _, c in entradas])),
+        "b": lambda entradas: recibidos.append(("b", [c["i"] for _, c in entradas])),
+    }
+    for i, destino in enumerate("aabaa"):
+        cola.agregar(destino, f"k{i}", {"i": i})
+    assert cola.reenviar(manejadores) == 5
+    # Solo se agrupan entradas consecutivas del mismo destino: el orden global se conserva
+    assert recibidos == [("a", [0, 1]), ("b", [2]), ("a", [3, 4])]
+    assert cola.pendientes() == 0
+
+def test_fallo_detiene_el_reenvio_sin_adelantar_entradas(cola):
+    recibidos = []
+    caido = {"valor": True}
+
+    def destino_b(entradas):
+        if caido["valor"]:
+            raise ConnectionError("caído")
+        recibidos.extend(c["i"] for _, c in entradas)
+
+    manejadores = {"a": lambda e: recibidos.extend(c["i"] for _, c in e), "b": destino_b}
+    for i, destino in enumerate("abab"):
+        cola.agregar(destino, f"k{i}", {"i": i})
+    assert cola.reenviar(manejadores, tamano_lote=10) == 1
+    assert recibidos == [0]
+    assert cola.pendientes() == 3
+
+    caido["valor"] = False
+    assert cola.reenviar(manejadores) == 3
+    assert recibidos == [0, 1, 2, 3]
+
+def test_entrada_envenenada_pasa_a_fallidas_sin_bloquear_la_cola(cola):
+    recibidos = []
+
+    def destino_a(entradas):
+        # Validación del esquema: un documento inválido rechaza el lote (los demás sí se escriben)
+        recibidos.extend(c["i"] for _, c in entradas if c["i"] != 1)
+        if any(c["i"] == 1 for _, c in entradas):
+            raise BulkWriteError({"writeErrors": [{"index": 0, "code": 121, "errmsg": "Document failed validation"}]})
+
+    for i in range(4):
+        cola.agregar("a", f"k{i}", {"i": i})
+    cola.agregar("desconocido", "k4", {"i": 4})
+    cola.agregar("a", "k5", {"i": 5})
+    assert cola.reenviar({"a": destino_a}) == 4
+    assert cola.pendientes() == 0
+    # El lote se reintentó de a una: lo válido queda escrito (una sola vez gracias al _id) y en orden
+    assert sorted(set(recibidos)) == [0, 2, 3, 5]
+    fallidas = cola.fallidas()
+    assert [(clave, destino) for clave, destino, *_ in fallidas] == [("k1", "a"), ("k4", "desconocido")]
+    assert fallidas[0][2] == {"i": 1}
+    assert fallidas[0][4].startswith("BulkWriteError")
+    assert fallidas[1][4].startswith("KeyError")
+
+def test_error_desconocido_se_reintenta_hasta_el_maximo(tmp_path):
+    s = Spool(str(tmp_path / "intentos.sqlite3"), max_intentos=2)
+    recibidos = []
+
+    def destino(entradas):
+        for _, c in entradas:
+            if c["i"] == 0:
+                raise ValueError("respuesta inesperada")
+            recibidos.append(c["i"])
+
+    s.agregar("a", "k0", {"i": 0})
+    s.agregar("a", "k1", {"i": 1})
+    # El primer fallo detiene la cola (puede ser pasajero); al agotar los intentos la entrada se aparta
+    assert s.reenviar({"a": destino}) == 0
+    assert s.pendientes() == 2 and s.fallidas() == []
+    assert s.reenviar({"a": destino}) == 1
+    assert recibidos == [1]
+    assert [(clave, intentos) for clave, _, _, intentos, _ in s.fallidas()] == [("k0", 2)]
+    s.cerrar()
+
+def test_sin_conexion_no_cuenta_como_intento_fallido(tmp_path):
+    s = Spool(str(tmp_path / "caido.sqlite3"), max_intentos=1)
+    s.agregar("mongo", "k0", {"coleccion": "lecturas", "doc": {"_id": 1}})
+    for _ in range(3):
+        assert s.reenviar({"mongo": manejador_mongo(DbCaidaLote())}) == 0
+    assert s.pendientes() == 1 and s.fallidas() == []
+    s.cerrar()
+
+def test_clave_repetida_se_ignora(cola):
+    cola.agregar("a", "misma", {"i": 1})
+    cola.agregar("a", "misma", {"i": 2})
+    assert cola.pendientes() == 1
+
+def test_tamano_maximo_descarta_las_mas_antiguas(tmp_path):
+    s = Spool(str(tmp_path / "chico.sqlite3"), max_mb=0.01)  # ~10 KB
+    recibidos = []
+    for i in range(20):
+        s.agregar("a", f"k{i}", {"i": i, "relleno": "x" * 1000})
+    assert s.descartadas > 0
+    s.reenviar({"a": lambda e: recibidos.extend(c["i"] for _, c in e)})
+    # Sobreviven las más recientes, en orden
+    assert recibidos == list(range(20 - len(recibidos), 20))
+    s.cerrar()
+
+def test_mongo_sin_conexion_encola_y_el_reenvio_es_idempotente(cola):
+    db = mongomock.MongoClient().db
+    doc = {"_id": ObjectId(), "valor": 1}
+    assert not insertar_o_encolar(cola, DbCaida(), "lecturas", doc)
+    # Con pendientes, lo nuevo también va al spool para no adelantarse
+    otro = {"_id": ObjectId(), "valor": 2}
+    assert not insertar_o_encolar(cola, db, "lecturas", otro)
+    assert cola.pendientes() == 2
+
+    # Un reenvío interrumpido que ya había escrito el primero: el _id repetido se ignora
+    db.lecturas.insert_one(dict(doc))
+    assert cola.reenviar({"mongo": manejador_mongo(db)}) == 2
+    assert sorted(d["valor"] for d in db.lecturas.find()) == [1, 2]
+    assert insertar_o_encolar(cola, db, "lecturas", {"_id": ObjectId(), "valor": 3})
+
+def test_api_sin_conexion_encola_con_clave_y_hora_original(cola, monkeypatch):
+    enviados = []
+
+    class Respuesta:
+        status_code = 201
+        text = ""
+
+    def post_caido(url, json, headers, timeout):
+        raise requests.ConnectionError("sin red")
+
+    def post_ok(url, json, headers, timeout):
+        enviados.append((url, json, headers))
+        return Respuesta()
+
+    monkeypatch.setattr(modulo_spool.requests, "post", post_caido)
+    assert enviar_o_encolar(cola, "http://api/registro", {"evento": "comida"}) is None
+    assert cola.pendientes() == 1
+
+    monkeypatch.setattr(modulo_spool.requests, "post", post_ok)
+    assert cola.reenviar({"http": manejador_http}) == 1
+    url, datos, cabeceras = enviados[0]
+    assert (url, datos) == ("http://api/registro", {"evento": "comida"})
+    assert len(cabeceras["Idempotency-Key"]) == 32
+    assert cabeceras["X-Tiempo-Original"].endswith("Z")
@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+
+import mongomock
+
+from app.umbrales import MotorUmbrales, ALARMA, PENDIENTE
+
+T0 = datetime(2026, 1, 1, 12, 0)
+
+def motor(duracion_min_s=60, histeresis=0.1):
+    # pH en [6, 9]; con 10 % de histéresis se recupera recién dentro de [6.3, 8.7]
+    notificados = []
+    m = MotorUmbrales({"por_defecto": {"ph": [6.0, 9.0]}}, histeresis=histeresis,
+                      duracion_min_s=duracion_min_s, notificar=notificados.append)
+    return m, notificados
+
+def lectura(ph, segundos, disp="r1"):
+    return {"id_dispositivo": disp, "ph": ph, "tiempo": T0 + timedelta(seconds=segundos)}
+
+def test_alarma_solo_tras_la_duracion_minima():
+    m, notificados = motor()
+    assert m.evaluar("dominio_terreno", lectura(9.5, 0)) == []
+    assert m.estado()[0]["estado"] == PENDIENTE
+    assert m.evaluar("dominio_terreno", lectura(9.6, 30)) == []
+    eventos = m.evaluar("dominio_terreno", lectura(9.7, 60))
+    assert [e["tipo"] for e in eventos] == [ALARMA]
+    assert eventos[0]["inicio"] == T0
+    assert len(notificados) == 1
+
+def test_pico_breve_no_genera_alarma():
+    m, notificados = motor()
+    m.evaluar("dominio_terreno", lectura(9.5, 0))
+    # Vuelve al rango antes de cumplir la duración mínima: se descarta sin alerta
+    m.evaluar("dominio_terreno", lectura(8.0, 30))
+    m.evaluar("dominio_terreno", lectura(9.5, 40))
+    assert m.evaluar("dominio_terreno", lectura(9.5, 90)) == []
+    assert notificados == []
+
+def test_histeresis_evita_alertas_en_el_borde():
+    m, notificados = motor(duracion_min_s=0)
+    assert [e["tipo"] for e in m.evaluar("dominio_terreno", lectura(9.1, 0))] == [ALARMA]
+    # Dentro del rango pero fuera del rango reducido: sigue en alarma
+    for i, ph in enumerate([8.9, 9.05, 8.8, 9.1, 8.75], start=1):
+        assert m.evaluar("dominio_terreno", lectura(ph, i)) == []
+    assert m.estado()[0]["estado"] == ALARMA
+    eventos = m.evaluar("dominio_terreno", lectura(8.6, 10))
+    assert [e["tipo"] for e in eventos] == ["recuperado"]
+    assert m.estado() == []
+    assert len(notificados) == 2
+
+def test_rangos_por_dispositivo_pisan_a_los_del_dominio():
+    m = MotorUmbrales({
+        "por_defecto": {"ph": [6.0, 9.0]},
+        "dominios": {"dominio_lab": {"ph": [5.0, 8.0]}},
+        "dispositivos": {"r2": {"ph": [7.0, 10.0]}},
+    }, histeresis=0, duracion_min_s=0, notificar=lambda m: None)
+    assert m.rangos("dominio_terreno", "r1")["ph"][:2] == (6.0, 9.0)
+    assert m.rangos("dominio_lab", "r1")["ph"][:2] == (5.0, 8.0)
+    assert m.rangos("dominio_lab", "r2")["ph"][:2] == (7.0, 10.0)
+
+def test_valores_no_numericos_se_ignoran():
+    m, _ = motor(duracion_min_s=0)
+    assert m.evaluar("dominio_terreno", lectura("error", 0)) == []
+    assert m.evaluar("dominio_terreno", lectura(True, 1)) == []
+    assert m.estado() == []
+
+def test_persistir_y_recuperar_estado():
+    col = mongomock.MongoClient().db.estado_umbrales
+    m, _ = motor(duracion_min_s=0)
+    m.evaluar("dominio_terreno", lectura(9.5, 0))
+    assert m.persistir(col) == 1
+    # Sin cambios no se escribe nada
+    assert m.persistir(col) == 0
+
+    nuevo, notificados = motor(duracion_min_s=0)
+    nuevo.cargar_estado(col)
+    assert nuevo.estado()[0]["estado"] == ALARMA
+    # Tras el reinicio sigue en alarma: la misma condición no vuelve a notificar
+    assert nuevo.evaluar("dominio_terreno", lectura(9.6, 5)) == []
+    assert notificados == []